@@ -0,0 +1,195 @@
+import numpy as np
+import pandas as pd
+import runner
+import simulation
+import stats
+
+
+# Name of the parameter with the number of shuffles in each trial, for the simulations in runner.SIMULATIONS that can be run adaptively
+MAX_SHUFFLE_PARAMETERS: dict = {
+    "riffle_shuffle": "max_n_riffle_shuffle",
+    "a_shuffle": "max_n_shuffle",
+    "overhand_shuffle": "max_n_shuffle",
+    "premo": "max_riffle_shuffle",
+    "shuffle_model": "max_n_shuffle",
+}
+
+
+# The estimators for `run_adaptive`. Like the reducers in runner.REDUCERS, `reduce` counts a chunk of trials, with one row per recorded
+# shuffle number. `estimate` returns the estimate, the lower and upper bound of its confidence interval, and the half width that is compared
+# with the precision, from the summed counts and the number of trials of one shuffle number.
+class TotalVariationDistanceEstimator:
+    """
+    Estimates the TVD after each shuffle number from the rising sequence counts, with the bias corrected estimate and the basic bootstrap
+    confidence interval of stats.empirical_total_variation_distance_bootstrap. The half width is that of the interval before it is clipped
+    to [0, 1], so shuffle numbers with a TVD close to 0 do not stop early.
+    """
+    def __init__(self, confidence: float = 0.95, n_bootstrap: int = 1000, seed: int = None):
+        self.confidence: float = confidence
+        self.n_bootstrap: int = n_bootstrap
+        self.rng: np.random.Generator = np.random.default_rng(seed)
+
+    def reduce(self, chunk) -> np.ndarray:
+        return runner.count_rising_sequences(chunk)
+
+    def estimate(self, counts: np.ndarray, n_trials: int) -> tuple:
+        bootstrap: dict = stats.empirical_total_variation_distance_bootstrap(counts, self.confidence, self.n_bootstrap, self.rng)
+        return bootstrap['tvd'], bootstrap['lower'], bootstrap['upper'], bootstrap['half_width']
+
+
+class CardPositionEstimator:
+    """
+    Estimates the frequency of each card on each position after each shuffle number (see stats.count_card_positions), with a Wilson score
+    confidence interval per frequency. The precision of a shuffle number is the widest interval of all its frequencies.
+    """
+    def __init__(self, confidence: float = 0.95):
+        self.confidence: float = confidence
+
+    def reduce(self, chunk) -> np.ndarray:
+        return runner.count_card_positions(chunk)
+
+    def estimate(self, counts: np.ndarray, n_trials: int) -> tuple:
+        centre, half_width = stats.wilson_interval(counts, n_trials, self.confidence)
+        return counts / n_trials, centre - half_width, centre + half_width, float(np.max(half_width))
+
+
+class PremoHitRateEstimator:
+    """
+    Estimates the hit rates of the premo trick with 1 to `max_guesses` guesses after each shuffle number (see stats.count_premo_hits), with a
+    Wilson score confidence interval per hit rate. The precision of a shuffle number is the widest interval of all its hit rates.
+    """
+    def __init__(self, max_guesses: int, confidence: float = 0.95):
+        self.max_guesses: int = max_guesses
+        self.confidence: float = confidence
+
+    def reduce(self, chunk) -> np.ndarray:
+        premo: dict = runner.collect_premo(chunk)
+        return np.array([stats.count_premo_hits(premo['top_card'][:, s], premo['deck'][:, s], self.max_guesses)
+                         for s in range(premo['top_card'].shape[1])])
+
+    def estimate(self, counts: np.ndarray, n_trials: int) -> tuple:
+        centre, half_width = stats.wilson_interval(counts, n_trials, self.confidence)
+        return counts / n_trials, centre - half_width, centre + half_width, float(np.max(half_width))
+
+
+def run_adaptive(simulation_name: str, estimator, precision: float, max_trials: int, batch_size: int = 1000, min_trials: int = None,
+                 seed: int = None, n_workers: int = 1, chunk_size: int = None, **params) -> dict:
+    """
+    Runs a simulation in batches of `batch_size` trials until the estimates after each shuffle number are precise enough, instead of a
+    fixed number of trials. After each batch, the counts of the estimator are updated and the confidence interval of each shuffle number is
+    computed. A shuffle number is done when the half width of its confidence interval is at most `precision` (and it used at least
+    `min_trials` trials). The next batches only record the shuffle numbers that are not done, and stop shuffling after the last of them.
+    The run stops when all shuffle numbers are done, or when `max_trials` trials have been simulated.
+
+    Each batch is run with `runner.run_simulation`, with a seed spawned from np.random.SeedSequence(seed), so for a given seed (and chunk_size)
+    the result is reproducible, no matter how many workers are used.
+
+    E.g.: estimate the TVD after 1 to 15 riffle shuffles to +/- 0.005, with at most 100.000 trials:
+        result = run_adaptive("riffle_shuffle", TotalVariationDistanceEstimator(seed=2023), precision=0.005, max_trials=100000,
+                              batch_size=5000, seed=2023, n_cards_in_deck=52, max_n_riffle_shuffle=15, vectorized=True)
+        result['summary']  # the TVD, its confidence interval and the number of trials, per shuffle number
+
+    :param  simulation_name: name of the simulation, one of the keys in MAX_SHUFFLE_PARAMETERS
+            estimator: TotalVariationDistanceEstimator, CardPositionEstimator or PremoHitRateEstimator
+            precision: the largest half width of the confidence interval at which a shuffle number is done
+            max_trials: the maximum number of trials (the trial budget)
+            batch_size: number of trials per batch. The precision is checked after each batch
+            min_trials: the minimum number of trials per shuffle number. If None, one batch
+            seed: seed for np.random.SeedSequence. If None, fresh entropy is used and the result is not reproducible
+            n_workers: number of processes per batch, see `runner.run_simulation`
+            chunk_size: number of trials per chunk within a batch. If None, the batch is one chunk
+            **params: parameters of the simulation generator, e.g. n_cards_in_deck, max_n_riffle_shuffle, record_at, stride, vectorized
+    :return dict with:
+                'summary': pd.DataFrame indexed by shuffle number, with the number of trials, the half width of the confidence interval, whether
+                           the precision was reached, and for the TVD also the bias corrected estimate and the interval
+                'estimates', 'ci_lower', 'ci_upper': dicts with the estimate and interval per shuffle number (numpy arrays for the card
+                                                     position frequencies and premo hit rates)
+                'counts': dict with the counts of the estimator per shuffle number, e.g. to use with stats.frequency_matrix_view
+                'n_trials': the total number of trials that were simulated
+    """
+    if simulation_name not in MAX_SHUFFLE_PARAMETERS:
+        raise ValueError(f"Unknown simulation '{simulation_name}', choose one of {list(MAX_SHUFFLE_PARAMETERS)}.")
+    max_shuffle_parameter: str = MAX_SHUFFLE_PARAMETERS[simulation_name]
+    min_trials = batch_size if min_trials is None else min_trials
+
+    active: list = simulation.recorded_shuffle_numbers(params.pop(max_shuffle_parameter), params.pop('record_at', None),
+                                                       params.pop('stride', None))
+    counts: dict = {}
+    trials: dict = dict.fromkeys(active, 0)
+    estimates: dict = {}
+    half_widths: dict = {}
+    converged: dict = dict.fromkeys(active, False)
+    seed_sequence: np.random.SeedSequence = np.random.SeedSequence(seed)
+
+    n_trials: int = 0
+    while active and n_trials < max_trials:
+        n_batch: int = min(batch_size, max_trials - n_trials)
+        batch_seed: list = seed_sequence.spawn(1)[0].generate_state(4).tolist()
+        batch_params: dict = {**params, max_shuffle_parameter: active[-1], 'record_at': set(active)}
+
+        batch_counts: np.ndarray = runner.run_simulation(simulation_name, n_batch, (estimator.reduce, runner.merge_sum), seed=batch_seed,
+                                                         n_workers=n_workers, chunk_size=chunk_size or n_batch, **batch_params)
+        n_trials += n_batch
+
+        for i, shuffle_number in enumerate(active):
+            counts[shuffle_number] = counts[shuffle_number] + batch_counts[i] if shuffle_number in counts else batch_counts[i]
+            trials[shuffle_number] += n_batch
+            estimates[shuffle_number] = estimator.estimate(counts[shuffle_number], trials[shuffle_number])
+            half_widths[shuffle_number] = estimates[shuffle_number][3]
+            converged[shuffle_number] = half_widths[shuffle_number] <= precision and trials[shuffle_number] >= min_trials
+
+        active = [shuffle_number for shuffle_number in active if not converged[shuffle_number]]
+
+    summary: pd.DataFrame = pd.DataFrame({
+        'trials': trials,
+        'half_width': half_widths,
+        'converged': converged,
+    })
+    summary.index.name = 'shuffle'
+    if isinstance(estimator, TotalVariationDistanceEstimator):
+        summary.insert(0, 'tvd', [estimates[s][0] for s in summary.index])
+        summary.insert(1, 'ci_lower', [estimates[s][1] for s in summary.index])
+        summary.insert(2, 'ci_upper', [estimates[s][2] for s in summary.index])
+
+    return {
+        'summary': summary,
+        'estimates': {s: e[0] for s, e in estimates.items()},
+        'ci_lower': {s: e[1] for s, e in estimates.items()},
+        'ci_upper': {s: e[2] for s, e in estimates.items()},
+        'counts': counts,
+        'n_trials': n_trials,
+    }
+
+
+if __name__ == "__main__":
+    SEED = 2023
+
+    # The TVD after few shuffles needs fewer trials than after many shuffles, where it is small
+    result = run_adaptive("riffle_shuffle", TotalVariationDistanceEstimator(n_bootstrap=200, seed=SEED), precision=0.01, max_trials=20000,
+                          batch_size=1000, seed=SEED, n_cards_in_deck=20, max_n_riffle_shuffle=8, vectorized=True)
+    summary = result['summary']
+    assert list(summary.index) == list(range(1, 9)) and result['n_trials'] <= 20000
+    assert summary['trials'].min() < summary['trials'].max() == result['n_trials']
+    assert (summary.loc[summary['converged'], 'half_width'] <= 0.01).all()
+    assert (summary['ci_lower'] <= summary['ci_upper']).all() and summary.loc[1, 'tvd'] > 0.9
+    assert all(result['counts'][s].sum() == summary.loc[s, 'trials'] for s in summary.index)
+    # The bias corrected estimate lies in its interval, and the half width is not narrowed by clipping the interval to [0, 1]
+    assert ((summary['ci_lower'] - 1e-12 <= summary['tvd']) & (summary['tvd'] <= summary['ci_upper'] + 1e-12)).all()
+    assert (summary['half_width'] >= (summary['ci_upper'] - summary['ci_lower']) / 2 - 1e-12).all()
+
+    # The result is reproducible, and does not depend on the number of workers
+    again = run_adaptive("riffle_shuffle", TotalVariationDistanceEstimator(n_bootstrap=200, seed=SEED), precision=0.01, max_trials=20000,
+                         batch_size=1000, seed=SEED, n_workers=2, chunk_size=500, n_cards_in_deck=20, max_n_riffle_shuffle=8, vectorized=True)
+    chunked = run_adaptive("riffle_shuffle", TotalVariationDistanceEstimator(n_bootstrap=200, seed=SEED), precision=0.01, max_trials=20000,
+                           batch_size=1000, seed=SEED, chunk_size=500, n_cards_in_deck=20, max_n_riffle_shuffle=8, vectorized=True)
+    assert again['summary'].equals(chunked['summary'])
+
+    # Only the recorded shuffle numbers are estimated, and the trial budget is respected
+    result = run_adaptive("overhand_shuffle", CardPositionEstimator(), precision=0.001, max_trials=300, batch_size=200, seed=SEED,
+                          n_cards_in_deck=10, max_n_shuffle=50, stride=25, vectorized=True)
+    assert list(result['summary'].index) == [25, 50] and result['n_trials'] == 300 and not result['summary']['converged'].any()
+    assert result['estimates'][50].shape == (10, 10) and np.allclose(result['estimates'][50].sum(axis=1), 1)
+
+    result = run_adaptive("premo", PremoHitRateEstimator(max_guesses=3), precision=0.05, max_trials=2000, batch_size=500, seed=SEED,
+                          n_cards_in_deck=10, max_riffle_shuffle=3)
+    assert result['summary']['converged'].all() and (np.diff(result['estimates'][1]) >= 0).all()
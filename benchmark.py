@@ -0,0 +1,278 @@
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import timeit
+from pathlib import Path
+import numpy as np
+import yaml
+from deck import Deck, new_deck_batch, rising_sequences_batch
+import gsr
+import shuffles
+import stats
+from variates import RandomVariatePool
+
+
+CONFIG_PATH = Path(__file__).resolve().parent / "config" / "simulation_config.yml"
+
+
+def load_sizes(config_path=CONFIG_PATH, scale: float = 1.0) -> list:
+    """
+    Reads the deck sizes and trial counts of the simulations in the config file.
+
+    :param  config_path: path to simulation_config.yml
+            scale: factor for the trial counts, e.g. 0.01 for a quick run
+    :return sorted list of unique (n_cards, n_trials) tuples
+    """
+    with open(config_path, "r") as f:
+        cfg: dict = yaml.safe_load(f)['simulation_config']
+
+    sizes: set = {(section['n_cards'], max(1, int(section['n_trials'] * scale))) for section in cfg.values() if isinstance(section, dict)}
+    return sorted(sizes)
+
+
+# Benchmarks of functions on a single deck. Each takes the number of cards and a numpy.random.Generator, does the setup, and returns
+# the function to time.
+def _bench_riffle_shuffle(n_cards: int, rng: np.random.Generator):
+    deck = Deck().init_new_deck(n_cards)
+    left, right = deck[:n_cards // 2], deck[n_cards // 2:]
+    return lambda: gsr.riffle_shuffle(left, right, rng=rng)
+
+
+def _bench_riffle_shuffle_pool(n_cards: int, rng: np.random.Generator):
+    deck = Deck().init_new_deck(n_cards)
+    left, right = deck[:n_cards // 2], deck[n_cards // 2:]
+    pool = RandomVariatePool(rng)
+    return lambda: gsr.riffle_shuffle(left, right, rng=pool)
+
+
+def _bench_a_shuffle(n_cards: int, rng: np.random.Generator):
+    deck = Deck().init_new_deck(n_cards)
+    return lambda: shuffles.a_shuffle(deck, a=3, rng=rng)
+
+
+def _bench_overhand_shuffle(n_cards: int, rng: np.random.Generator):
+    deck = Deck().init_new_deck(n_cards)
+    return lambda: shuffles.overhand_shuffle(deck, p=0.25, rng=rng)
+
+
+def _bench_top_in_at_random_shuffle(n_cards: int, rng: np.random.Generator):
+    deck = Deck().init_new_deck(n_cards)
+    return lambda: shuffles.top_in_at_random_shuffle(deck, rng=rng)
+
+
+def _bench_rising_sequences(n_cards: int, rng: np.random.Generator):
+    deck = Deck(rng.permutation(np.arange(1, n_cards + 1)))
+    return lambda: deck.rising_sequences
+
+
+def _bench_winding_distance(n_cards: int, rng: np.random.Generator):
+    deck = Deck(rng.permutation(np.arange(1, n_cards + 1)))
+    return lambda: [stats.winding_distance(deck, card) for card in range(1, n_cards + 1)]
+
+
+def _bench_eulerian(n_cards: int, rng: np.random.Generator):
+    def eulerian_without_cache():
+        stats._eulerian_rows.clear()
+        return stats.eulerian(n_cards, n_cards // 2)
+    return eulerian_without_cache
+
+
+# Benchmarks of functions on all decks of a simulation. Each takes the number of cards, the number of trials and a numpy.random.Generator.
+def _bench_create_frequency_matrix(n_cards: int, n_trials: int, rng: np.random.Generator):
+    decks = rng.permuted(new_deck_batch(n_trials, n_cards), axis=1)
+    return lambda: stats.create_frequency_matrix(decks)
+
+
+def _bench_riffle_shuffle_batch(n_cards: int, n_trials: int, rng: np.random.Generator):
+    decks = new_deck_batch(n_trials, n_cards)
+    return lambda: gsr.riffle_shuffle_batch(decks, rng=rng)
+
+
+def _bench_a_shuffle_batch(n_cards: int, n_trials: int, rng: np.random.Generator):
+    decks = new_deck_batch(n_trials, n_cards)
+    return lambda: shuffles.a_shuffle_batch(decks, a=3, rng=rng)
+
+
+def _bench_overhand_shuffle_batch(n_cards: int, n_trials: int, rng: np.random.Generator):
+    decks = new_deck_batch(n_trials, n_cards)
+    return lambda: shuffles.overhand_shuffle_batch(decks, p=0.25, rng=rng)
+
+
+def _bench_rising_sequences_batch(n_cards: int, n_trials: int, rng: np.random.Generator):
+    decks = rng.permuted(new_deck_batch(n_trials, n_cards), axis=1)
+    return lambda: rising_sequences_batch(decks)
+
+
+def _bench_winding_distances_batch(n_cards: int, n_trials: int, rng: np.random.Generator):
+    decks = rng.permuted(new_deck_batch(n_trials, n_cards), axis=1)
+    return lambda: stats.winding_distances_batch(decks)
+
+
+DECK_BENCHMARKS: dict = {
+    "gsr.riffle_shuffle": _bench_riffle_shuffle,
+    "gsr.riffle_shuffle (RandomVariatePool)": _bench_riffle_shuffle_pool,
+    "shuffles.a_shuffle": _bench_a_shuffle,
+    "shuffles.overhand_shuffle": _bench_overhand_shuffle,
+    "shuffles.top_in_at_random_shuffle": _bench_top_in_at_random_shuffle,
+    "Deck.rising_sequences": _bench_rising_sequences,
+    "stats.winding_distance": _bench_winding_distance,
+    "stats.eulerian": _bench_eulerian,
+}
+
+BATCH_BENCHMARKS: dict = {
+    "stats.create_frequency_matrix": _bench_create_frequency_matrix,
+    "gsr.riffle_shuffle_batch": _bench_riffle_shuffle_batch,
+    "shuffles.a_shuffle_batch": _bench_a_shuffle_batch,
+    "shuffles.overhand_shuffle_batch": _bench_overhand_shuffle_batch,
+    "deck.rising_sequences_batch": _bench_rising_sequences_batch,
+    "stats.winding_distances_batch": _bench_winding_distances_batch,
+}
+
+
+def time_function(function, repeat: int = 5, min_time: float = 0.2) -> dict:
+    """
+    Times a function with timeit: the number of calls per measurement is chosen so that a measurement takes at least `min_time` seconds,
+    and the measurement is repeated `repeat` times.
+
+    :return dict with the number of calls per measurement, and the best, median and mean time per call in seconds
+    """
+    timer = timeit.Timer(function)
+    number: int = 1
+    while timer.timeit(number) < min_time and number < 10**6:
+        number *= 10
+    times: list = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+
+    return {'number': number, 'repeat': repeat, 'best': min(times), 'median': statistics.median(times), 'mean': statistics.mean(times)}
+
+
+def run_benchmarks(config_path=CONFIG_PATH, scale: float = 1.0, names: list = None, repeat: int = 5, min_time: float = 0.2,
+                   seed: int = 2023) -> dict:
+    """
+    Runs the benchmarks for the deck sizes and trial counts in the config file (see `load_sizes`).
+    Single deck benchmarks are run once per deck size, batch benchmarks once per (deck size, trial count).
+
+    :param  config_path: path to simulation_config.yml
+            scale: factor for the trial counts, e.g. 0.01 for a quick run
+            names: names of the benchmarks to run (keys of DECK_BENCHMARKS and BATCH_BENCHMARKS). If None, all benchmarks are run
+            repeat, min_time: see `time_function`
+            seed: seed of the numpy.random.Generator used by the benchmarks
+    :return dict with 'metadata' about the run, and 'results': a list with a dict per benchmark, with its name, params and timings
+    """
+    sizes: list = load_sizes(config_path, scale)
+    rng: np.random.Generator = np.random.default_rng(seed)
+
+    cases: list = []
+    for n_cards in sorted({n for n, _ in sizes}):
+        cases += [(name, setup, {'n_cards': n_cards}) for name, setup in DECK_BENCHMARKS.items()]
+    for n_cards, n_trials in sizes:
+        cases += [(name, setup, {'n_cards': n_cards, 'n_trials': n_trials}) for name, setup in BATCH_BENCHMARKS.items()]
+
+    results: list = []
+    for name, setup, params in cases:
+        if names is not None and name not in names:
+            continue
+        function = setup(**params, rng=rng)
+        results.append({'name': name, 'params': params, **time_function(function, repeat, min_time)})
+
+    metadata: dict = {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'config': str(config_path),
+        'scale': scale,
+        'seed': seed,
+    }
+    return {'metadata': metadata, 'results': results}
+
+
+def _result_key(result: dict) -> tuple:
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1, statistic: str = 'best') -> list:
+    """
+    Compares two benchmark runs (as returned by `run_benchmarks`, or loaded from their JSON files).
+
+    :param  baseline, current: the benchmark runs
+            threshold: relative change of the time per call above which a benchmark counts as 'slower' or 'faster'
+            statistic: timing to compare, 'best', 'median' or 'mean'
+    :return list with a dict per benchmark, with the name, params, both times, the ratio current / baseline and the status:
+            'slower', 'faster', 'same', 'new' (only in current) or 'removed' (only in baseline)
+    """
+    baseline_results: dict = {_result_key(r): r for r in baseline['results']}
+    current_results: dict = {_result_key(r): r for r in current['results']}
+
+    comparison: list = []
+    for key in list(baseline_results) + [k for k in current_results if k not in baseline_results]:
+        base_time = baseline_results[key][statistic] if key in baseline_results else None
+        current_time = current_results[key][statistic] if key in current_results else None
+
+        if base_time is None:
+            ratio, status = None, 'new'
+        elif current_time is None:
+            ratio, status = None, 'removed'
+        else:
+            ratio = current_time / base_time
+            status = 'slower' if ratio > 1 + threshold else 'faster' if ratio < 1 / (1 + threshold) else 'same'
+
+        comparison.append({'name': key[0], 'params': json.loads(key[1]), 'baseline': base_time, 'current': current_time,
+                           'ratio': ratio, 'status': status})
+    return comparison
+
+
+def _format_time(seconds) -> str:
+    if seconds is None:
+        return "-"
+    for unit, factor in [("s", 1), ("ms", 1e-3), ("us", 1e-6)]:
+        if seconds >= factor:
+            return f"{seconds / factor:.3g} {unit}"
+    return f"{seconds / 1e-9:.3g} ns"
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks of the shuffle kernels and statistics, at the sizes in simulation_config.yml.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write the timings to a JSON file")
+    run_parser.add_argument("--output", "-o", default="benchmark.json")
+    run_parser.add_argument("--config", default=str(CONFIG_PATH))
+    run_parser.add_argument("--scale", type=float, default=1.0, help="factor for the trial counts, e.g. 0.01 for a quick run")
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--min-time", type=float, default=0.2)
+    run_parser.add_argument("--only", nargs="*", help="names of the benchmarks to run")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two JSON files, exits with 1 when a benchmark got slower")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    compare_parser.add_argument("--statistic", default="best", choices=["best", "median", "mean"])
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        result: dict = run_benchmarks(args.config, args.scale, args.only, args.repeat, args.min_time)
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        for r in result['results']:
+            print(f"{r['name']:<36} {json.dumps(r['params']):<36} {_format_time(r['best']):>10}")
+        return 0
+
+    with open(args.baseline, "r") as f:
+        baseline: dict = json.load(f)
+    with open(args.current, "r") as f:
+        current: dict = json.load(f)
+
+    comparison: list = compare(baseline, current, args.threshold, args.statistic)
+    for c in comparison:
+        ratio: str = "-" if c['ratio'] is None else f"{c['ratio']:.2f}x"
+        print(f"{c['name']:<36} {json.dumps(c['params']):<36} {_format_time(c['baseline']):>10} {_format_time(c['current']):>10} "
+              f"{ratio:>7}  {c['status']}")
+    return int(any(c['status'] == 'slower' for c in comparison))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+import numpy as np
+
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "shufflingcards"
+DEFAULT_MAX_BYTES = 10 * 1024**3  # 10 GB
+# Layout of the cache files, part of the cache key so that files with another layout are never read
+CACHE_FORMAT = 2
+
+
+def _canonical(value):
+    """
+    Helper function that converts parameters to a JSON serializable form that does not depend on e.g. the order of a set. Other values,
+    e.g. a numpy.random.Generator, have no stable content to hash, so they raise a TypeError.
+    """
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in sorted(value.items(), key=lambda item: str(item[0]))}
+    if isinstance(value, (set, frozenset)):
+        return sorted(_canonical(v) for v in value)
+    if isinstance(value, (list, tuple, range)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f"Cannot cache a simulation with the parameter {value!r} of type {type(value).__name__}, only JSON values, sets and "
+                    f"numpy scalars. Use the `seed` of SimulationCache.run instead of an `rng`.")
+
+
+def _module_sources(module, seen: dict = None) -> dict:
+    """
+    Helper function that returns the source code of a module, and of the modules of this repository it imports (directly or indirectly).
+    """
+    seen = {} if seen is None else seen
+    seen[module.__name__] = inspect.getsource(module)
+
+    repository: Path = Path(__file__).resolve().parent
+    for value in vars(module).values():
+        imported = value if inspect.ismodule(value) else inspect.getmodule(value)
+        if imported is None or imported.__name__ in seen or getattr(imported, '__file__', None) is None:
+            continue
+        if Path(imported.__file__).resolve().parent == repository:
+            _module_sources(imported, seen)
+
+    return seen
+
+
+def cache_key(function, seed, params: dict) -> str:
+    """
+    Content address of the output of a simulation: a SHA-256 hash of the function name, its parameters, the seed, and the source code of
+    the module of the function (and the modules of this repository it imports). When any of these changes, the key changes.
+
+    :param  function: a simulation function, e.g. simulation.riffle_shuffle_simulation
+            seed: the random seed
+            params: the parameters of the function
+    :return hex digest
+    """
+    sources: dict = _module_sources(sys.modules[function.__module__])
+    content: dict = {
+        'format': CACHE_FORMAT,
+        'function': f"{function.__module__}.{function.__qualname__}",
+        'params': _canonical(params),
+        'seed': _canonical(seed),
+        'sources': sources,
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+class SimulationCache:
+    """
+    Disk cache for the outputs of the simulation functions in simulation.py. The outputs are stored as pickle files in `cache_dir`,
+    named after their `cache_key`. When the total size exceeds `max_bytes`, the least recently used outputs are removed.
+
+    E.g.: rerunning the notebook only runs the simulation the first time, or after the config, the seed or the code changed
+        cache = SimulationCache()
+        results = cache.run(simulation.riffle_shuffle_simulation, seed=RANDOM_SEED, n_trials=N_TRIALS, n_cards_in_deck=N_CARDS,
+                            max_n_riffle_shuffle=MAX_RIFFLE_SHUFFLES)
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir: Path = Path(cache_dir)
+        self.max_bytes: int = max_bytes
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.pickle"
+
+    def run(self, function, seed: int, **params):
+        """
+        Returns the cached output of `function(**params)` with the global numpy random state seeded with `seed` (see np.random.seed).
+        If it is not cached yet, the function is run and its output is stored, together with the global numpy random state after the run.
+        On a cache hit this state is restored, so the random numbers drawn after `run` are the same as when the function had been run.
+
+        :param  function: a simulation function, e.g. simulation.riffle_shuffle_simulation
+                seed: the random seed
+                **params: the parameters of the function: numbers, strings, None, and lists, sets and dicts of these. Not an rng, the
+                          global random state is seeded with `seed`
+        :return the output of the function
+        """
+        path: Path = self._path(cache_key(function, seed, params))
+
+        try:
+            with open(path, "rb") as f:
+                entry: dict = pickle.load(f)
+            os.utime(path)  # mark as recently used
+            np.random.set_state(entry['random_state'])
+            return entry['result']
+        except FileNotFoundError:
+            pass  # not cached yet, or evicted by another process
+
+        np.random.seed(seed)
+        result = function(**params)
+        self._store(path, {'result': result, 'random_state': np.random.get_state()})
+        return result
+
+    def _store(self, path: Path, entry: dict) -> None:
+        """
+        Writes a cache entry to a temporary file and renames it, so that an interrupted write never leaves a broken cache entry. Each write
+        has its own temporary file, so processes that store the same entry at the same time do not overwrite each other's file.
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".tmp", delete=False) as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f.name, path)
+        self.evict()
+
+    def _entries_with_stats(self) -> list:
+        """
+        Returns (path, os.stat_result) of the cache files, least recently used first. Files that are removed by another process while they
+        are listed are skipped.
+        """
+        if not self.cache_dir.exists():
+            return []
+        entries: list = []
+        for path in self.cache_dir.glob("*.pickle"):
+            try:
+                entries.append((path, path.stat()))
+            except FileNotFoundError:
+                continue
+        return sorted(entries, key=lambda entry: entry[1].st_mtime)
+
+    def entries(self) -> list:
+        """
+        Returns the cache files, least recently used first.
+        """
+        return [path for path, _ in self._entries_with_stats()]
+
+    def size(self) -> int:
+        """
+        Returns the total size of the cache files in bytes.
+        """
+        return sum(stat.st_size for _, stat in self._entries_with_stats())
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used outputs until the total size is at most `max_bytes`. Several processes can share the cache
+        directory: a file that another process already removed is skipped.
+        """
+        entries: list = self._entries_with_stats()
+        total_size: int = sum(stat.st_size for _, stat in entries)
+        for path, stat in entries:
+            if total_size <= self.max_bytes:
+                break
+            total_size -= stat.st_size
+            path.unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        """
+        Removes all cached outputs.
+        """
+        for path in self.entries():
+            path.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    import time
+    import simulation
+
+    with tempfile.TemporaryDirectory() as folder:
+        cache = SimulationCache(folder)
+        params = dict(n_trials=20, n_cards_in_deck=10, max_n_riffle_shuffle=5)
+
+        first = cache.run(simulation.riffle_shuffle_simulation, seed=2023, **params)
+        first_draws = np.random.random(5)
+        assert len(cache.entries()) == 1
+        second = cache.run(simulation.riffle_shuffle_simulation, seed=2023, **params)
+        assert [[d.cards.tolist() for d in trial] for trial in first] == [[d.cards.tolist() for d in trial] for trial in second]
+        # On a hit the global random state is the same as after running the function
+        assert (np.random.random(5) == first_draws).all()
+        assert not list(Path(folder).glob("*.tmp"))
+
+        # Another seed, other parameters or another function give other entries
+        cache.run(simulation.riffle_shuffle_simulation, seed=2024, **params)
+        cache.run(simulation.riffle_shuffle_simulation, seed=2023, **{**params, 'vectorized': True})
+        assert len(cache.entries()) == 3
+        assert cache_key(simulation.riffle_shuffle_simulation, 1, {'record_at': {3, 1, 2}}) == \
+               cache_key(simulation.riffle_shuffle_simulation, 1, {'record_at': {1, 2, 3}})
+        assert cache_key(simulation.riffle_shuffle_simulation, 1, {}) != cache_key(simulation.a_shuffle_simulation, 1, {})
+
+        # The least recently used entries are removed first
+        time.sleep(0.01)
+        cache.run(simulation.riffle_shuffle_simulation, seed=2023, **params)
+        cache.max_bytes = cache._path(cache_key(simulation.riffle_shuffle_simulation, 2023, params)).stat().st_size
+        cache.evict()
+        assert cache.entries() == [cache._path(cache_key(simulation.riffle_shuffle_simulation, 2023, params))]
+
+        # An entry that another process removed in the meantime is skipped
+        stale_entries = cache._entries_with_stats()
+        stale_entries[0][0].unlink()
+        cache._entries_with_stats = lambda: stale_entries
+        cache.max_bytes = 0
+        cache.evict()
+        del cache._entries_with_stats
+
+        cache.clear()
+        assert cache.size() == 0
+
+        # A source of random numbers has no stable content to hash, the seed should be used instead
+        try:
+            cache.run(simulation.riffle_shuffle_simulation, seed=2023, rng=np.random.default_rng(2023), **params)
+            assert False
+        except TypeError:
+            pass
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from pathlib import Path
+import numpy as np
+import runner
+import simulation
+
+
+STATE_FILE_NAME = "state.pickle"
+
+
+def _fingerprint(simulation_name: str, n_trials: int, checkpoint_every: int, seed, reducer, params: dict) -> str:
+    """
+    Helper function that returns a hash of everything that determines the output of `run_with_checkpoints`. A checkpoint can only be
+    resumed by a run with the same fingerprint. With `seed` None this includes the global numpy random state the run starts from, so a
+    run after another np.random.seed does not resume the checkpoint.
+    """
+    reducer_name = reducer if isinstance(reducer, str) or reducer is None else [f"{f.__module__}.{f.__qualname__}" for f in reducer]
+    content: dict = {
+        'simulation': simulation_name,
+        'n_trials': n_trials,
+        'checkpoint_every': checkpoint_every,
+        'seed': seed,
+        'random_state': _hash_random_state(np.random.get_state()) if seed is None else None,
+        'reducer': reducer_name,
+        'params': {key: sorted(value) if isinstance(value, (set, frozenset)) else value for key, value in params.items()},
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+def _hash_random_state(state: tuple) -> str:
+    """
+    Helper function that returns a hash of a global numpy random state, see np.random.get_state.
+    """
+    algorithm, keys, position, has_gauss, cached_gaussian = state
+    return hashlib.sha256(repr((algorithm, position, has_gauss, cached_gaussian)).encode() + keys.tobytes()).hexdigest()
+
+
+def _get_rng_state(rng) -> dict:
+    return np.random.get_state() if rng is None else rng.bit_generator.state
+
+
+def _set_rng_state(rng, state) -> None:
+    if rng is None:
+        np.random.set_state(state)
+    else:
+        rng.bit_generator.state = state
+
+
+def _write_pickle(path: Path, value) -> None:
+    """
+    Helper function that pickles `value` to a temporary file and renames it, so that `path` never holds a partly written file. Each write
+    has its own temporary file, so two writers of the same file do not overwrite each other's temporary file.
+    """
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f.name, path)
+
+
+def _merge_blocks(blocks: list):
+    """
+    Helper function that merges the blocks of trials: lists of trials are joined, numpy arrays (or dicts of arrays) are concatenated.
+    """
+    if not blocks:
+        return []
+    if isinstance(blocks[0], list):
+        return [trial for block in blocks for trial in block]
+    return runner.merge_concatenate(blocks)
+
+
+def run_with_checkpoints(simulation_name: str, n_trials: int, checkpoint_dir, checkpoint_every: int = 1000, seed: int = None,
+                         reducer=None, **params):
+    """
+    Runs a simulation in blocks of `checkpoint_every` trials, and writes a checkpoint to `checkpoint_dir` after each block: the trials
+    of the block (or their statistics, when a reducer is given) and the exact state of the random number generator.
+
+    When the run is interrupted, e.g. because the process is killed, rerunning it with the same arguments resumes after the last
+    checkpoint, and the output is identical to an uninterrupted run. Rerunning a finished run only reads the checkpoints.
+
+    With `seed` None, the global numpy random state is used (see np.random.seed) and saved. The checkpoint is then only resumed by a run
+    that starts from the same global random state, e.g. after the same np.random.seed. Because the trials of the non-vectorized
+    simulations only depend on the random numbers drawn before them, the output then equals the simulation functions, e.g.:
+        np.random.seed(RANDOM_SEED)
+        results = run_with_checkpoints("overhand_shuffle", N_TRIALS, "../checkpoints/overhand", checkpoint_every=100,
+                                       n_cards_in_deck=N_CARDS, max_n_shuffle=MAX_OVERHAND_SHUFFLES, p=P)
+    gives the same result as `simulation.overhand_shuffle_simulation(N_TRIALS, N_CARDS, MAX_OVERHAND_SHUFFLES, p=P)` after the same seed.
+
+    :param  simulation_name: name of the simulation, one of the keys in runner.SIMULATIONS
+            n_trials: number of trials
+            checkpoint_dir: folder for the checkpoint files. It is created if it does not exist
+            checkpoint_every: number of trials per block. A vectorized simulation shuffles a block at once
+            seed: seed for np.random.default_rng. If None, the global numpy random state is used
+            reducer: None to keep all trials, or a reducer of runner.REDUCERS (a name, or a tuple (reduce, merge)) to only keep statistics
+            **params: parameters of the simulation generator, e.g. n_cards_in_deck, max_n_shuffle, record_at, vectorized
+    :return the trials, merged like the simulation returns them (a list of trials, or a numpy array for vectorized simulations), or the
+            merged statistics when a reducer is given
+    """
+    if simulation_name not in runner.SIMULATIONS:
+        raise ValueError(f"Unknown simulation '{simulation_name}', choose one of {list(runner.SIMULATIONS)}.")
+    simulate = runner.SIMULATIONS[simulation_name]
+    reduce, merge = runner._get_reducer(reducer) if reducer is not None else (None, _merge_blocks)
+
+    checkpoint_dir = Path(checkpoint_dir)
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    state_path: Path = checkpoint_dir / STATE_FILE_NAME
+    fingerprint: str = _fingerprint(simulation_name, n_trials, checkpoint_every, seed, reducer, params)
+    rng: np.random.Generator = None if seed is None else np.random.default_rng(seed)
+
+    block_sizes: list = list(simulation._chunk_sizes(n_trials, checkpoint_every))
+    blocks_done: int = 0
+    if state_path.exists():
+        with open(state_path, "rb") as f:
+            state: dict = pickle.load(f)
+        if state['fingerprint'] != fingerprint:
+            raise ValueError(f"The checkpoint in '{checkpoint_dir}' belongs to another run. Use another folder, or remove the checkpoint.")
+        blocks_done = state['blocks_done']
+        _set_rng_state(rng, state['rng_state'])
+
+    for i_block in range(blocks_done, len(block_sizes)):
+        block = next(simulate(n_trials=block_sizes[i_block], chunk_size=block_sizes[i_block], rng=rng, **params))
+        if reduce is not None:
+            block = reduce(block)
+
+        # The block is written before the state, so the state never refers to a missing block
+        _write_pickle(checkpoint_dir / f"block_{i_block:05d}.pickle", block)
+        _write_pickle(state_path, {'fingerprint': fingerprint, 'blocks_done': i_block + 1, 'n_blocks': len(block_sizes),
+                                   'rng_state': _get_rng_state(rng)})
+
+    blocks: list = []
+    for i_block in range(len(block_sizes)):
+        with open(checkpoint_dir / f"block_{i_block:05d}.pickle", "rb") as f:
+            blocks.append(pickle.load(f))
+    return merge(blocks)
+
+
+if __name__ == "__main__":
+    def flatten(trials):
+        return [[d.cards.tolist() for d in trial] for trial in trials]
+
+    with tempfile.TemporaryDirectory() as folder:
+        # With the global random state, the output equals the simulation function
+        np.random.seed(2023)
+        checkpointed = run_with_checkpoints("overhand_shuffle", 25, Path(folder) / "overhand", checkpoint_every=10,
+                                            n_cards_in_deck=20, max_n_shuffle=30, p=0.25)
+        np.random.seed(2023)
+        assert flatten(checkpointed) == flatten(simulation.overhand_shuffle_simulation(25, 20, 30, p=0.25))
+        np.random.seed(2023)
+        assert flatten(run_with_checkpoints("overhand_shuffle", 25, Path(folder) / "overhand", checkpoint_every=10,
+                                            n_cards_in_deck=20, max_n_shuffle=30, p=0.25)) == flatten(checkpointed)
+
+        # A checkpoint with the global random state is not resumed after another seed
+        np.random.seed(2024)
+        try:
+            run_with_checkpoints("overhand_shuffle", 25, Path(folder) / "overhand", checkpoint_every=10, n_cards_in_deck=20, max_n_shuffle=30,
+                                 p=0.25)
+            assert False
+        except ValueError:
+            pass
+        assert not list(Path(folder).glob("*/*.tmp"))
+
+        # An interrupted run resumes from the last checkpoint, with the same output as an uninterrupted run
+        params = dict(n_cards_in_deck=52, max_n_riffle_shuffle=8, vectorized=True)
+        uninterrupted = run_with_checkpoints("riffle_shuffle", 1000, Path(folder) / "uninterrupted", checkpoint_every=300, seed=7, **params)
+
+        simulate = runner.SIMULATIONS["riffle_shuffle"]
+        def interrupted(*args, **kwargs):
+            if interrupted.calls == 2:
+                raise KeyboardInterrupt
+            interrupted.calls += 1
+            return simulate(*args, **kwargs)
+        interrupted.calls = 0
+
+        runner.SIMULATIONS["riffle_shuffle"] = interrupted
+        try:
+            run_with_checkpoints("riffle_shuffle", 1000, Path(folder) / "interrupted", checkpoint_every=300, seed=7, **params)
+            assert False
+        except KeyboardInterrupt:
+            pass
+        finally:
+            runner.SIMULATIONS["riffle_shuffle"] = simulate
+        assert len(list((Path(folder) / "interrupted").glob("block_*.pickle"))) == 2
+
+        resumed = run_with_checkpoints("riffle_shuffle", 1000, Path(folder) / "interrupted", checkpoint_every=300, seed=7, **params)
+        assert (resumed == uninterrupted).all() and resumed.shape == (1000, 8, 52)
+
+        # Only the statistics are kept with a reducer
+        counts = run_with_checkpoints("riffle_shuffle", 1000, Path(folder) / "counts", checkpoint_every=300, seed=7, reducer="rising_sequences",
+                                      **params)
+        assert (counts == runner.count_rising_sequences(uninterrupted)).all()
+
+        # A checkpoint of another run is not resumed
+        try:
+            run_with_checkpoints("riffle_shuffle", 1000, Path(folder) / "interrupted", checkpoint_every=300, seed=8, **params)
+            assert False
+        except ValueError:
+            pass
@@ -1,28 +1,105 @@
 from collections import deque 
-from copy import deepcopy
-from itertools import islice
 import numpy as np
-import types
 
 
 # from typing import Self
 
 
+# Counts of the Deck objects that are created, one dict for each running instrumentation.Instrumentation, so nested or interleaved
+# instrumented simulations each keep counting. Empty when they are not counted.
+_deck_counts: list = []
+
+
+def card_dtype(number_of_cards: int) -> np.dtype:
+    """
+    Returns the smallest unsigned integer dtype that can hold the card numbers 1 to `number_of_cards`.
+    A deck of 52 cards fits in np.uint8, which keeps batches of decks (e.g. 100.000 trials x 15 shuffles) small in memory.
+
+    :param  number_of_cards: the number of cards in the deck
+    :return numpy dtype to store the cards in
+    """
+    if number_of_cards < 2**8:
+        return np.dtype(np.uint8)
+    elif number_of_cards < 2**16:
+        return np.dtype(np.uint16)
+    else:
+        return np.dtype(np.uint32)
+
+
+def new_deck_batch(n_decks: int, number_of_cards: int = 52) -> np.ndarray:
+    """
+    Initiates a batch of decks in standard order, as a 2-D numpy array with shape (n_decks, number_of_cards).
+    Each row represents a deck, holding the cards [1, 2, ..., number_of_cards], just like Deck().init_new_deck(number_of_cards).
+
+    E.g.:
+        decks = new_deck_batch(3, 4)
+        decks --> array([[1, 2, 3, 4],
+                         [1, 2, 3, 4],
+                         [1, 2, 3, 4]])
+
+    :param  n_decks: the number of decks (rows) in the batch
+            number_of_cards: the number of cards in each deck
+    :return 2-D numpy array with a deck in standard order on each row
+    """
+    cards: np.ndarray = np.arange(1, number_of_cards + 1, dtype=card_dtype(number_of_cards))
+    return np.tile(cards, (n_decks, 1))
+
+
+def inverse_permutation_batch(decks: np.ndarray) -> np.ndarray:
+    """
+    Returns the inverse permutation of each deck in a batch of decks. The decks hold the cards 1 to n, along the last axis.
+    The inverse permutation holds the position of each card: positions[..., c - 1] is the index of card c in the deck.
+
+    The positions are filled in with one scatter over the decks, which is O(n) per deck, instead of an O(n log n) argsort.
+
+    E.g.:
+        inverse_permutation_batch(np.array([[3, 1, 2]])) --> array([[1, 2, 0]])
+
+    :param  decks: numpy array with shape (..., n_cards), each deck holds the cards 1 to n_cards
+    :return numpy array with the same shape as `decks`, holding the position of each card
+    """
+    n_cards: int = decks.shape[-1]
+    positions: np.ndarray = np.empty(decks.shape, dtype=np.intp)
+    np.put_along_axis(positions, decks.astype(np.intp) - 1, np.broadcast_to(np.arange(n_cards), decks.shape), axis=-1)
+    return positions
+
+
+def rising_sequences_batch(decks: np.ndarray) -> np.ndarray:
+    """
+    Returns the number of rising sequences of each deck in a batch of decks, in one vectorized pass.
+    The number of rising sequences is the number of times card c + 1 lies above card c in the deck, plus one.
+
+    E.g.:
+        decks = new_deck_batch(100000, 52)
+        rising_sequences_batch(decks) --> array([1, 1, 1, ...])
+
+    :param  decks: numpy array with shape (..., n_cards), each deck holds the cards 1 to n_cards
+    :return numpy array with shape (...), holding the number of rising sequences of each deck
+    """
+    positions: np.ndarray = inverse_permutation_batch(decks)
+    return np.count_nonzero(np.diff(positions, axis=-1) < 0, axis=-1) + 1
+
+
 class Deck:
     """
     This class simulates a deck of cards.
 
     A Deck object holds cards. The cards can be evaluated by calling Deck.cards, or Deck[slice], e.g. Deck[1:5]
-    :param cards: A deque object holding a sequence of subsequent cards. This simulates the cards in a deck.
+    The cards are stored in a numpy array with a small dtype (see `card_dtype`), so a copy of a Deck is a single copy of a small buffer.
+    :param cards: A sequence (deque, list or numpy array) of subsequent cards. This simulates the cards in a deck.
     """
-    def __init__(self, cards: deque = None) -> None:
+    # `_buffer` holds the cards, `_start` is the index of the top card in `_buffer`. Taking the top card only moves `_start`, which
+    # makes `popleft` O(1) like it is for a deque.
+    __slots__ = ("_buffer", "_start")
+
+    def __init__(self, cards=None) -> None:
         """
         Init the Deck object with or without cards. 
-        The cards param takes a deque object, which reflects the order of cards in a deck. 
+        The cards param takes a sequence of cards (deque, list or numpy array), which reflects the order of cards in a deck. 
         E.g.: 
             For a deck of 4 cards, in standard order, the Deck object will be initiated with Deck(deque([1,2,3,4])).
         
-        If the Deck is initiated without any cards, an empty deque object is assigned to self.cards. A new deque of 'cards' can be assigned to Deck.cards
+        If the Deck is initiated without any cards, the deck is empty. A new sequence of 'cards' can be assigned to Deck.cards
         at any time.
         E.g.: 
             d = Deck()
@@ -35,15 +112,12 @@ class Deck:
                 d = Deck().init_new_deck(52)
         
                 
-        :param cards: A deque object holding a sequence of subsequent cards. This simulates the cards in a deck.
+        :param cards: A sequence of subsequent cards. This simulates the cards in a deck.
         :return None
         """
-
-        if not cards:
-            # cards is a deque object, as deque allows for easy and fast item selection on either end of the sequence (with O(1) time complexity).
-            self._cards: deque = deque()
-        else:
-            self._cards: deque = cards
+        self.cards = cards if cards is not None else ()
+        for counts in _deck_counts:
+            counts['allocations'] += 1
 
 
     def __len__(self) -> int:
@@ -54,7 +128,17 @@ class Deck:
         :param None
         :return the length of self.cards as an integer
         """
-        return len(self.cards)
+        return len(self._buffer) - self._start
+    
+
+    def __iter__(self):
+        """
+        Iterating over a Deck yields the cards from top to bottom, as Python integers.
+
+        :param None
+        :return iterator over the cards in the deck
+        """
+        return iter(self.cards.tolist())
     
     
     def __repr__(self) -> repr:
@@ -66,16 +150,16 @@ class Deck:
             d = Deck()
             d.cards = deque([1,2,3,4])
             print(d)
-            std.out: shows: deque([1,2,3,4])
+            std.out: shows: Deck([1, 2, 3, 4])
 
 
         :param None
-        :return repr(self.cards), to show the sequence of cards in self.cards    
+        :return a string showing the sequence of cards in self.cards    
         """
         
-        return repr(self.cards)
+        return f"Deck({self.cards.tolist()})"
     
-    def __getitem__(self, index) -> deque:
+    def __getitem__(self, index):
         """
         Cards in Deck object can be accesses by using indexes, or slices on the Deck object itself. 
         __getitem__ will check if the user has used a slice or just one index and return the requested cards from self.cards, in a new Deck object.
@@ -93,139 +177,160 @@ class Deck:
 
         
         :param: index: the index, or slice which will slice the self.cards object
-        :return Deck: a new deck object with the cards that are selected through the user input 
+        :return Deck: a new deck object with the cards that are selected through the user input, or the card (int) for an index
         """
         if isinstance(index, slice):
-            packet: Deck = Deck()
-            packet.cards = deque(islice(self.cards, index.start, index.stop))
-            return packet
+            return self._from_buffer(self.cards[index].copy())
         else:
-            return self.cards[index]
-        
-        
-    def __getattr__(self, name):
+            return int(self.cards[index])
+
+
+    def packet(self, start: int, stop: int = None):
         """
-        When calling a function or attribute of an instance of Deck, this function will check of the function/attribute is part of Deck.
-        If it's present in the Deck class, it will call the function or attribute on the Deck instance like it normally would.
-        If it's not part of the Deck class, it will call the function or attribute on self.cards, the deque object. This allows the user to directly call
-        deque functionalities on the Deck object.
+        Returns a packet of the deck: a new Deck holding the cards from index `start` up to `stop`, like self[start:stop], but without
+        copying the cards. The packet is a window (a numpy view) on the cards of this deck, so a cut into packets costs no allocation.
 
-        E.g.: calling a function that is part of the Deck object
-            d = Deck()
-            d.init_new_deck(52)     --> calls function init_new_deck() because it's part of the Deck object
+        The packet shares its cards with this deck, so its cards are read-only: writing into `packet.cards` raises a ValueError. The
+        deque-like methods (e.g. `insert` after `popleft`) copy the cards of a packet first, so changing a packet never changes this
+        deck. Use self[start:stop] for a packet that is changed many times afterwards.
 
-        E.g.: calling a function that is NOT part of the Deck object
+        E.g.:
             d = Deck().init_new_deck(52)
-            d.popleft()             --> popleft() is not part of the Deck object. It is part of the self.cards deque object. So it's called on self.cards
+            left_packet, right_packet = d.packet(0, 26), d.packet(26)
 
-        :param name: of attribute or function that is called
-        :return function or attribute from Deck object or collections.deque object
+        :param  start: index of the first card of the packet
+                stop: index after the last card of the packet. If None, the packet runs to the bottom of the deck
+        :return Deck: a new deck object, holding a read-only view on the cards of this deck
         """
-        if name == "__setstate__":
-            raise AttributeError(name)
-        
-        if hasattr(Deck, name):
-            return super(Deck, self).__getattribute__(name)
-        else:
-            f = getattr(self.cards, name)
-            if isinstance(getattr(self.cards, name), types.FunctionType):
-                f = f()
-            return f
+        view: np.ndarray = self.cards[start:stop]
+        view.flags.writeable = False
+        return self._from_buffer(view)
+
+    def __setstate__(self, state) -> None:
+        """
+        Restores a pickled Deck. Besides the state of this class, this also loads the pickles of the earlier Deck, which held its cards
+        in a deque (`_cards`).
+
+        :param  state: a tuple (None, slots) of this class, or the attribute dict {'_cards': deque} of the earlier Deck
+        :return None
+        """
+        if isinstance(state, dict):
+            self.cards = state['_cards']
+            return
+        _, slots = state
+        self._buffer = slots['_buffer']
+        self._start = slots['_start']
+
+    @classmethod
+    def _from_buffer(cls, buffer: np.ndarray):
+        """
+        Helper to create a Deck directly around a numpy array of cards, without converting or copying it.
+
+        :param  buffer: numpy array holding the cards
+        :return new instance of Deck, holding `buffer` as its cards
+        """
+        deck = cls.__new__(cls)
+        deck._buffer = buffer
+        deck._start = 0
+        for counts in _deck_counts:
+            counts['allocations'] += 1
+        return deck
 
     
     def init_new_deck(self, number_of_cards: int =52): # add type hinting
         """
-        This function initiates a new sequence of cards as a deque object. It initiates a sequence of n `number_of_cards`, and puts these in standard order.
+        This function initiates a new sequence of cards. It initiates a sequence of n `number_of_cards`, and puts these in standard order.
         E.g.:
             d = Deck()
             d.init_new_deck(52)
-            d.cards <- now holds a deque object with a sequence of [1,2,3...,52] cards
+            d.cards <- now holds a sequence of [1,2,3...,52] cards
 
         :param number_of_cards: the number of cards in the deck of cards. In standard order, from low to high
         :return self: this object returns itself. 
         """
-        self.cards: deque = deque(range(1, number_of_cards + 1))
+        self._buffer = np.arange(1, number_of_cards + 1, dtype=card_dtype(number_of_cards))
+        self._start = 0
         return self
     
     @property
-    def cards(self) -> deque:
+    def cards(self) -> np.ndarray:
         """
-        Property which returns the attribute self._cards, which holds a sequence of numbers, representing cards in a deck
-        Usage: when for an instance of a Deck `d`, d.cards is called, it calls this property and returns self._cards
+        Property which returns the cards in the deck, as a sequence of numbers representing cards in a deck
+        Usage: when for an instance of a Deck `d`, d.cards is called, it calls this property and returns the cards
 
         :param  None
-        :return self._cards, a collections.deque object which represents the cards in a deck
+        :return a numpy array which represents the cards in a deck, from top to bottom
         """
-        return self._cards
+        return self._buffer[self._start:]
     
 
     @cards.setter
-    def cards(self, c) -> deque:
+    def cards(self, c) -> None:
         """
-        This setter ensures that when a list is assigned to Deck.cards, it is converted to a collections.deque object.
+        This setter ensures that when a deque, list or other sequence is assigned to Deck.cards, it is converted to a numpy array.
 
         E.g.:
             c = [1,2,3,4]
             d = Deck()
-            d.cards = c  # c is a list here. This setter ensures its converted to collections.deque before setting it to self._cards
-            # such that: type(d.cards) is collections.deque
+            d.cards = c  # c is a list here. This setter ensures its converted to a numpy array before setting it to the deck
 
         :param  c:  a sequence of numbers representing a sequence of cards
         return  None: this setter does not return anything. It sets self.cards to c.
         """
-        if isinstance(c, list):
-            c = deque(c)
-        
-        self._cards: deque = c
-
-        return self._cards
+        if isinstance(c, Deck):
+            c = c.cards
+        c = np.asarray(c)
+        if c.dtype.kind not in "ui":
+            c = c.astype(np.int64)
+        self._buffer: np.ndarray = c.astype(card_dtype(int(c.max())) if len(c) else np.uint8)
+        self._start: int = 0
 
 
     @property
     def rising_sequences(self) -> int:
         """
-        This property/attribute can be called on an instance of Deck, it will return the number of rising sequences in self._cards (as an integer).
+        This property/attribute can be called on an instance of Deck, it will return the number of rising sequences in self.cards (as an integer).
         
         :param  None
-        :return number of rising sequences in self._cards, as int 
+        :return number of rising sequences in self.cards, as int 
         """
-        cards: np.array = np.array(self.cards)
-        inv_order: np.array = np.argsort(cards)
-        return sum(np.diff(inv_order) < 0) + 1
+        inv_order: np.ndarray = np.argsort(self.cards)
+        return int(np.count_nonzero(np.diff(inv_order) < 0)) + 1
     
 
     def get_rising_sequences(self) -> list:
         """
-        This method can returns a list of of lists, with the cards in the rising sequences.
+        This method can returns a list of of lists, with the cards in the rising sequences. The rising sequences are ordered by the position
+        of their first card in the deck.
 
-        E.g.: if self.cards contains [1,5,6,2,4,3,8,7], this function will return [[1,2,3], [5,6], [4], [8], [7]]
+        E.g.: if self.cards contains [1,5,6,2,4,3,8,7], this function will return [[1,2,3], [5,6,7], [4], [8]]
+
+        A rising sequence is a run of subsequent cards c, c+1, c+2, ... where each card lies below the previous card in the deck. Using the 
+        position of each card (the inverse permutation), the runs are found in O(n).
 
         :param  None
         return  list of lists containing the cards in each rising sequence in self.cards
-
-        Note for future development: this function can be optimised by implementing a collections.deque object in stead of using lists
         """
-        rising_sequences: list = []
-        nums: list = list(self.cards)
-        current_rising_sequence:list = [nums[0]]
-        
-        i: int = 0
-        while i < len(nums) and len(nums) > 1:          
-            for next_r in nums[i+1:]:
-                if next_r - current_rising_sequence[-1] == 1:
-                    index_r = nums.index(next_r)
-                    current_rising_sequence.append(nums.pop(index_r))
-
-            nums: list = [n for n in nums if n not in current_rising_sequence]
-            rising_sequences.append(current_rising_sequence)
-            if nums:
-                current_rising_sequence = [nums[0]]
-        
-        # if only one item is left, that is a rising sequence on its own
-        if nums:
-            rising_sequences.append(nums)
-        
-        return rising_sequences
+        cards: np.ndarray = self.cards
+        n_cards: int = len(cards)
+        if n_cards == 0:
+            return []
+
+        if cards.min() == 1 and cards.max() == n_cards:
+            # A full deck with the cards 1 to n: the position of each card is found with one scatter
+            sorted_cards: np.ndarray = np.arange(1, n_cards + 1)
+            positions: np.ndarray = inverse_permutation_batch(cards)
+        else:
+            # Any other set of cards, e.g. a packet: sort the cards to find their positions
+            positions: np.ndarray = np.argsort(cards, kind="stable")
+            sorted_cards: np.ndarray = cards[positions].astype(np.int64)
+
+        # A new rising sequence starts when the next card is not the subsequent card, or when it lies above the previous card
+        starts: np.ndarray = np.flatnonzero((np.diff(sorted_cards) != 1) | (np.diff(positions) < 0)) + 1
+        rising_sequences: list = [sequence.tolist() for sequence in np.split(sorted_cards, starts)]
+
+        first_card_positions: np.ndarray = positions[np.concatenate(([0], starts))]
+        return [rising_sequences[i] for i in np.argsort(first_card_positions)]
     
 
     def cut_deck(self, cut_position: int):
@@ -239,28 +344,133 @@ class Deck:
                 print(d) --> [3,4,1,2]
 
         :param  cut_position: the cut position of the deck (as an index)
-        :return self, this function alters self._cards and returns the instance
+        :return self, this function alters self.cards and returns the instance
         """
-
-        # This can be optimised further. Converting to list and then deque takes O(n) complexity
-        cards: list = list(self._cards)
-        top_packet: list = cards[:cut_position]
-        bottom_packet: list = cards[cut_position:]
-
-        cards_new_order: list = bottom_packet + top_packet
-        self.cards: deque = deque(cards_new_order)
+        cards: np.ndarray = self.cards
+        self._buffer = np.concatenate((cards[cut_position:], cards[:cut_position]))
+        self._start = 0
 
         return self
     
     
     def copy(self):
         """
-        Returns a copy of the instance of a Deck. Including a copy of the self.cards deque object and all of the elements (cards) within self.cards
+        Returns a copy of the instance of a Deck. Including a copy of the cards in the deck.
         
         :param  None
         :return Deck object, with a new id and memory allocation, all attributes from the original Deck also have a new id and memory allocation
         """
-        return deepcopy(self)
+        for counts in _deck_counts:
+            counts['copies'] += 1
+        return self._from_buffer(self.cards.copy())
+
+
+    def popleft(self) -> int:
+        """
+        Removes the top card from the deck and returns it, like collections.deque.popleft().
+
+        :param  None
+        :return the top card, as an integer
+        """
+        if self._start >= len(self._buffer):
+            raise IndexError("pop from an empty deck")
+        card: int = int(self._buffer[self._start])
+        self._start += 1
+        return card
+
+
+    def pop(self) -> int:
+        """
+        Removes the bottom card from the deck and returns it, like collections.deque.pop().
+
+        :param  None
+        :return the bottom card, as an integer
+        """
+        if self._start >= len(self._buffer):
+            raise IndexError("pop from an empty deck")
+        card: int = int(self._buffer[-1])
+        self._buffer = self._buffer[:-1]
+        return card
+
+
+    def insert(self, index: int, card: int) -> None:
+        """
+        Inserts a card in the deck at position `index`, like collections.deque.insert().
+
+        When a card was taken from the top of the deck before (e.g. with `popleft`), there is room in front of the top card. The cards above 
+        `index` are then moved up one place in the same buffer, so no new buffer is allocated. A read-only buffer (see `packet`) is
+        copied instead.
+
+        :param  index: the position to insert the card at (as an index)
+                card: the card to insert
+        :return None
+        """
+        n_cards: int = len(self)
+        if index < 0:
+            index = max(index + n_cards, 0)
+        index = min(index, n_cards)
+
+        if self._start > 0 and self._buffer.flags.writeable and card <= np.iinfo(self._buffer.dtype).max:
+            start: int = self._start
+            self._buffer[start - 1:start - 1 + index] = self._buffer[start:start + index]
+            self._buffer[start - 1 + index] = card
+            self._start = start - 1
+        else:
+            self.cards = np.insert(self.cards.astype(np.int64), index, card)
+
+
+    def append(self, card: int) -> None:
+        """
+        Adds a card to the bottom of the deck, like collections.deque.append().
+
+        :param  card: the card to add
+        :return None
+        """
+        self.insert(len(self), card)
+
+
+    def appendleft(self, card: int) -> None:
+        """
+        Adds a card to the top of the deck, like collections.deque.appendleft().
+
+        :param  card: the card to add
+        :return None
+        """
+        self.insert(0, card)
+
+
+    def extendleft(self, cards) -> None:
+        """
+        Adds cards to the top of the deck one by one, like collections.deque.extendleft(). Note that this reverses the order of `cards`.
+
+        :param  cards: a sequence of cards
+        :return None
+        """
+        self.cards = np.concatenate((np.asarray(list(cards), dtype=np.int64)[::-1], self.cards))
+
+
+    def reverse(self) -> None:
+        """
+        Reverses the order of the cards in the deck in place, like collections.deque.reverse().
+
+        :param  None
+        :return None
+        """
+        self._buffer = self.cards[::-1].copy()
+        self._start = 0
+
+
+    def index(self, card: int) -> int:
+        """
+        Returns the position (as an index) of `card` in the deck, like collections.deque.index().
+
+        :param  card: the card to look for
+        :return the index of the card in the deck
+        """
+        positions: np.ndarray = np.flatnonzero(self.cards == card)
+        if len(positions) == 0:
+            raise ValueError(f"{card} is not in deck")
+        return int(positions[0])
 
 
 if __name__ == "__main__":
@@ -271,15 +481,61 @@ if __name__ == "__main__":
     d.cards = deque([1, 2, 4, 3, 5])
     assert d.rising_sequences == 2
 
-    d.cards = deque([3,4,1,5,7,6,2,3,8,9,10])
+    d.cards = deque([3,4,1,5,8,7,2,6,9,10])
     assert d.rising_sequences == 4
     
     d.init_new_deck(52)
     assert d.rising_sequences == 1
-    d.cards.reverse()
+    d.reverse()
     assert d.rising_sequences == 52
 
-    # Assert the correct len of the deck of cards AND check if __getattr__ calls the correct order of functions/attributes 
+    # Assert the correct len of the deck of cards AND check if the deque-like functions alter the cards in the deck
     org_len = len(d)
     d.popleft()
-    assert org_len == len(d) + 1
\ No newline at end of file
+    assert org_len == len(d) + 1
+    d.insert(3, 52)
+    assert org_len == len(d) and d[3] == 52 and d.index(52) == 3
+
+    # Assert a copy of the deck does not share its cards with the original deck
+    d.init_new_deck(52)
+    c = d.copy()
+    c.cut_deck(10)
+    assert list(c) == list(range(11, 53)) + list(range(1, 11))
+    assert list(d) == list(range(1, 53))
+    assert list(d[:3]) == [1, 2, 3]
+
+    # Assert a packet is a view on the cards of the deck, with the same cards as a slice
+    packet = d.packet(10, 20)
+    assert list(packet) == list(d[10:20]) and np.shares_memory(packet.cards, d.cards) and list(d.packet(50)) == [51, 52]
+
+    # Assert changing a packet never changes the deck it was taken from
+    try:
+        packet.cards[0] = 1
+        assert False
+    except ValueError:
+        pass
+    packet.popleft()
+    packet.insert(2, 1)
+    assert list(packet) == [12, 13, 1] + list(range(14, 21)) and list(d) == list(range(1, 53))
+
+    # Assert a pickled Deck loads, and so does a pickle of the earlier Deck that held a deque in `_cards`
+    import pickle
+    d.popleft()
+    assert list(pickle.loads(pickle.dumps(d))) == list(range(2, 53))
+    earlier = Deck.__new__(Deck)
+    earlier.__setstate__({'_cards': deque([3, 1, 2])})
+    assert list(earlier) == [3, 1, 2] and earlier.rising_sequences == 2
+    d.init_new_deck(52)
+
+    # Assert the rising sequences of a deck are found in the right order
+    d.cards = [1, 5, 6, 2, 4, 3, 8, 7]
+    assert d.get_rising_sequences() == [[1, 2, 3], [5, 6, 7], [4], [8]]
+    assert len(d.get_rising_sequences()) == d.rising_sequences
+    assert d[2:6].get_rising_sequences() == [[6], [2, 3], [4]]
+
+    # Assert the batched number of rising sequences is equal to the number of rising sequences of each Deck
+    np.random.seed(2023)
+    decks = np.array([np.random.permutation(np.arange(1, 53)) for _ in range(100)])
+    assert rising_sequences_batch(decks).tolist() == [Deck(d).rising_sequences for d in decks]
+    assert rising_sequences_batch(decks).tolist() == [len(Deck(d).get_rising_sequences()) for d in decks]
+    assert (rising_sequences_batch(new_deck_batch(10, 52)) == 1).all()
@@ -0,0 +1,299 @@
+import itertools
+import math
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+import numpy as np
+from deck import card_dtype
+import stats
+
+
+# Maximum size in bytes of the index maps of a kernel that are kept in memory, see `exact_distributions`. Larger kernels (e.g. the riffle
+# shuffle of 9 cards, 730 MB) are computed once in blocks of this size, and kept in a temporary file on disk between the shuffles.
+MAX_KERNEL_BYTES: int = 512 * 1024**2
+
+
+@lru_cache(maxsize=4)
+def all_permutations(n: int) -> np.ndarray:
+    """
+    Returns all n! decks of the cards 1 to n, in the order of their Lehmer code (which is the lexicographic order).
+    Row i holds the deck with Lehmer rank i, see `lehmer_rank`. Row 0 is the new deck 1, 2, ..., n.
+
+    :param  n: number of cards
+    :return read-only numpy array with shape (n!, n)
+    """
+    decks: np.ndarray = np.array(list(itertools.permutations(range(1, n + 1))), dtype=card_dtype(n)).reshape(-1, n)
+    decks.flags.writeable = False
+    return decks
+
+
+def lehmer_rank(decks: np.ndarray) -> np.ndarray:
+    """
+    Returns the rank of each deck in the order of all permutations (see `all_permutations`), computed from its Lehmer code:
+    the i-th digit is the number of cards after position i that are lower than the card on position i, and the rank is the sum of
+    digit i times (n - 1 - i)!.
+
+    E.g.:
+        lehmer_rank(np.array([[1, 2, 3], [2, 3, 1], [3, 2, 1]])) --> array([0, 3, 5])
+
+    :param  decks: numpy array with shape (..., n_cards), holding permutations
+    :return numpy array with shape (...), with the rank of each deck (0 to n! - 1)
+    """
+    n: int = decks.shape[-1]
+    ranks: np.ndarray = np.zeros(decks.shape[:-1], dtype=np.int64)
+    for i in range(n - 1):
+        digit: np.ndarray = np.zeros(decks.shape[:-1], dtype=np.int64)
+        for j in range(i + 1, n):
+            digit += decks[..., j] < decks[..., i]
+        ranks += digit * math.factorial(n - 1 - i)
+    return ranks
+
+
+def _merge_kernel(shuffled: np.ndarray, probabilities: np.ndarray) -> tuple:
+    """
+    Helper function that adds up the probabilities of shuffles that give the same permutation, and drops shuffles with probability 0.
+    """
+    ranks: np.ndarray = lehmer_rank(shuffled)
+    unique_ranks, first, inverse = np.unique(ranks, return_index=True, return_inverse=True)
+    merged: np.ndarray = np.bincount(inverse.ravel(), weights=probabilities, minlength=len(unique_ranks))
+    keep: np.ndarray = merged > 0
+    return shuffled[first][keep], merged[keep]
+
+
+def _interleave_kernel(n: int, a: int, packet_size_probability) -> tuple:
+    """
+    Helper function for the shuffles that cut the deck in a packets and interleave them uniformly: each sequence of a packet label per
+    position of the shuffled deck is enumerated. The cards of packet j are taken in order from the j-th part of the deck.
+    The probability of a label sequence is the probability of its packet sizes, divided by the number of interleavings with these sizes.
+    """
+    labels: np.ndarray = np.array(list(itertools.product(range(a), repeat=n)), dtype=np.int64).reshape(-1, n)
+    sizes: np.ndarray = np.stack([(labels == j).sum(axis=1) for j in range(a)], axis=1)
+
+    n_interleavings: np.ndarray = np.array([math.factorial(n) // math.prod(math.factorial(s) for s in row) for row in sizes.tolist()])
+    probabilities: np.ndarray = np.array([packet_size_probability(tuple(row)) for row in sizes.tolist()]) / n_interleavings
+
+    # The original card m goes to the m-th position in the stable order of the labels, see shuffles.a_shuffle_batch
+    shuffled: np.ndarray = np.empty(labels.shape, dtype=card_dtype(n))
+    np.put_along_axis(shuffled, np.argsort(labels, axis=1, kind="stable"), np.arange(1, n + 1, dtype=shuffled.dtype)[None, :], axis=1)
+    return _merge_kernel(shuffled, probabilities)
+
+
+def riffle_shuffle_kernel(n: int) -> tuple:
+    """
+    Kernel of the riffle shuffle (gsr.riffle_shuffle after gsr.get_cut_position): a binomial(n, 1/2) cut, and a uniformly random
+    interleaving of the two packets.
+
+    A kernel is a tuple (shuffled, probabilities): shuffled[i] is the new deck after a shuffle with probability probabilities[i].
+    A deck `d` (numpy array) becomes d[shuffled[i] - 1] after this shuffle. The shuffled decks are unique.
+
+    :param  n: number of cards
+    :return tuple with a numpy array with shape (shuffles, n), and a numpy array with the probabilities of the shuffles
+    """
+    return _interleave_kernel(n, 2, lambda sizes: math.comb(n, sizes[0]) / 2**n)
+
+
+def a_shuffle_batch_kernel(n: int, a: int) -> tuple:
+    """
+    Kernel of the a-shuffle of shuffles.a_shuffle_batch: every sequence of base-a digits is equally likely. For a = 2 this is the riffle
+    shuffle. See `riffle_shuffle_kernel` for the layout of a kernel.
+    """
+    return _interleave_kernel(n, a, lambda sizes: math.factorial(n) / math.prod(math.factorial(s) for s in sizes) / a**n)
+
+
+def a_shuffle_kernel(n: int, a: int) -> tuple:
+    """
+    Kernel of shuffles.a_shuffle: a - 1 cuts with gsr.get_cut_position(deck, 1/a), each a binomial(n, 1/a) number of cards after the
+    previous cut (the packets are cut off the deck in order, a cut beyond the bottom of the deck gives empty packets), and a uniformly
+    random interleaving of the packets. See `riffle_shuffle_kernel` for the layout of a kernel.
+
+    For a = 2 this is the riffle shuffle. For a > 2 the packet sizes are not multinomial, so the distribution differs from the a-shuffle 
+    of `a_shuffle_batch_kernel`.
+    """
+    cut_probability: list = [math.comb(n, c) * (1 / a)**c * (1 - 1 / a)**(n - c) for c in range(n + 1)]
+
+    size_probabilities: dict = {}
+    for cuts in itertools.product(range(n + 1), repeat=a - 1):
+        sizes: list = []
+        total: int = 0
+        for cut in cuts:
+            size: int = min(cut, n - total)
+            sizes.append(size)
+            total += size
+        sizes.append(n - total)
+        key: tuple = tuple(sizes)
+        size_probabilities[key] = size_probabilities.get(key, 0.0) + math.prod(cut_probability[c] for c in cuts)
+
+    return _interleave_kernel(n, a, lambda sizes: size_probabilities.get(sizes, 0.0))
+
+
+def top_in_at_random_kernel(n: int) -> tuple:
+    """
+    Kernel of one move of shuffles.top_in_at_random_shuffle: the top card is inserted at one of the n positions, uniformly.
+    See `riffle_shuffle_kernel` for the layout of a kernel.
+    """
+    shuffled: list = []
+    for position in range(n):
+        cards: list = list(range(2, n + 1))
+        cards.insert(position, 1)
+        shuffled.append(cards)
+    return _merge_kernel(np.array(shuffled, dtype=card_dtype(n)), np.full(n, 1 / n))
+
+
+def overhand_shuffle_kernel(n: int, p: float = 0.2) -> tuple:
+    """
+    Kernel of shuffles.overhand_shuffle: clumps are taken off the top of the deck, each clump has a binomial(cards left, p) size,
+    redrawn when it is 0, and the order of the clumps is reversed. Every composition of n into clump sizes is enumerated.
+    See `riffle_shuffle_kernel` for the layout of a kernel.
+    """
+    def clump_probability(size: int, cards_left: int) -> float:
+        return math.comb(cards_left, size) * p**size * (1 - p)**(cards_left - size) / (1 - (1 - p)**cards_left)
+
+    shuffled: list = []
+    probabilities: list = []
+    for n_bounds in range(n):
+        for bounds in itertools.combinations(range(1, n), n_bounds):
+            starts: tuple = (0,) + bounds
+            ends: tuple = bounds + (n,)
+            probabilities.append(math.prod(clump_probability(end - start, n - start) for start, end in zip(starts, ends)))
+            shuffled.append([card for start, end in zip(starts[::-1], ends[::-1]) for card in range(start + 1, end + 1)])
+
+    return _merge_kernel(np.array(shuffled, dtype=card_dtype(n)), np.array(probabilities))
+
+
+# The kernels of the shuffle models, by name. Each takes the number of cards and the parameters of the shuffle.
+KERNELS: dict = {
+    "riffle_shuffle": riffle_shuffle_kernel,
+    "a_shuffle": a_shuffle_kernel,
+    "a_shuffle_batch": a_shuffle_batch_kernel,
+    "top_in_at_random_shuffle": top_in_at_random_kernel,
+    "overhand_shuffle": overhand_shuffle_kernel,
+}
+
+
+def _index_maps(shuffled: np.ndarray) -> np.ndarray:
+    """
+    Helper function that returns, for each shuffle of a kernel and each deck y (by rank), the rank of the deck x that becomes y after
+    the shuffle. With these maps, the distribution after one more shuffle is a weighted sum of gathers of the current distribution.
+    """
+    n: int = shuffled.shape[1]
+    decks: np.ndarray = all_permutations(n)
+    maps: np.ndarray = np.empty((len(shuffled), len(decks)), dtype=np.int32)
+    for i, s in enumerate(shuffled):
+        # x[s - 1] = y, so x = y[inverse of s - 1]
+        inverse: np.ndarray = np.argsort(s)
+        maps[i] = lehmer_rank(decks[:, inverse])
+    return maps
+
+
+def exact_distributions(model: str, n: int, max_k: int, **params):
+    """
+    Yields the exact distribution of the deck after k = 1 to max_k shuffles of a new deck of n cards, over all n! decks.
+
+    The distribution is a vector indexed by Lehmer rank (see `all_permutations`). Each shuffle moves the probability of deck x to the
+    decks x[s - 1], for each shuffle s of the kernel of the model (see KERNELS). The index maps of these moves take kernel size * n! * 4
+    bytes and are computed once. Above MAX_KERNEL_BYTES they are kept in a temporary file on disk, which is removed when the generator is
+    closed. So this is meant for decks up to 9 cards: the riffle shuffle of 9 cards takes about 730 MB of disk and 20 seconds to compute
+    the maps, that of 10 cards would take about 15 GB.
+
+    :param  model: name of the shuffle model, one of the keys in KERNELS
+            n: number of cards
+            max_k: number of shuffles
+            **params: parameters of the kernel, e.g. a for the a-shuffle, p for the overhand shuffle
+    :return generator, yielding a numpy array with shape (n!,) after each shuffle. distribution[i] is the probability of all_permutations(n)[i]
+    """
+    if model not in KERNELS:
+        raise ValueError(f"Unknown shuffle model '{model}', choose one of {list(KERNELS)}.")
+    shuffled, probabilities = KERNELS[model](n, **params)
+
+    n_decks: int = math.factorial(n)
+    if len(shuffled) * n_decks * 4 <= MAX_KERNEL_BYTES:
+        yield from _iter_distributions(_index_maps(shuffled), probabilities, max_k)
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        maps: np.ndarray = np.lib.format.open_memmap(Path(folder) / "maps.npy", mode="w+", dtype=np.int32, shape=(len(shuffled), n_decks))
+        block_size: int = max(1, MAX_KERNEL_BYTES // (n_decks * 4))
+        for first in range(0, len(shuffled), block_size):
+            maps[first:first + block_size] = _index_maps(shuffled[first:first + block_size])
+        try:
+            yield from _iter_distributions(maps, probabilities, max_k)
+        finally:
+            del maps  # close the file before the folder is removed
+
+
+def _iter_distributions(maps: np.ndarray, probabilities: np.ndarray, max_k: int):
+    """
+    Helper function that yields the distributions after 1 to max_k shuffles of a new deck, from the index maps of a kernel (see
+    `_index_maps`) and the probabilities of its shuffles.
+    """
+    distribution: np.ndarray = np.zeros(maps.shape[1])
+    distribution[0] = 1.0
+    for _ in range(max_k):
+        new_distribution: np.ndarray = np.zeros(len(distribution))
+        for index_map, probability in zip(maps, probabilities):
+            new_distribution += probability * distribution[index_map]
+        distribution = new_distribution
+        yield distribution
+
+
+def exact_total_variation_distance(model: str, n: int, max_k: int, **params) -> np.ndarray:
+    """
+    Exact total variation distance between the deck after k shuffles and the uniform distribution (stats.uniform), for k = 1 to max_k.
+    See `exact_distributions`.
+
+    E.g.: the TVD of 1 to 30 overhand shuffles of a deck of 8 cards
+        exact_total_variation_distance("overhand_shuffle", 8, 30, p=0.25)
+
+    :return numpy array with shape (max_k,). tvd[k - 1] is the TVD after k shuffles
+    """
+    uniform_probability: float = stats.uniform(n)
+    return np.array([np.abs(distribution - uniform_probability).sum() / 2 for distribution in exact_distributions(model, n, max_k, **params)])
+
+
+if __name__ == "__main__":
+    from deck import Deck
+    import gsr
+    import shuffles
+
+    assert lehmer_rank(np.array([[1, 2, 3], [2, 3, 1], [3, 2, 1]])).tolist() == [0, 3, 5]
+    assert (lehmer_rank(all_permutations(6)) == np.arange(720)).all()
+
+    # The kernels should be probability distributions
+    for model, params in [("riffle_shuffle", {}), ("a_shuffle", {'a': 3}), ("a_shuffle_batch", {'a': 3}),
+                          ("top_in_at_random_shuffle", {}), ("overhand_shuffle", {'p': 0.25})]:
+        shuffled, probabilities = KERNELS[model](6, **params)
+        assert abs(probabilities.sum() - 1) < 1e-12 and len(np.unique(lehmer_rank(shuffled))) == len(shuffled)
+
+    # The exact TVD of the riffle shuffle and a-shuffle should match the theoretical TVD, based on the rising sequences
+    for n in [5, 7]:
+        for model, a, params in [("riffle_shuffle", 2, {}), ("a_shuffle_batch", 3, {'a': 3})]:
+            tvd = exact_total_variation_distance(model, n, 6, **params)
+            for k in range(1, 7):
+                assert abs(tvd[k - 1] - stats._theoretical_total_variation_distance(a, n, k)) < 1e-12
+
+    # The kernels should match the frequencies of the shuffles in shuffles.py and gsr.py
+    def frequencies(shuffle, n, n_samples=40000):
+        np.random.seed(2023)
+        counts = np.zeros(math.factorial(n))
+        for _ in range(n_samples):
+            counts[lehmer_rank(shuffle(Deck().init_new_deck(n)).cards[None, :])[0]] += 1
+        return counts / n_samples
+
+    n = 4
+    for model, params, shuffle in [
+        ("riffle_shuffle", {}, lambda d: gsr.riffle_shuffle(*(lambda c: (d[:c], d[c:]))(gsr.get_cut_position(d)))),
+        ("a_shuffle", {'a': 3}, lambda d: shuffles.a_shuffle(d, 3)),
+        ("top_in_at_random_shuffle", {}, shuffles.top_in_at_random_shuffle),
+        ("overhand_shuffle", {'p': 0.25}, lambda d: shuffles.overhand_shuffle(d, p=0.25)),
+    ]:
+        exact = next(exact_distributions(model, n, 1, **params))
+        assert np.abs(exact - frequencies(shuffle, n)).max() < 0.01, model
+
+    # Top in at random: after k moves of 4 cards, the TVD decreases, and the first move is 1 of 4 insertions
+    tvd = exact_total_variation_distance("top_in_at_random_shuffle", 4, 20)
+    assert (np.diff(tvd) <= 1e-12).all() and abs(tvd[0] - (1 - 4 / 24)) < 1e-12
+
+    # Kernels above MAX_KERNEL_BYTES are kept on disk, with the same distributions
+    in_memory = list(exact_distributions("riffle_shuffle", 6, 3))
+    MAX_KERNEL_BYTES = 10000
+    assert all(np.array_equal(a, b) for a, b in zip(in_memory, exact_distributions("riffle_shuffle", 6, 3)))
@@ -1,8 +1,8 @@
 import numpy as np
-from deck import Deck
+from deck import Deck, new_deck_batch
 
 
-def get_cut_position(deck: Deck, p: float=0.5) -> np.ndarray:
+def get_cut_position(deck: Deck, p: float=0.5, rng=None) -> np.ndarray:
     """
     Given an instance of Deck, this function returns a cut position, as an index (int), to use to cut the deck of cards.
     The cut position is determined according to the binomial distribution, as described in the paper, with parameter p.
@@ -19,15 +19,17 @@ def get_cut_position(deck: Deck, p: float=0.5) -> np.ndarray:
 
     :param  deck: instance of Deck of cards, holding cards in Deck.cards
             p: binomial parameter, to determine the cut position.
+            rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
 
     :return the index of the cut as an integer.
     """
+    rng = np.random if rng is None else rng
 
     n: int = len(deck.cards)
-    return np.random.binomial(n=n, p=p)
+    return rng.binomial(n=n, p=p)
     
 
-def drop_from_left_stack(n_left: int, n_right: int) -> bool:
+def drop_from_left_stack(n_left: int, n_right: int, rng=None) -> bool:
     """
     This function takes the number of cards (as integers) in the two decks, and returns a boolean (True/False), if a card should be dropped
     from the the left deck (the number of cards passed as `n_left`). 
@@ -40,13 +42,14 @@ def drop_from_left_stack(n_left: int, n_right: int) -> bool:
 
     :param  n_left: number of cards in the left packet
             n_right: number of cards in the right packet
+            rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
 
     :return boolean indicating if a card should be dropped from the packet corresponding to n_left
     """
 
     if n_left > 0 and n_right > 0:
         prob_n_left: float = (n_left) / (n_left + n_right)
-        uniform_random: float = np.random.random()
+        uniform_random: float = (np.random if rng is None else rng).random()
         return prob_n_left > uniform_random
         
     elif n_left == 0 and n_right > 0:
@@ -59,7 +62,7 @@ def drop_from_left_stack(n_left: int, n_right: int) -> bool:
         raise ValueError("n_left and n_right can not both be zero.")
 
 
-def riffle_shuffle(left_packet: Deck, right_packet: Deck) -> Deck:
+def riffle_shuffle(left_packet: Deck, right_packet: Deck, rng=None, out: np.ndarray = None) -> Deck:
     """
     This function simulates a riffle shuffle, given a left packet (instance of Deck) and a right packet (instance of Deck). 
     It returns a new Deck object with Deck.cards shuffled according to the riffle shuffle, decsribed in the paper by Diaconis.
@@ -67,29 +70,98 @@ def riffle_shuffle(left_packet: Deck, right_packet: Deck) -> Deck:
     This function makes a new instance of a Deck (pile), and assigns cards from the either the left_packet or right_packet to the pile.cards variable according to the function
     `drop_from_left_stack`.
 
+    The packets are only read, so they can be views on the deck that was cut (see `Deck.packet`). The shuffled cards are written into
+    `out` when it is given, so a caller can reuse a buffer instead of allocating a new one for each shuffle.
+
     :param  left_packet: an instance of Deck, which holds the left packet of cards after a cut
             right_packet: an instance of Deck, which holds the left packet of cards after a cut
+            rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
+            out: numpy array with room for the cards of both packets, that holds the shuffled cards. It must not overlap the packets.
+                 If None, a new array is allocated
 
     return: pile: a new instance of Deck, which holds Deck.cards with riffle shuffled cards.
     """
 
     n_left: int = len(left_packet)
     n_right: int = len(right_packet)
+    left_cards: np.ndarray = left_packet.cards
+    right_cards: np.ndarray = right_packet.cards
 
-    pile: Deck = Deck()
-
-    while left_packet or right_packet:
-        if drop_from_left_stack(n_left, n_right):
-            card_to_drop: int = left_packet.cards.popleft()
-            n_left -= 1
+    # The shuffled cards are written into one preallocated array, instead of dropping the cards one by one onto a new pile
+    if out is None:
+        pile_cards: np.ndarray = np.empty(n_left + n_right, dtype=np.result_type(left_cards, right_cards))
+    else:
+        pile_cards: np.ndarray = out[:n_left + n_right]
+    i_left: int = 0
+    i_right: int = 0
+
+    for position in range(n_left + n_right):
+        if drop_from_left_stack(n_left - i_left, n_right - i_right, rng=rng):
+            pile_cards[position] = left_cards[i_left]
+            i_left += 1
         else:
-            card_to_drop: int = right_packet.cards.popleft()
-            n_right -= 1        
-        pile.cards.append(card_to_drop)
+            pile_cards[position] = right_cards[i_right]
+            i_right += 1
 
+    pile: Deck = Deck._from_buffer(pile_cards)
     return pile
 
 
+def get_cut_positions(decks: np.ndarray, p: float=0.5, rng=None) -> np.ndarray:
+    """
+    Batched version of `get_cut_position`. Given a 2-D array of decks, with shape (n_decks, n_cards), this function returns one cut position
+    per deck, drawn from the binomial distribution with parameter p.
+
+    :param  decks: 2-D numpy array, each row holds the cards of a deck
+            p: binomial parameter, to determine the cut positions
+            rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
+
+    :return 1-D numpy array with the index of the cut, for each deck
+    """
+    rng = np.random if rng is None else rng
+    n_decks, n_cards = decks.shape
+    return rng.binomial(n=n_cards, p=p, size=n_decks)
+
+
+def riffle_shuffle_batch(decks: np.ndarray, p: float=0.5, rng=None) -> np.ndarray:
+    """
+    This function applies one riffle shuffle to every deck in a batch of decks at once. It returns a new 2-D array with the shuffled decks.
+
+    For each deck, the cut position is drawn from the binomial distribution (see `get_cut_positions`). Dropping cards from the left and right
+    packets with a probability proportional to the packet sizes (see `drop_from_left_stack`) makes every interleaving of the two packets
+    equally likely. So instead of dropping the cards one by one, a uniformly random set of `cut_position` positions in the shuffled deck is
+    chosen for the cards of the left packet. The remaining positions get the cards of the right packet. Within each packet, the order of the
+    cards is kept. This gives the Gilbert-Shannon-Reeds distribution, as described in the paper by Diaconis.
+
+    E.g.:
+        decks = new_deck_batch(100000, 52)
+        shuffled_decks = riffle_shuffle_batch(decks)
+
+    :param  decks: 2-D numpy array with shape (n_decks, n_cards), each row holds the cards of a deck
+            p: binomial parameter, to determine the cut positions
+            rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
+
+    :return 2-D numpy array with shape (n_decks, n_cards), holding the riffle shuffled decks
+    """
+    rng = np.random if rng is None else rng
+    n_decks, n_cards = decks.shape
+    positions: np.ndarray = np.arange(n_cards)
+
+    cut_positions: np.ndarray = get_cut_positions(decks, p=p, rng=rng)[:, None]
+
+    # A random ordering of the positions in the shuffled deck, the first `cut_position` positions receive the cards of the left packet
+    position_order: np.ndarray = np.argsort(rng.random((n_decks, n_cards)), axis=1)
+    from_left: np.ndarray = np.empty((n_decks, n_cards), dtype=bool)
+    np.put_along_axis(from_left, position_order, positions < cut_positions, axis=1)
+
+    # For each position in the shuffled deck, find the index of the card in the original deck
+    left_index: np.ndarray = np.cumsum(from_left, axis=1) - 1
+    right_index: np.ndarray = cut_positions + positions - left_index - 1
+    source_index: np.ndarray = np.where(from_left, left_index, right_index)
+
+    return np.take_along_axis(decks, source_index, axis=1)
+
+
 if __name__ == "__main__":
     number_of_cards_in_deck: int = 52
     deck = Deck()
@@ -109,3 +181,10 @@ if __name__ == "__main__":
     
     # number of rising sequences can not be more than 2, after 1 riffle shuffle
     assert deck.rising_sequences <= 2
+
+    # test the batched riffle shuffle: each shuffled deck holds the same cards, and has at most 2 rising sequences
+    decks: np.ndarray = new_deck_batch(1000, number_of_cards_in_deck)
+    shuffled_decks: np.ndarray = riffle_shuffle_batch(decks)
+    assert shuffled_decks.shape == decks.shape
+    assert (np.sort(shuffled_decks, axis=1) == decks).all()
+    assert all(Deck(list(d)).rising_sequences <= 2 for d in shuffled_decks)
@@ -0,0 +1,237 @@
+import time
+from contextlib import contextmanager, nullcontext
+import numpy as np
+import deck
+
+
+# Methods of numpy.random.Generator (and of the np.random module) that draw random numbers, and are counted by `CountingRNG`
+RNG_METHODS: tuple = ("binomial", "geometric", "integers", "randint", "random", "permutation", "permuted", "shuffle", "choice")
+
+
+class CountingRNG:
+    """
+    Wraps a source of random numbers (a numpy.random.Generator, or the np.random module) and counts the calls and the number of random
+    numbers drawn per method. The random numbers are not changed: a simulation gives the same result with or without the wrapper.
+    """
+    def __init__(self, rng, calls: dict, draws: dict):
+        self._rng = rng
+        self._calls: dict = calls
+        self._draws: dict = draws
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._rng, name)
+        if name not in RNG_METHODS:
+            return attribute
+
+        def counted(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            self._calls[name] = self._calls.get(name, 0) + 1
+            self._draws[name] = self._draws.get(name, 0) + (getattr(result, 'size', 1) if result is not None else len(args[0]))
+            return result
+        return counted
+
+
+class Instrumentation:
+    """
+    Collects measurements while a simulation runs. Pass an instance as `instrumentation` to one of the simulation functions in
+    simulation.py, e.g. `riffle_shuffle_simulation(..., instrumentation=Instrumentation())`. Without it (the default), nothing is measured,
+    and the simulation only pays for a few no-op calls.
+
+    It measures:
+        - phase_times and phase_calls: the time spent in, and the number of calls of, each phase of the simulation loop, e.g. 'cut',
+          'shuffle', 'copy' and 'record' (appending the kept decks to the result)
+        - rng_calls and rng_draws: the number of calls and the number of random numbers drawn, per method of the random number generator
+        - deck_allocations and deck_copies: the number of Deck objects that are created, and how many of them are copies (Deck.copy)
+        - throughput: every `interval` seconds `callback` is called with a progress report (see `progress`), with trials/sec, decks/sec
+          and the estimated time to finish (ETA)
+
+    E.g.: print the progress every 10 seconds, and the time per phase at the end
+        instrumentation = Instrumentation(callback=print, interval=10)
+        results = simulation.overhand_shuffle_simulation(5000, 52, 2800, instrumentation=instrumentation)
+        print(instrumentation.report())
+    """
+    def __init__(self, callback=None, interval: float = 1.0):
+        self.callback = callback
+        self.interval: float = interval
+
+        self.phase_times: dict = {}
+        self.phase_calls: dict = {}
+        self.rng_calls: dict = {}
+        self.rng_draws: dict = {}
+        self.deck_counts: dict = {'allocations': 0, 'copies': 0}
+
+        self.n_trials: int = None
+        self.trials_done: int = 0
+        self.decks_done: int = 0
+        self.start_time: float = None
+        self.end_time: float = None
+        self._last_callback_time: float = None
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Context manager that adds the time spent in its block to the phase `name`.
+        """
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_times[name] = self.phase_times.get(name, 0.0) + time.perf_counter() - start
+            self.phase_calls[name] = self.phase_calls.get(name, 0) + 1
+
+    def wrap_rng(self, rng):
+        """
+        Returns `rng` (or the np.random module when rng is None) wrapped in a CountingRNG, that counts the random numbers drawn.
+        """
+        return CountingRNG(np.random if rng is None else rng, self.rng_calls, self.rng_draws)
+
+    def start(self, n_trials: int) -> None:
+        """
+        Called by the simulation when it starts. Starts counting the Deck allocations (see deck._deck_counts). Other running
+        Instrumentations keep counting as well, so the Deck allocations of a nested simulation are also counted by the outer one.
+        """
+        self.n_trials = n_trials
+        self.trials_done = 0
+        self.decks_done = 0
+        self.start_time = self._last_callback_time = time.perf_counter()
+        self.end_time = None
+        if not any(counts is self.deck_counts for counts in deck._deck_counts):
+            deck._deck_counts.append(self.deck_counts)
+
+    def update(self, n_trials: int = 1, n_decks: int = 0) -> None:
+        """
+        Called by the simulation when `n_trials` trials are done, in which `n_decks` decks were shuffled. Calls `callback` with a progress
+        report when `interval` seconds have passed since the last report.
+        """
+        self.trials_done += n_trials
+        self.decks_done += n_decks
+        if self.callback is not None and time.perf_counter() - self._last_callback_time >= self.interval:
+            self._last_callback_time = time.perf_counter()
+            self.callback(self.progress())
+
+    def finish(self) -> None:
+        """
+        Called by the simulation when all trials are done. Stops counting the Deck allocations, and calls `callback` a last time.
+        """
+        self.end_time = time.perf_counter()
+        deck._deck_counts[:] = [counts for counts in deck._deck_counts if counts is not self.deck_counts]
+        if self.callback is not None:
+            self.callback(self.progress())
+
+    @property
+    def elapsed(self) -> float:
+        if self.start_time is None:
+            return 0.0
+        return (self.end_time if self.end_time is not None else time.perf_counter()) - self.start_time
+
+    def progress(self) -> dict:
+        """
+        Returns a progress report: the number of trials done (of n_trials), the elapsed time, trials/sec, decks/sec and the ETA in seconds.
+        """
+        elapsed: float = self.elapsed
+        trials_per_second: float = self.trials_done / elapsed if elapsed > 0 else 0.0
+        remaining: int = (self.n_trials or 0) - self.trials_done
+        return {
+            'trials_done': self.trials_done,
+            'n_trials': self.n_trials,
+            'elapsed': elapsed,
+            'trials_per_second': trials_per_second,
+            'decks_per_second': self.decks_done / elapsed if elapsed > 0 else 0.0,
+            'eta': remaining / trials_per_second if trials_per_second > 0 else None,
+        }
+
+    def report(self) -> dict:
+        """
+        Returns all measurements: the progress report, the phase times and calls, the random numbers drawn, and the Deck allocations.
+        """
+        return {
+            **self.progress(),
+            'phase_times': dict(self.phase_times),
+            'phase_calls': dict(self.phase_calls),
+            'rng_calls': dict(self.rng_calls),
+            'rng_draws': dict(self.rng_draws),
+            'deck_allocations': self.deck_counts['allocations'],
+            'deck_copies': self.deck_counts['copies'],
+        }
+
+
+class _NoInstrumentation:
+    """
+    Stand-in for Instrumentation that measures nothing. Used by the simulations when no instrumentation is given, so the simulation loops
+    do not need to check for None.
+    """
+    _no_phase = nullcontext()
+
+    def phase(self, name: str):
+        return self._no_phase
+
+    def wrap_rng(self, rng):
+        return rng
+
+    def start(self, n_trials: int) -> None:
+        pass
+
+    def update(self, n_trials: int = 1, n_decks: int = 0) -> None:
+        pass
+
+    def finish(self) -> None:
+        pass
+
+
+NO_INSTRUMENTATION = _NoInstrumentation()
+
+
+def get_instrumentation(instrumentation: Instrumentation = None):
+    """
+    Returns `instrumentation`, or NO_INSTRUMENTATION when it is None.
+    """
+    return NO_INSTRUMENTATION if instrumentation is None else instrumentation
+
+
+if __name__ == "__main__":
+    import simulation
+
+    # The results with instrumentation should be identical to the results without it
+    reports = []
+    instrumentation = Instrumentation(callback=reports.append, interval=0)
+    np.random.seed(2023)
+    measured = simulation.riffle_shuffle_simulation(20, 52, 5, instrumentation=instrumentation)
+    np.random.seed(2023)
+    unmeasured = simulation.riffle_shuffle_simulation(20, 52, 5)
+    assert [[d.cards.tolist() for d in trial] for trial in measured] == [[d.cards.tolist() for d in trial] for trial in unmeasured]
+
+    report = instrumentation.report()
+    assert report['trials_done'] == 20 and report['n_trials'] == 20 and len(reports) == 21
+    assert report['phase_calls'] == {'cut': 100, 'shuffle': 100, 'record': 100}
+    assert report['rng_calls']['binomial'] == 100 and 0 < report['rng_draws']['random'] < 100 * 52
+    assert report['deck_allocations'] > 0 and report['deck_copies'] == 0 and not deck._deck_counts
+
+    instrumentation = Instrumentation()
+    simulation.top_in_at_random_shuffle_simulation(10, 10, instrumentation=instrumentation)
+    assert instrumentation.deck_counts['copies'] == instrumentation.phase_calls['copy'] == instrumentation.decks_done
+
+    instrumentation = Instrumentation()
+    next(simulation.iter_overhand_shuffle_simulation(100, 52, 10, stride=5, chunk_size=100, vectorized=True, 
+                                                     rng=np.random.default_rng(2023), instrumentation=instrumentation))
+    assert instrumentation.decks_done == 1000 and instrumentation.phase_calls == {'shuffle': 2, 'record': 2}
+    assert instrumentation.rng_calls['random'] > 0
+
+    # A simulation that fails halfway stops counting the Deck allocations
+    try:
+        simulation.premo_simulation(10, 0, 3, instrumentation=Instrumentation())
+        assert False
+    except ValueError:
+        assert not deck._deck_counts
+
+    # Nested or interleaved simulations do not stop each other's counts: the outer run also counts the Decks of the inner run
+    alone = [Instrumentation(), Instrumentation()]
+    list(simulation.iter_riffle_shuffle_simulation(4, 20, 3, instrumentation=alone[0]))
+    list(simulation.iter_riffle_shuffle_simulation(2, 20, 3, instrumentation=alone[1]))
+    outer, inner = Instrumentation(), Instrumentation()
+    outer_trials = simulation.iter_riffle_shuffle_simulation(4, 20, 3, instrumentation=outer)
+    next(outer_trials)
+    list(simulation.iter_riffle_shuffle_simulation(2, 20, 3, instrumentation=inner))
+    list(outer_trials)
+    assert inner.deck_counts == alone[1].deck_counts
+    assert outer.deck_counts['allocations'] == alone[0].deck_counts['allocations'] + alone[1].deck_counts['allocations']
+    assert not deck._deck_counts
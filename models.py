@@ -0,0 +1,179 @@
+import numpy as np
+import gsr
+from instrumentation import Instrumentation, get_instrumentation
+import shuffles
+import simulation
+
+
+# Registry of the batched shuffle models, see `register_model`. Each kernel has the same signature: kernel(rng, decks, **params) takes a
+# source of random numbers (a numpy.random.Generator, or the np.random module) and a 2-D numpy array with a deck on each row, with shape
+# (n_decks, n_cards), and returns a new array with each deck shuffled once.
+SHUFFLE_MODELS: dict = {}
+
+
+def register_model(name: str):
+    """
+    Decorator that adds a batched shuffle kernel to SHUFFLE_MODELS under `name`. A registered model can be run by `iter_model_simulation`,
+    and by runner.run_simulation, checkpoint.run_with_checkpoints and adaptive.run_adaptive as the simulation "shuffle_model".
+
+    E.g.:
+        @register_model("reverse")
+        def reverse_kernel(rng, decks):
+            return decks[:, ::-1]
+    """
+    def register(kernel):
+        if name in SHUFFLE_MODELS:
+            raise ValueError(f"A shuffle model named '{name}' is already registered.")
+        SHUFFLE_MODELS[name] = kernel
+        return kernel
+    return register
+
+
+@register_model("riffle_shuffle")
+def riffle_shuffle_kernel(rng, decks: np.ndarray, p: float = 0.5) -> np.ndarray:
+    """
+    The Gilbert-Shannon-Reeds riffle shuffle, see gsr.riffle_shuffle_batch.
+    """
+    return gsr.riffle_shuffle_batch(decks, p=p, rng=rng)
+
+
+@register_model("a_shuffle_batch")
+def a_shuffle_kernel(rng, decks: np.ndarray, a: int = 2) -> np.ndarray:
+    """
+    The a-shuffle of Bayer and Diaconis, see shuffles.a_shuffle_batch. For a > 2 this is another shuffle model than shuffles.a_shuffle, so
+    it is registered under the name of its exact kernel in exact.py.
+    """
+    return shuffles.a_shuffle_batch(decks, a, rng=rng)
+
+
+@register_model("overhand_shuffle")
+def overhand_shuffle_kernel(rng, decks: np.ndarray, p: float = 0.25) -> np.ndarray:
+    """
+    The overhand shuffle, see shuffles.overhand_shuffle_batch.
+    """
+    return shuffles.overhand_shuffle_batch(decks, p=p, rng=rng)
+
+
+@register_model("top_in_at_random_shuffle")
+def top_in_at_random_kernel(rng, decks: np.ndarray) -> np.ndarray:
+    """
+    One move of the top in at random shuffle (see shuffles.top_in_at_random_shuffle): the top card is inserted at a uniformly random
+    position j of the deck. The cards on positions 1 to j move up one place, so the deck is gathered from positions i + 1 above j.
+    """
+    n_decks, n_cards = decks.shape
+    positions: np.ndarray = np.arange(n_cards)
+    insert_positions: np.ndarray = shuffles.random_integers(rng, n_cards, (n_decks, 1))
+
+    source_index: np.ndarray = np.where(positions < insert_positions, positions + 1, np.where(positions == insert_positions, 0, positions))
+    return np.take_along_axis(decks, source_index, axis=1)
+
+
+@register_model("random_transposition")
+def random_transposition_kernel(rng, decks: np.ndarray) -> np.ndarray:
+    """
+    The random transposition shuffle (Diaconis and Shahshahani): two positions are chosen uniformly and independently, and their cards
+    are swapped. When both positions are the same, the deck stays as it is.
+    """
+    n_decks, n_cards = decks.shape
+    first, second = shuffles.random_integers(rng, n_cards, (2, n_decks))
+    rows: np.ndarray = np.arange(n_decks)
+
+    shuffled_decks: np.ndarray = decks.copy()
+    shuffled_decks[rows, first] = decks[rows, second]
+    shuffled_decks[rows, second] = decks[rows, first]
+    return shuffled_decks
+
+
+@register_model("thorp_shuffle")
+def thorp_shuffle_kernel(rng, decks: np.ndarray) -> np.ndarray:
+    """
+    The Thorp shuffle: the deck is cut exactly in half, and the i-th cards of both halves are dropped as a pair, where a fair coin decides
+    whether the card of the left or of the right half comes first. The number of cards must be even.
+    """
+    n_decks, n_cards = decks.shape
+    if n_cards % 2:
+        raise ValueError("The Thorp shuffle needs an even number of cards.")
+    left_first: np.ndarray = shuffles.random_integers(rng, 2, (n_decks, n_cards // 2)).astype(bool)
+
+    left, right = decks[:, :n_cards // 2], decks[:, n_cards // 2:]
+    shuffled_decks: np.ndarray = np.empty_like(decks)
+    shuffled_decks[:, 0::2] = np.where(left_first, left, right)
+    shuffled_decks[:, 1::2] = np.where(left_first, right, left)
+    return shuffled_decks
+
+
+def iter_model_simulation(model: str, n_trials: int, n_cards_in_deck: int, max_n_shuffle: int, record_at: set = None, stride: int = None,
+                          chunk_size: int = None, rng=None, instrumentation: Instrumentation = None, **params):
+    """
+    Runs any shuffle model in SHUFFLE_MODELS: for each chunk of trials, a batch of new decks is shuffled `max_n_shuffle` times with the
+    kernel of the model, and the decks after the shuffle numbers given by `record_at` and `stride` are kept (see
+    simulation.recorded_shuffle_numbers). The chunks have the same layout as the vectorized simulations in simulation.py, so the reducers in
+    runner.REDUCERS and the statistics in stats.py work on them as they are.
+
+    E.g.: the rising sequence counts after 1 to 20 Thorp shuffles, for 100.000 trials on 8 processes:
+        counts = runner.run_simulation("shuffle_model", 100000, "rising_sequences", seed=2023, n_workers=8, model="thorp_shuffle",
+                                       n_cards_in_deck=52, max_n_shuffle=20)
+
+    :param  model: name of the shuffle model, one of the keys in SHUFFLE_MODELS
+            n_trials: number of trials
+            n_cards_in_deck: number of cards in the deck
+            max_n_shuffle: number of shuffles in each trial
+            record_at: a set of shuffle numbers after which the decks are kept
+            stride: keep the decks after every `stride`-th shuffle
+            chunk_size: number of trials per yielded chunk. If None, all trials are yielded at once
+            rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
+            instrumentation: an instrumentation.Instrumentation to measure the simulation, e.g. the time per phase and the throughput
+            **params: parameters of the kernel, e.g. a for the a-shuffle, p for the overhand shuffle
+    :return generator, yielding numpy arrays with shape (trials in chunk, recorded shuffles, cards)
+    """
+    if model not in SHUFFLE_MODELS:
+        raise ValueError(f"Unknown shuffle model '{model}', choose one of {list(SHUFFLE_MODELS)}.")
+    kernel = SHUFFLE_MODELS[model]
+
+    shuffle_numbers: list = simulation.recorded_shuffle_numbers(max_n_shuffle, record_at, stride)
+    instrumentation = get_instrumentation(instrumentation)
+    rng = instrumentation.wrap_rng(np.random if rng is None else rng)
+
+    yield from simulation._iter_batched_trials(n_trials, n_cards_in_deck, shuffle_numbers, chunk_size,
+                                               lambda decks: kernel(rng, decks, **params), instrumentation)
+
+
+if __name__ == "__main__":
+    import math
+    from deck import new_deck_batch
+    import exact
+    import runner
+
+    # The kernels keep all cards in each deck, and the registered models follow the distribution of their exact kernel
+    n_cards, n_trials = 4, 40000
+    rng = np.random.default_rng(2023)
+    for model, params in [("riffle_shuffle", {}), ("a_shuffle_batch", {'a': 3}), ("overhand_shuffle", {'p': 0.25}),
+                          ("top_in_at_random_shuffle", {})]:
+        decks = next(iter_model_simulation(model, n_trials, n_cards, 1, rng=rng, **params))[:, 0]
+        frequencies = np.bincount(exact.lehmer_rank(decks), minlength=math.factorial(n_cards)) / n_trials
+        assert np.abs(frequencies - next(exact.exact_distributions(model, n_cards, 1, **params))).max() < 0.01, model
+
+    for model in SHUFFLE_MODELS:
+        decks = SHUFFLE_MODELS[model](rng, new_deck_batch(100, 52))
+        assert (np.sort(decks, axis=1) == np.arange(1, 53)).all(), model
+
+    # A random transposition swaps two cards or none, a Thorp shuffle keeps each pair of cards i and i + n/2 together
+    decks = random_transposition_kernel(rng, new_deck_batch(1000, 10))
+    assert set((decks != np.arange(1, 11)).sum(axis=1)) == {0, 2}
+    decks = thorp_shuffle_kernel(rng, new_deck_batch(1000, 10))
+    assert (np.sort(decks.reshape(1000, 5, 2), axis=2) == np.arange(1, 6)[:, None] + np.array([0, 5])).all()
+
+    # Random transpositions mix a deck of 4 cards: after 30 shuffles all 24 decks are about equally likely
+    decks = next(iter_model_simulation("random_transposition", n_trials, n_cards, 30, record_at={30}, rng=rng))[:, 0]
+    assert np.abs(np.bincount(exact.lehmer_rank(decks), minlength=24) / n_trials - 1 / 24).max() < 0.01
+
+    # A new model runs through the runner like the other simulations, with the same result for any number of workers
+    counts = [runner.run_simulation("shuffle_model", 1000, "rising_sequences", seed=2023, n_workers=n, chunk_size=300, model="thorp_shuffle",
+                                    n_cards_in_deck=52, max_n_shuffle=10, stride=5) for n in [1, 2]]
+    assert (counts[0] == counts[1]).all() and counts[0].shape == (2, 53) and (counts[0].sum(axis=1) == 1000).all()
+
+    try:
+        register_model("thorp_shuffle")(thorp_shuffle_kernel)
+        assert False
+    except ValueError:
+        pass
@@ -0,0 +1,201 @@
+from functools import reduce
+import numpy as np
+from deck import Deck
+
+
+class Permutation:
+    """
+    This class represents a shuffle as a permutation of the positions in a deck, so shuffles can be composed, inverted and applied
+    to decks as one gather, instead of moving the cards around.
+
+    A Permutation holds an index array `order`: applying it to a deck puts the card at position order[i] on position i. So the
+    permutation of a shuffled deck of the cards 1 to n is the deck minus one (see `from_deck`), and applying it to a new deck gives
+    the shuffled deck back.
+
+    E.g.: cutting a deck after 10 cards, and then taking the top card and inserting it below the 5th card
+        p = Permutation.cut(52, 10).then(Permutation.top_to_position(52, 5))
+        shuffled_deck = p.apply(Deck().init_new_deck(52))
+
+    A sequence of shuffles is composed once, and then applied to many decks with a single gather each:
+        p = Permutation.compose([Permutation.from_deck(d) for d in trial])
+        decks = p.apply(new_deck_batch(100000, 52))
+    """
+    __slots__ = ("order",)
+
+    def __init__(self, order) -> None:
+        """
+        :param order: sequence with the positions 0 to n - 1 in any order. Position i of the result gets the card at position order[i]
+        """
+        order = np.asarray(order, dtype=np.intp)
+        if order.ndim != 1 or not (np.sort(order) == np.arange(len(order))).all():
+            raise ValueError("order should hold each of the positions 0 to n - 1 exactly once.")
+        self.order: np.ndarray = order
+
+    @classmethod
+    def _from_order(cls, order: np.ndarray):
+        """
+        Helper to create a Permutation around an index array that is known to be valid, without checking or copying it.
+        """
+        permutation = cls.__new__(cls)
+        permutation.order = order
+        return permutation
+
+    @classmethod
+    def identity(cls, n: int):
+        """
+        The permutation that leaves a deck of n cards as it is.
+        """
+        return cls._from_order(np.arange(n))
+
+    @classmethod
+    def from_deck(cls, deck):
+        """
+        The permutation that turns a new deck (the cards 1 to n in standard order) into `deck`.
+
+        E.g.: the permutation of one a-shuffle
+            p = Permutation.from_deck(shuffles.a_shuffle(Deck().init_new_deck(52), a=3))
+
+        :param  deck: instance of Deck, or a sequence of cards, holding the cards 1 to n
+        :return Permutation
+        """
+        cards = deck.cards if isinstance(deck, Deck) else deck
+        return cls(np.asarray(cards, dtype=np.intp) - 1)
+
+    @classmethod
+    def cut(cls, n: int, cut_position: int):
+        """
+        The permutation of `Deck.cut_deck`: the top `cut_position` cards go to the bottom of the deck.
+        """
+        return cls._from_order((np.arange(n) + cut_position) % n)
+
+    @classmethod
+    def top_to_position(cls, n: int, position: int):
+        """
+        The permutation of the premo trick step that takes the top card, and inserts it at `position` in the remaining n - 1 cards (as with
+        `Deck.popleft` followed by `Deck.insert`).
+        """
+        order: np.ndarray = np.arange(n)
+        order[:position] += 1
+        order[position] = 0
+        return cls._from_order(order)
+
+    @classmethod
+    def compose(cls, permutations: list):
+        """
+        The permutation of performing `permutations` one after the other, from first to last.
+        """
+        return reduce(cls.then, permutations)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Permutation) and np.array_equal(self.order, other.order)
+
+    def __repr__(self) -> str:
+        return f"Permutation({self.order.tolist()})"
+
+    def then(self, other):
+        """
+        The permutation of performing this permutation, and then `other`.
+        """
+        return self._from_order(self.order[other.order])
+
+    def inverse(self):
+        """
+        The permutation that undoes this permutation.
+        """
+        inverse_order: np.ndarray = np.empty_like(self.order)
+        inverse_order[self.order] = np.arange(len(self.order))
+        return self._from_order(inverse_order)
+
+    def power(self, k: int):
+        """
+        The permutation of performing this permutation k times, by repeated squaring: O(n log k) instead of O(n k).
+        """
+        result, square = Permutation.identity(len(self)), self
+        while k > 0:
+            if k & 1:
+                result = result.then(square)
+            square = square.then(square)
+            k >>= 1
+        return result
+
+    def position(self, index):
+        """
+        Inverse position lookup: the position the card at position `index` is moved to.
+
+        :param  index: a position, or a numpy array of positions
+        :return the new position(s)
+        """
+        return self.inverse().order[index]
+
+    def apply(self, deck):
+        """
+        Applies the permutation to a deck, or to a batch of decks, with one gather.
+
+        :param  deck: instance of Deck, or a numpy array with shape (..., n), e.g. a batch of decks from deck.new_deck_batch
+        :return a new Deck, or a new numpy array with the same shape
+        """
+        if isinstance(deck, Deck):
+            return Deck._from_buffer(deck.cards[self.order])
+        return np.asarray(deck)[..., self.order]
+
+    def cycle_type(self) -> list:
+        """
+        The lengths of the cycles of the permutation, from long to short. E.g. [2, 1, 1] for a swap of two cards in a deck of 4 cards.
+        """
+        visited: np.ndarray = np.zeros(len(self), dtype=bool)
+        lengths: list = []
+        for start in range(len(self)):
+            if visited[start]:
+                continue
+            length: int = 0
+            position: int = start
+            while not visited[position]:
+                visited[position] = True
+                position = self.order[position]
+                length += 1
+            lengths.append(length)
+        return sorted(lengths, reverse=True)
+
+
+if __name__ == "__main__":
+    import shuffles
+
+    n_cards = 52
+    new_deck = Deck().init_new_deck(n_cards)
+
+    # The cut and the premo trick step give the same deck as the Deck methods
+    assert Permutation.cut(n_cards, 10).apply(new_deck).cards.tolist() == new_deck.copy().cut_deck(10).cards.tolist()
+    d = new_deck.copy()
+    d.insert(5, d.popleft())
+    assert Permutation.top_to_position(n_cards, 5).apply(new_deck).cards.tolist() == d.cards.tolist()
+    assert Permutation.top_to_position(n_cards, n_cards - 1).apply(new_deck).cards.tolist() == list(range(2, n_cards + 1)) + [1]
+
+    # An a-shuffle of any deck is its permutation applied to that deck
+    np.random.seed(2023)
+    shuffled = shuffles.a_shuffle(new_deck, a=3)
+    p = Permutation.from_deck(shuffled)
+    assert p.apply(new_deck).cards.tolist() == shuffled.cards.tolist()
+
+    # Composing, inverting and powers
+    q = Permutation.from_deck(np.random.permutation(np.arange(1, n_cards + 1)))
+    assert p.then(q).apply(new_deck).cards.tolist() == q.apply(p.apply(new_deck)).cards.tolist()
+    assert Permutation.compose([p, q, p]) == p.then(q).then(p)
+    assert p.then(p.inverse()) == p.inverse().then(p) == Permutation.identity(n_cards)
+    assert p.power(7) == Permutation.compose([p] * 7) and p.power(0) == Permutation.identity(n_cards)
+    assert (p.apply(new_deck).cards[p.position(np.arange(n_cards))] == new_deck.cards).all()
+
+    # Applied to a batch of decks, each deck is permuted
+    decks = np.array([np.random.permutation(np.arange(1, n_cards + 1)) for _ in range(10)])
+    assert all((row == p.apply(Deck(d)).cards).all() for row, d in zip(p.apply(decks), decks))
+
+    # The cycle type
+    assert Permutation([1, 0, 2, 3]).cycle_type() == [2, 1, 1] and Permutation.cut(12, 4).cycle_type() == [3, 3, 3, 3]
+    assert sum(p.cycle_type()) == n_cards and Permutation.identity(5).cycle_type() == [1] * 5
+    try:
+        Permutation([0, 0, 1])
+        assert False
+    except ValueError:
+        pass
@@ -0,0 +1,227 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from deck import rising_sequences_batch
+import models
+import simulation
+import stats
+
+
+# The simulations that can be run with `run_simulation`. Each of them is a generator from simulation.py, that takes `chunk_size` and `rng`.
+SIMULATIONS: dict = {
+    "riffle_shuffle": simulation.iter_riffle_shuffle_simulation,
+    "a_shuffle": simulation.iter_a_shuffle_simulation,
+    "top_in_at_random_shuffle": simulation.iter_top_in_at_random_shuffle_simulation,
+    "top_in_at_random_stopping_time": simulation.iter_top_in_at_random_stopping_times,
+    "overhand_shuffle": simulation.iter_overhand_shuffle_simulation,
+    "premo": simulation.iter_premo_simulation,
+    "shuffle_model": models.iter_model_simulation,  # any model in models.SHUFFLE_MODELS, chosen with the parameter `model`
+}
+
+
+def _cards(item) -> np.ndarray:
+    """
+    Helper function that returns the cards of a Deck, or of the deck in a row of the premo simulation.
+    """
+    if isinstance(item, dict):
+        item = item['deck']
+    return item.cards
+
+
+def collect_decks(chunk) -> np.ndarray:
+    """
+    Converts a chunk of trials, as yielded by one of the simulation generators, into a 3-D numpy array with shape
+    (trials, recorded shuffles, cards). This array is much smaller and faster to send between processes than lists of Deck objects.
+
+    :param  chunk: a list of trials (each a list of Decks or premo rows), or a 3-D numpy array from a vectorized simulation
+    :return 3-D numpy array with the cards of the kept decks
+    """
+    if isinstance(chunk, np.ndarray):
+        return chunk
+    return np.array([[_cards(item) for item in trial] for trial in chunk])
+
+
+def collect_premo(chunk) -> dict:
+    """
+    Converts a chunk of trials of the premo simulation into numpy arrays.
+
+    :param  chunk: a list of trials, each a list of rows (dicts), as yielded by `simulation.iter_premo_simulation`
+    :return dict with 'top_card', an array with shape (trials, recorded shuffles), and 'deck', an array with shape (trials, recorded shuffles, cards)
+    """
+    return {
+        'top_card': np.array([[row['top_card'] for row in trial] for trial in chunk]),
+        'deck': collect_decks(chunk),
+    }
+
+
+def count_rising_sequences(chunk) -> np.ndarray:
+    """
+    Counts how many decks have r rising sequences, for each recorded shuffle number in a chunk of trials.
+
+    :param  chunk: a chunk of trials, see `collect_decks`
+    :return 2-D numpy array with shape (recorded shuffles, cards + 1). counts[s, r] is the number of decks with r rising sequences
+            after the s-th recorded shuffle
+    """
+    decks: np.ndarray = collect_decks(chunk)
+    return stats.rising_sequence_histogram(rising_sequences_batch(decks), decks.shape[-1])
+
+
+def count_card_positions(chunk) -> np.ndarray:
+    """
+    Counts how often each card lands on each position in the deck, for each recorded shuffle number in a chunk of trials.
+    See `stats.count_card_positions`, use `stats.frequency_matrix_view` to get the counts of one shuffle as in `stats.create_frequency_matrix`.
+
+    :param  chunk: a chunk of trials, see `collect_decks`
+    :return 3-D numpy array with shape (recorded shuffles, positions, cards). counts[s, i, c - 1] is the number of decks with card c on
+            position i after the s-th recorded shuffle
+    """
+    return stats.count_card_positions(collect_decks(chunk))
+
+
+def count_moves(chunk) -> np.ndarray:
+    """
+    Returns the number of moves in each trial of the top in at random simulation (when all moves are kept).
+
+    :param  chunk: a list of trials, as yielded by `simulation.iter_top_in_at_random_shuffle_simulation`, or the number of moves as yielded
+                   by `simulation.iter_top_in_at_random_stopping_times`
+    :return 1-D numpy array with the number of moves for each trial
+    """
+    if isinstance(chunk, dict):
+        return chunk['moves']
+    if isinstance(chunk, np.ndarray):
+        return chunk
+    return np.array([len(trial) for trial in chunk])
+
+
+def merge_sum(results: list):
+    """
+    Merges the results of the chunks by adding them up. Used for counts.
+    """
+    return sum(results[1:], results[0].copy())
+
+
+def merge_concatenate(results: list):
+    """
+    Merges the results of the chunks by concatenating them along the trials axis. Used for results with one entry per trial.
+    Results can be numpy arrays, or dicts of numpy arrays.
+    """
+    if isinstance(results[0], dict):
+        return {key: np.concatenate([result[key] for result in results]) for key in results[0]}
+    return np.concatenate(results)
+
+
+# Reducers that can be passed by name to `run_simulation`: (function that reduces one chunk, function that merges the chunk results)
+REDUCERS: dict = {
+    "rising_sequences": (count_rising_sequences, merge_sum),
+    "card_positions": (count_card_positions, stats.merge_card_position_counts),
+    "moves": (count_moves, merge_concatenate),
+    "decks": (collect_decks, merge_concatenate),
+    "premo": (collect_premo, merge_concatenate),
+}
+
+
+def _get_reducer(reducer) -> tuple:
+    """
+    Helper function that returns the (reduce, merge) functions for a reducer name, or the reducer itself when it is already a tuple.
+    """
+    if isinstance(reducer, str):
+        if reducer not in REDUCERS:
+            raise ValueError(f"Unknown reducer '{reducer}', choose one of {list(REDUCERS)}.")
+        return REDUCERS[reducer]
+    return reducer
+
+
+def _run_chunk(simulation_name: str, n_trials: int, seed_sequence: np.random.SeedSequence, reducer, params: dict):
+    """
+    Runs one chunk of trials of a simulation with its own random number generator, and reduces the result in the worker.
+    """
+    rng: np.random.Generator = np.random.default_rng(seed_sequence)
+    reduce, _ = _get_reducer(reducer)
+
+    simulate = SIMULATIONS[simulation_name]
+    chunk = next(simulate(n_trials=n_trials, chunk_size=n_trials, rng=rng, **params))
+    return reduce(chunk)
+
+
+def run_simulation(simulation_name: str, n_trials: int, reducer, seed: int = None, n_workers: int = 1, chunk_size: int = 10000, **params):
+    """
+    Runs a simulation from simulation.py, split in chunks of `chunk_size` trials over a pool of `n_workers` processes.
+
+    Each chunk gets its own numpy.random.Generator, spawned from np.random.SeedSequence(seed). The chunks only depend on n_trials and
+    chunk_size, and the chunk results are merged in order, so the result is identical for a given seed, no matter how many workers are used.
+
+    The workers reduce their chunk of trials to statistics (see REDUCERS), e.g. the rising sequence counts, and only send these back.
+
+    E.g.: count the rising sequences after 1 to 15 riffle shuffles, for 100.000 trials on 8 processes:
+        counts = run_simulation("riffle_shuffle", 100000, "rising_sequences", seed=2023, n_workers=8,
+                                n_cards_in_deck=52, max_n_riffle_shuffle=15, vectorized=True)
+
+    :param  simulation_name: name of the simulation, one of the keys in SIMULATIONS
+            n_trials: number of trials, at least 1
+            reducer: name of a reducer in REDUCERS, or a tuple (reduce, merge) of two module level functions. reduce takes a chunk of trials
+                     as yielded by the simulation generator, merge takes the list of reduced chunks
+            seed: seed for np.random.SeedSequence. If None, fresh entropy is used and the result is not reproducible
+            n_workers: number of processes. With 1, the chunks are run in the current process
+            chunk_size: number of trials per chunk
+            **params: parameters of the simulation generator, e.g. n_cards_in_deck, max_n_riffle_shuffle, record_at
+    :return the merged statistics of all chunks
+    """
+    if simulation_name not in SIMULATIONS:
+        raise ValueError(f"Unknown simulation '{simulation_name}', choose one of {list(SIMULATIONS)}.")
+    if n_trials < 1:
+        raise ValueError(f"n_trials should be at least 1, got {n_trials}.")
+
+    chunk_sizes: list = list(simulation._chunk_sizes(n_trials, chunk_size))
+    seed_sequences: list = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+
+    args: tuple = (
+        [simulation_name] * len(chunk_sizes),
+        chunk_sizes,
+        seed_sequences,
+        [reducer] * len(chunk_sizes),
+        [params] * len(chunk_sizes),
+    )
+
+    if n_workers == 1:
+        results: list = list(map(_run_chunk, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results: list = list(executor.map(_run_chunk, *args))
+
+    _, merge = _get_reducer(reducer)
+    return merge(results)
+
+
+if __name__ == "__main__":
+    SEED = 2023
+
+    # The result should be identical for a given seed, no matter how many workers are used
+    single = run_simulation("riffle_shuffle", 1000, "rising_sequences", seed=SEED, n_workers=1, chunk_size=100,
+                            n_cards_in_deck=52, max_n_riffle_shuffle=10, vectorized=True)
+    multi = run_simulation("riffle_shuffle", 1000, "rising_sequences", seed=SEED, n_workers=4, chunk_size=100,
+                           n_cards_in_deck=52, max_n_riffle_shuffle=10, vectorized=True)
+    assert (single == multi).all()
+    assert (single.sum(axis=1) == 1000).all()
+    assert single[0, 1:3].sum() == 1000  # after 1 riffle shuffle there are 1 or 2 rising sequences
+
+    overhand = [run_simulation("overhand_shuffle", 50, "card_positions", seed=SEED, n_workers=n, chunk_size=20,
+                               n_cards_in_deck=20, max_n_shuffle=50, p=0.25, stride=10) for n in [1, 3]]
+    assert (overhand[0] == overhand[1]).all() and overhand[0].shape == (5, 20, 20)
+    assert (overhand[0].sum(axis=1) == 50).all() and (overhand[0].sum(axis=2) == 50).all()
+
+    moves = run_simulation("top_in_at_random_shuffle", 100, "moves", seed=SEED, n_workers=2, chunk_size=30, n_cards_in_deck=10)
+    assert len(moves) == 100 and (moves >= 10).all()
+    stopping_times = [run_simulation("top_in_at_random_stopping_time", 1000, "moves", seed=SEED, n_workers=n, chunk_size=300, n_cards_in_deck=10) 
+                      for n in [1, 2]]
+    assert (stopping_times[0] == stopping_times[1]).all() and len(stopping_times[0]) == 1000
+
+    a = run_simulation("a_shuffle", 100, "decks", seed=SEED, n_workers=2, chunk_size=30, a=3, n_cards_in_deck=10, max_n_shuffle=2)
+    assert a.shape == (100, 2, 10)
+
+    premo = run_simulation("premo", 100, "premo", seed=SEED, n_workers=2, chunk_size=30, n_cards_in_deck=10, max_riffle_shuffle=3)
+    assert premo['deck'].shape == (100, 3, 10) and premo['top_card'].shape == (100, 3)
+
+    try:
+        run_simulation("riffle_shuffle", 0, "rising_sequences", seed=SEED, n_cards_in_deck=10, max_n_riffle_shuffle=3)
+        assert False
+    except ValueError:
+        pass
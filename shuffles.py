@@ -1,65 +1,116 @@
 import numpy as np
-from collections import deque
-from deck import Deck
+from deck import Deck, new_deck_batch
 import gsr
 
-def _create_packet(cards: deque) -> Deck:
+def a_shuffle(deck: Deck, a: int, rng=None) -> Deck:
     """
-    A helper function used to create the left and right packets within the `riffle_shuffle` and `a_shuffles` functions. 
-    The cards that are assigned to the packet are given as a sequence of Deck.cards in the parameter of this function. 
+    This function performs one a-shuffle on a deck of cards: the deck is cut in a packets, and the packets are riffle shuffled together.
+    It returns a new Deck object with the shuffled cards.
 
-    This function returns a new instance of a Deck
-
-    :param  cards: a sequence of Deck.cards of a collections.deque object with a sequence of integers, representing cards in a deck
-    :return packet: a new instance of Deck, with the `cards` from the params assigned to the instance to Deck.cards
+    :param      deck: instance of Deck of cards, holding cards in Deck.cards
+                a: number of packets in the a-shuffle
+                rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
+    :return     deck object, a new instance of deck, containing the cards after one a-shuffle
     """
 
-    packet: Deck = Deck()
-    packet.cards = cards
-    return packet
-
-
-def a_shuffle(deck: Deck, a: int) -> Deck:
-    
-
     number_of_cuts: int = a-1
     p: float = 1/float(a)
 
     list_of_packets: list = list()
 
+    # The packets are views on the cards of the deck (see `Deck.packet`), cutting does not copy any cards
     total_cards_cut = 0
     for cut in range(number_of_cuts):
-        relative_cut_position: int = gsr.get_cut_position(deck, p)
+        relative_cut_position: int = gsr.get_cut_position(deck, p, rng=rng)
         absolute_cut_position: int = total_cards_cut + relative_cut_position
-        cards_from_deck: Deck = deck[total_cards_cut:absolute_cut_position]
-        packet: Deck = _create_packet(cards_from_deck)
+        packet: Deck = deck.packet(total_cards_cut, absolute_cut_position)
         list_of_packets.append(packet)
         total_cards_cut += relative_cut_position
     
-    packet: Deck = _create_packet(deck[total_cards_cut:]) # add last cards in deck to piles
+    packet: Deck = deck.packet(total_cards_cut) # add last cards in deck to piles
     list_of_packets.append(packet)
 
+    if len(list_of_packets) == 1:
+        return deck[:]
+
+    # The packets are riffled together one by one. Each riffle writes into one of two buffers, and reads the result of the previous
+    # riffle from the other one, so an a-shuffle allocates at most two buffers, and a riffle shuffle (a=2) one.
+    buffers: list = [np.empty(len(deck), dtype=deck.cards.dtype) for _ in range(min(number_of_cuts, 2))]
     for i, pckt in enumerate(list_of_packets):
         if i == 0:
             result: Deck = pckt
         else:
-            result: Deck = gsr.riffle_shuffle(result, pckt)
+            result: Deck = gsr.riffle_shuffle(result, pckt, rng=rng, out=buffers[(number_of_cuts - i) % 2])
 
     return result
 
 
-def riffle_shuffle(deck):
+def random_integers(rng, high: int, size: tuple = None):
+    """
+    Helper function to draw random integers in [0, high) from either a numpy.random.Generator or the global numpy random state (np.random),
+    as these two have a different name for this function.
+
+    :param  rng: a numpy.random.Generator, or the np.random module
+            high: the upper bound (exclusive) of the random integers
+            size: the shape of the output. If None, a single integer is returned
+    :return random integer(s) in [0, high)
+    """
+    if hasattr(rng, 'integers'):
+        return rng.integers(0, high, size=size)
+    return rng.randint(0, high, size=size)
+
+
+def a_shuffle_batch(decks: np.ndarray, a: int, k: int = 1, rng=None) -> np.ndarray:
+    """
+    This function applies an a-shuffle to every deck in a batch of decks at once. It returns a new 2-D array with the shuffled decks.
+
+    Instead of cutting the deck in a packets and riffling the packets together, each position in the shuffled deck gets a random base-a
+    digit (the packet it takes its card from). The packets are then filled in order by one stable sort of these digits. This is the
+    a-shuffle as described in the paper by Diaconis (Bayer and Diaconis), with multinomial packet sizes.
+
+    For a = 2 this has the same distribution as `a_shuffle`. For a > 2 it does not: `a_shuffle` makes a - 1 binomial(n, 1/a) cuts one after
+    the other, so its packet sizes are not multinomial. E.g. the TVD between one shuffle of both is 0.085 for 5 cards with a = 3
+    (see exact.a_shuffle_kernel and exact.a_shuffle_batch_kernel).
+
+    Performing k a-shuffles after each other gives the same distribution as one a**k-shuffle. With k > 1 this function samples the
+    k a-shuffles at once, by giving each position k base-a digits.
+
+    :param  decks: 2-D numpy array with shape (n_decks, n_cards), each row holds the cards of a deck
+            a: number of packets in the a-shuffle
+            k: number of a-shuffles to perform
+            rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
+    :return 2-D numpy array with shape (n_decks, n_cards), holding the shuffled decks
+    """
+    rng = np.random if rng is None else rng
+    n_decks, n_cards = decks.shape
+
+    if a**k < 2**63:
+        digits: np.ndarray = random_integers(rng, a**k, (n_decks, n_cards))
+        order: np.ndarray = np.argsort(digits, axis=1, kind="stable")
+    else:
+        # a**k does not fit in a 64 bit integer, so sort on the k base-a digits separately
+        digits: np.ndarray = random_integers(rng, a, (k, n_decks, n_cards))
+        order: np.ndarray = np.lexsort(digits, axis=-1)
+
+    # The card on top of the deck goes to the first position with the lowest digit, etc.
+    shuffled_decks: np.ndarray = np.empty_like(decks)
+    np.put_along_axis(shuffled_decks, order, decks, axis=1)
+    return shuffled_decks
+
+
+def riffle_shuffle(deck, rng=None):
     """
     Riffle shuffle is a particular a-shuffle, where a=2. This function calls the a-shuffle function with a=2.
     It returns a once riffle shuffled deck.
 
     :param      deck: instance of Deck of cards, holding cards in Deck.cards
+                rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
     :return     deck object, a new instance of deck, containing the cards after one riffle shuffle
     """
-    return a_shuffle(deck, a=2)
+    return a_shuffle(deck, a=2, rng=rng)
 
 
-def top_in_at_random_shuffle(deck) -> Deck:
+def top_in_at_random_shuffle(deck, rng=None) -> Deck:
     """
     This function simulates one move for a top in 'top in at random shuffle'. 
     That is: it takes the top card and inserts it in a random position of the same deck, but once! 
@@ -70,6 +121,7 @@ def top_in_at_random_shuffle(deck) -> Deck:
     the reference to the original deck.
 
     :param      deck: instance of Deck of cards, holding cards in Deck.cards
+                rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
     :return     deck: the same instance as given in param, but with one 'top in at random' permutation performed on the cards
     """
     deck = deck
@@ -77,46 +129,90 @@ def top_in_at_random_shuffle(deck) -> Deck:
     # take the top card
     top_card: int = deck.popleft()
     
-    idx_to_insert_card: int = np.random.randint(low=0, high=number_of_cards) 
+    idx_to_insert_card: int = random_integers(np.random if rng is None else rng, number_of_cards)
     # insert the top card to a random position in the deck
     deck.insert(idx_to_insert_card, top_card)
     
     return deck
 
 
-def overhand_shuffle(deck: Deck, p: float=0.2):
+def overhand_shuffle(deck: Deck, p: float=0.2, rng=None):
     """
     In this function, one overhand shuffle is performed. Given a deck of cards, clumps according to the binomial distirbution are created.
     Each clump is then added to a new pile. Where the clump of cards initially on top, ends up on the bottom of the new deck.
 
     :param      deck: instance of Deck of cards, holding cards in Deck.cards
+                p: binomial parameter for the clump sizes
+                rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
     :return     pile: a new instance of deck, containing the cards after one overhand shuffle
     """
-    pile = Deck() # This pile will represent the shuffled pile of cards
+    rng = np.random if rng is None else rng
+    cards: np.ndarray = deck.cards
+    cards_in_deck: int = len(deck)
+    clumps: list = []
     
-    deck = deck.copy()
-    cards_in_deck = len(deck)
+    top: int = 0
+    while top < cards_in_deck:
+        n_cards_still_in_deck: int = cards_in_deck - top
+        clump_size: int = rng.binomial(n=n_cards_still_in_deck, p=p)
+        if clump_size > 0:
+            # The clumps are views on the cards of the original deck, the deck itself is not altered
+            clumps.append(cards[top:top + clump_size])
+            top += clump_size
     
-    while cards_in_deck > 0:
-        n_cards_still_in_deck: int = len(deck)
-        clump_size: int = np.random.binomial(n=n_cards_still_in_deck, p=p)
-        if clump_size > 0:            
-            # Create a clump of cards that is added to the new pile of cards
-            # Use slice with positive numbers instead of a slice with negative index for performance
-            clump: Deck = deck[:clump_size].copy()
-            clump.reverse() # reverse the elements in the clump, `extendleft()` will re-reverse the elements as intended
-            pile.cards.extendleft(clump)
-            cards_in_deck -= clump_size
-
-            # remove number of cards in the clump from original deck
-            for c in range(clump_size):
-                # deck = deck.copy() #TODO: check performance for copying the deck for each card
-                deck.popleft() 
+    # The clump of cards initially on top ends up on the bottom of the new pile
+    pile = Deck(np.concatenate(clumps[::-1]) if clumps else None) # This pile will represent the shuffled pile of cards
     
     return pile
     
 
+def overhand_shuffle_batch(decks: np.ndarray, p: float=0.2, rng=None) -> np.ndarray:
+    """
+    This function applies one overhand shuffle to every deck in a batch of decks at once. It returns a new 2-D array with the shuffled decks.
+
+    In `overhand_shuffle`, the clump sizes are drawn one by one from the binomial distribution, with the number of cards still in the deck
+    and p. The same clump sizes follow from giving each card a geometric(p) number: the round in which it is taken off the deck. The number
+    of cards taken in the first round is binomial(n, p), in the next round binomial(cards left, p), etc. With these numbers sorted from top
+    to bottom, a clump ends where the round changes. This draws all clump boundaries of a deck at once, for all decks in the batch.
+    The shuffle itself is then a reversal of the order of the clumps: each card moves to its new position with one scatter.
+
+    E.g.:
+        decks = new_deck_batch(5000, 52)
+        shuffled_decks = overhand_shuffle_batch(decks, p=0.25)
+
+    :param      decks: 2-D numpy array with shape (n_decks, n_cards), each row holds the cards of a deck
+                p: binomial parameter for the clump sizes
+                rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
+    :return     2-D numpy array with shape (n_decks, n_cards), holding the overhand shuffled decks
+    """
+    rng = np.random if rng is None else rng
+    n_decks, n_cards = decks.shape
+    # small integers for the positions keep the accumulations below fast
+    positions: np.ndarray = np.arange(n_cards, dtype=np.int16 if n_cards < 2**15 else np.int64)
+
+    # The geometric rounds, by inverse transform sampling of sorted uniforms. Sorting the uniforms from high to low sorts the rounds from low to high
+    uniforms: np.ndarray = np.sort(rng.random((n_decks, n_cards)), axis=1)[:, ::-1]
+    rounds: np.ndarray = np.floor(np.log(uniforms) / np.log1p(-p))
+
+    # boundaries[d, i] is True when a clump in deck d starts at position i (position n_cards marks the end of the deck)
+    boundaries: np.ndarray = np.empty((n_decks, n_cards + 1), dtype=bool)
+    boundaries[:, 0] = True
+    boundaries[:, n_cards] = True
+    np.not_equal(rounds[:, 1:], rounds[:, :-1], out=boundaries[:, 1:n_cards])
+
+    # For each position, the start and the end of the clump it belongs to
+    starts: np.ndarray = np.maximum.accumulate(np.where(boundaries[:, :n_cards], positions, positions[0]), axis=1)
+    ends: np.ndarray = np.minimum.accumulate(np.where(boundaries[:, 1:], positions + 1, positions.dtype.type(n_cards))[:, ::-1], axis=1)[:, ::-1]
+
+    # The clump initially on top ends up on the bottom, the order of the cards within a clump is kept
+    new_positions: np.ndarray = n_cards - ends + positions - starts
+    shuffled_decks: np.ndarray = np.empty_like(decks)
+    np.put_along_axis(shuffled_decks, new_positions, decks, axis=1)
+    return shuffled_decks
+
+
 if __name__ == "__main__":
+    np.random.seed(2023)
     number_of_cards_in_deck = 52
 
     first_deck = Deck().init_new_deck(number_of_cards_in_deck)
@@ -124,14 +220,22 @@ if __name__ == "__main__":
     assert first_deck is shuffled_first_deck
 
     second_deck = Deck().init_new_deck(52)
-    new_shuffled_deck = top_in_at_random_shuffle(second_deck, copy=True)
+    new_shuffled_deck = top_in_at_random_shuffle(second_deck.copy())
     assert new_shuffled_deck is not second_deck
-    assert sum(o == s for o,s in zip(new_shuffled_deck.cards, second_deck.cards)) != number_of_cards_in_deck
+    assert sorted(new_shuffled_deck) == list(second_deck)
 
     a_shuffled_pile = a_shuffle(second_deck, a=10)
     assert len(a_shuffled_pile) == number_of_cards_in_deck
     assert sum(o == s for o,s in zip(second_deck, a_shuffled_pile)) != number_of_cards_in_deck
 
+    # the batched a-shuffle keeps all cards in each deck, and an a-shuffle has at most a rising sequences
+    decks = new_deck_batch(1000, number_of_cards_in_deck)
+    a_shuffled_decks = a_shuffle_batch(decks, a=3)
+    assert (np.sort(a_shuffled_decks, axis=1) == decks).all()
+    assert all(Deck(list(d)).rising_sequences <= 3 for d in a_shuffled_decks)
+    assert all(Deck(list(d)).rising_sequences <= 3**4 for d in a_shuffle_batch(decks, a=3, k=4))
+    assert (np.sort(a_shuffle_batch(decks, a=2, k=70), axis=1) == decks).all()
+
     overhand_shuffled_pile = overhand_shuffle(second_deck, p=0.2)
-    assert len(overhand_shuffle) == number_of_cards_in_deck
+    assert len(overhand_shuffled_pile) == number_of_cards_in_deck
     assert sum(o == s for o,s in zip(second_deck, overhand_shuffled_pile)) != number_of_cards_in_deck
\ No newline at end of file
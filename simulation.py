@@ -1,148 +1,751 @@
-from deck import Deck
+from deck import Deck, card_dtype, new_deck_batch, rising_sequences_batch
 import gsr
+from instrumentation import Instrumentation, get_instrumentation
 import shuffles
+import stats
 import numpy as np
 
 
-def riffle_shuffle_simulation(n_trials: int, n_cards_in_deck: int, max_n_riffle_shuffle:int) -> list:
+def recorded_shuffle_numbers(max_n_shuffle: int, record_at: set = None, stride: int = None) -> list:
     """
-    
+    Returns the sorted list of shuffle numbers (1 to max_n_shuffle) after which the shuffled decks are kept in a simulation.
+    A shuffle number is kept when it is in `record_at`, or when it is a multiple of `stride`. When both are None, all shuffle numbers are kept.
+
+    E.g.:
+        recorded_shuffle_numbers(10, record_at={1, 5}, stride=4) --> [1, 4, 5, 8]
+
+    :param  max_n_shuffle: the number of shuffles in each trial
+            record_at: a set of shuffle numbers to keep
+            stride: keep every `stride`-th shuffle
+    :return sorted list of the shuffle numbers to keep
+    """
+    if record_at is None and stride is None:
+        return list(range(1, max_n_shuffle + 1))
+
+    shuffle_numbers: set = set()
+    if record_at is not None:
+        if any(n < 1 or n > max_n_shuffle for n in record_at):
+            raise ValueError(f"record_at should only hold shuffle numbers between 1 and max_n_shuffle ({max_n_shuffle}).")
+        shuffle_numbers.update(record_at)
+    if stride is not None:
+        if stride < 1:
+            raise ValueError("stride should be a positive integer.")
+        shuffle_numbers.update(range(stride, max_n_shuffle + 1, stride))
+
+    return sorted(shuffle_numbers)
+
+
+def _is_recorded(shuffle_number: int, record_at: set = None, stride: int = None) -> bool:
+    """
+    Helper function for simulations without a fixed number of shuffles. Returns True if the deck after `shuffle_number` shuffles should be kept.
+    See `recorded_shuffle_numbers`.
+    """
+    if record_at is None and stride is None:
+        return True
+    return (record_at is not None and shuffle_number in record_at) or (stride is not None and shuffle_number % stride == 0)
+
+
+def _in_chunks(trials, chunk_size: int = None):
+    """
+    Helper function that groups the results of a generator which yields one trial at a time, into lists of `chunk_size` trials.
+    If `chunk_size` is None, the trials are yielded one by one.
+    """
+    if chunk_size is None:
+        yield from trials
+        return
+
+    chunk: list = []
+    for trial in trials:
+        chunk.append(trial)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _chunk_sizes(n_trials: int, chunk_size: int = None):
+    """
+    Helper function that splits `n_trials` into chunks of at most `chunk_size` trials, and yields the number of trials in each chunk.
+    If `chunk_size` is None, all trials are one chunk, also when there are no trials, so a vectorized simulation of 0 trials yields
+    one empty array.
+    """
+    if chunk_size is None:
+        yield n_trials
+        return
+    for first_trial in range(0, n_trials, chunk_size):
+        yield min(chunk_size, n_trials - first_trial)
+
+
+def riffle_shuffle_simulation(n_trials: int, n_cards_in_deck: int, max_n_riffle_shuffle:int, vectorized: bool = False, rng=None,
+                              instrumentation: Instrumentation = None):
+    """
+    Simulate `n_trials` trials. In each trial a new deck of `n_cards_in_deck` cards is riffle shuffled `max_n_riffle_shuffle` times.
+
+    By default the result is a list of lists: for each trial a list with the shuffled Deck after each riffle shuffle.
+    When `vectorized` is True, all trials are shuffled at once with `gsr.riffle_shuffle_batch` and the result is a 3-D numpy array with shape
+    (n_trials, max_n_riffle_shuffle, n_cards_in_deck). result[trial, shuffle] holds the cards of the deck after shuffle + 1 riffle shuffles.
+
+    To keep only some of the shuffled decks, or to process the trials while they are simulated, use `iter_riffle_shuffle_simulation`.
+
+    :param  n_trials: number of trials
+            n_cards_in_deck: number of cards in the deck
+            max_n_riffle_shuffle: number of riffle shuffles in each trial
+            vectorized: if True, use the batched riffle shuffle and return a numpy array
+            rng: source of random numbers, a numpy.random.Generator or a variates.RandomVariatePool. If None, the global numpy random state 
+                 is used (see np.random.seed)
+            instrumentation: an instrumentation.Instrumentation to measure the simulation, e.g. the time per phase and the throughput
+    :return list of lists with Deck objects, or a 3-D numpy array when `vectorized` is True
     """
+    if vectorized:
+        return next(iter_riffle_shuffle_simulation(n_trials, n_cards_in_deck, max_n_riffle_shuffle, vectorized=True,
+                                                   rng=rng, instrumentation=instrumentation))
+
     # the `results` is a list of lists. For each trial we run, we append the results of that trial to the `results` list. 
-    result: list = []
+    return list(iter_riffle_shuffle_simulation(n_trials, n_cards_in_deck, max_n_riffle_shuffle, rng=rng, instrumentation=instrumentation))
 
-    # Execute n_trials
-    for i_trial in range(n_trials):
-        # For each trial create a new deck of cards
-        deck: Deck = Deck().init_new_deck(n_cards_in_deck)
 
-        # The trial_results holds all the different shuffled Decks of cards. 
-        # The first deck in the trial_results is the initial deck, in new standard order.
-        trial_result: list = []
-        
-        # Shuffle the deck n number of times, by cutting the deck into two packets and then riffle shuffling the 
-        # two packets together, using the gsr.riffle_shuffle function.
-        for i_shuffle in range(max_n_riffle_shuffle):
-            cut_position: int = gsr.get_cut_position(deck)
-            left_packet: Deck = deck[:cut_position]
-            right_packet: Deck = deck[cut_position:]
-            deck: Deck = gsr.riffle_shuffle(left_packet, right_packet)
-            trial_result.append(deck)
+def iter_riffle_shuffle_simulation(n_trials: int, n_cards_in_deck: int, max_n_riffle_shuffle: int, record_at: set = None, 
+                                   stride: int = None, chunk_size: int = None, vectorized: bool = False, rng=None, 
+                                   instrumentation: Instrumentation = None):
+    """
+    Generator version of `riffle_shuffle_simulation`. Instead of returning all trials at once, the trials are yielded while they are simulated,
+    and only the decks after the shuffle numbers given by `record_at` and `stride` are kept (see `recorded_shuffle_numbers`).
+    The peak memory then depends on `chunk_size`, not on n_trials x max_n_riffle_shuffle.
+
+    E.g.: only keep the decks after 7 and 15 shuffles, and process 10.000 trials at a time:
+        for chunk in iter_riffle_shuffle_simulation(100000, 52, 15, record_at={7, 15}, chunk_size=10000, vectorized=True):
+            ...  # chunk is a numpy array with shape (10000, 2, 52)
+
+    :param  n_trials: number of trials
+            n_cards_in_deck: number of cards in the deck
+            max_n_riffle_shuffle: number of riffle shuffles in each trial
+            record_at: a set of shuffle numbers after which the decks are kept
+            stride: keep the decks after every `stride`-th shuffle
+            chunk_size: number of trials per yielded chunk. If None, one trial is yielded at a time (or all trials, when vectorized)
+            vectorized: if True, use the batched riffle shuffle and yield numpy arrays with shape (trials in chunk, recorded shuffles, cards)
+            rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
+            instrumentation: an instrumentation.Instrumentation to measure the simulation, e.g. the time per phase and the throughput
+    :return generator, yielding a list of the kept Decks for each trial, or a list of these lists for each chunk of trials
+    """
+    shuffle_numbers: list = recorded_shuffle_numbers(max_n_riffle_shuffle, record_at, stride)
+    instrumentation = get_instrumentation(instrumentation)
+    rng = instrumentation.wrap_rng(rng)
+
+    if vectorized:
+        yield from _iter_batched_trials(n_trials, n_cards_in_deck, shuffle_numbers, chunk_size, 
+                                        lambda decks: gsr.riffle_shuffle_batch(decks, rng=rng), instrumentation)
+        return
+
+    yield from _in_chunks(_iter_riffle_shuffle_trials(n_trials, n_cards_in_deck, max_n_riffle_shuffle, set(shuffle_numbers), rng, 
+                                                      instrumentation), chunk_size)
+
+
+def _iter_batched_trials(n_trials: int, n_cards_in_deck: int, shuffle_numbers: list, chunk_size: int, shuffle_batch, 
+                         instrumentation: Instrumentation = None):
+    """
+    Helper function for the vectorized simulations. For each chunk of trials, a batch of new decks is shuffled with `shuffle_batch` up to the
+    last shuffle number in `shuffle_numbers`, and the decks after these shuffle numbers are yielded as one 3-D numpy array with shape
+    (trials in chunk, len(shuffle_numbers), n_cards_in_deck).
+
+    :param  shuffle_batch: function that takes a 2-D numpy array of decks, and returns the decks after one shuffle
+    """
+    instrumentation = get_instrumentation(instrumentation)
+    instrumentation.start(n_trials)
+    try:
+        for n_trials_in_chunk in _chunk_sizes(n_trials, chunk_size):
+            decks: np.ndarray = new_deck_batch(n_trials_in_chunk, n_cards_in_deck)
+            result: np.ndarray = np.empty((n_trials_in_chunk, len(shuffle_numbers), n_cards_in_deck), dtype=decks.dtype)
             
-        result.append(trial_result)
-    
-    return result
+            n_shuffled: int = 0
+            for i_recorded, shuffle_number in enumerate(shuffle_numbers):
+                with instrumentation.phase('shuffle'):
+                    while n_shuffled < shuffle_number:
+                        decks = shuffle_batch(decks)
+                        n_shuffled += 1
+                with instrumentation.phase('record'):
+                    result[:, i_recorded] = decks
+            
+            instrumentation.update(n_trials_in_chunk, n_trials_in_chunk * n_shuffled)
+            yield result
+    finally:
+        instrumentation.finish()
 
 
-def a_shuffle_simulation(n_trials:int, a: int, n_cards_in_deck: int, max_n_shuffle: int) -> list:
-    
-    result: list = []
-    
-    for i_trial in range(n_trials):
-        deck: Deck = Deck().init_new_deck(n_cards_in_deck)
-        
-        trial_result: list = []
-        
-        for i_shuffle in range(max_n_shuffle):
-            deck: Deck = shuffles.a_shuffle(deck, a)
-            trial_result.append(deck)
-        
-        result.append(trial_result)
-    
-    return result
+def _iter_riffle_shuffle_trials(n_trials: int, n_cards_in_deck: int, max_n_riffle_shuffle: int, shuffle_numbers: set, rng=None, 
+                                instrumentation: Instrumentation = None):
+    """
+    Yields the kept Decks of each trial of the riffle shuffle simulation, see `iter_riffle_shuffle_simulation`.
+    """
+    instrumentation = get_instrumentation(instrumentation)
+    instrumentation.start(n_trials)
+    try:
+        # Execute n_trials
+        for i_trial in range(n_trials):
+            # For each trial create a new deck of cards
+            deck: Deck = Deck().init_new_deck(n_cards_in_deck)
 
+            # The trial_results holds the shuffled Decks of cards which are kept.
+            trial_result: list = []
+            
+            # Shuffle the deck n number of times, by cutting the deck into two packets and then riffle shuffling the 
+            # two packets together, using the gsr.riffle_shuffle function.
+            for shuffle_number in range(1, max_n_riffle_shuffle + 1):
+                with instrumentation.phase('cut'):
+                    cut_position: int = gsr.get_cut_position(deck, rng=rng)
+                    left_packet: Deck = deck.packet(0, cut_position)
+                    right_packet: Deck = deck.packet(cut_position)
+                with instrumentation.phase('shuffle'):
+                    deck: Deck = gsr.riffle_shuffle(left_packet, right_packet, rng=rng)
+                if shuffle_number in shuffle_numbers:
+                    with instrumentation.phase('record'):
+                        trial_result.append(deck)
+            
+            instrumentation.update(1, max_n_riffle_shuffle)
+            yield trial_result
+    finally:
+        instrumentation.finish()
 
-def top_in_at_random_shuffle_simulation(n_trials: int, n_cards_in_deck: int) -> list:
-    
-    result: list = []
 
-    for i_trial in range(n_trials):
-        trial_result: list = []
+def a_shuffle_simulation(n_trials:int, a: int, n_cards_in_deck: int, max_n_shuffle: int, vectorized: bool = False, 
+                         shuffle_numbers: list = None, rng=None, instrumentation: Instrumentation = None, model: str = "a_shuffle"):
+    """
+    Simulate `n_trials` trials. In each trial a new deck of `n_cards_in_deck` cards is a-shuffled `max_n_shuffle` times.
 
-        deck: Deck = Deck().init_new_deck(n_cards_in_deck)
-        bottom_card: int = deck[-1]
-        top_card: int = deck[0]
-        
-        while top_card != bottom_card:
-            deck = deck.copy()
-            deck: Deck = shuffles.top_in_at_random_shuffle(deck)
-            trial_result.append(deck)
-            top_card: int = deck[0]
+    By default the result is a list of lists: for each trial a list with the shuffled Deck after each a-shuffle.
+    When `vectorized` is True, all trials are shuffled at once with `shuffles.a_shuffle_batch` and the result is a 3-D numpy array with shape
+    (n_trials, number of recorded shuffles, n_cards_in_deck).
 
-        # perform one more top in at random move for the bottom card 
-        deck = shuffles.top_in_at_random_shuffle(deck)
-        trial_result.append(deck)
-        
-        result.append(trial_result)
-        
-    return result
-        
+    In vectorized mode, `shuffle_numbers` can be used to only record the decks after these numbers of shuffles, e.g. [10, 15]. The shuffles
+    in between are not simulated one by one: k a-shuffles are sampled at once as one a**k-shuffle.
 
-def overhand_shuffle_simulation(n_trials: int, n_cards_in_deck: int, max_n_shuffle: int, p: float = 0.25) -> list:
-        
-    result: list = []
+    For a > 2 the two functions are different shuffle models: `shuffles.a_shuffle` cuts the deck with a - 1 binomial cuts, while
+    `shuffles.a_shuffle_batch` uses the multinomial packet sizes of the a-shuffle of Bayer and Diaconis. For a = 2 both are the riffle shuffle.
+    `model` chooses between them: "a_shuffle" can only be simulated one trial at a time, and "a_shuffle_batch" only vectorized. So for
+    a > 2, `vectorized` raises a ValueError unless `model` is "a_shuffle_batch".
+
+    :param  n_trials: number of trials
+            a: number of packets in the a-shuffle
+            n_cards_in_deck: number of cards in the deck
+            max_n_shuffle: number of a-shuffles in each trial
+            vectorized: if True, use the batched a-shuffle and return a numpy array. For a > 2 this needs model="a_shuffle_batch"
+            shuffle_numbers: (vectorized only) the numbers of shuffles after which the decks are recorded. Defaults to 1 to max_n_shuffle
+            rng: source of random numbers, a numpy.random.Generator or a variates.RandomVariatePool. If None, the global numpy random state 
+                 is used (see np.random.seed)
+            instrumentation: an instrumentation.Instrumentation to measure the simulation, e.g. the time per phase and the throughput
+            model: "a_shuffle" for the a-shuffle of `shuffles.a_shuffle`, or "a_shuffle_batch" for the a-shuffle of `shuffles.a_shuffle_batch`
+    :return list of lists with Deck objects, or a 3-D numpy array when `vectorized` is True
+    """
+    if vectorized:
+        return next(iter_a_shuffle_simulation(n_trials, a, n_cards_in_deck, max_n_shuffle, record_at=shuffle_numbers, 
+                                              vectorized=True, rng=rng, instrumentation=instrumentation, model=model))
     
-    for i_trial in range(n_trials):
-        init_deck: Deck = Deck().init_new_deck(n_cards_in_deck)
+    return list(iter_a_shuffle_simulation(n_trials, a, n_cards_in_deck, max_n_shuffle, rng=rng, instrumentation=instrumentation, model=model))
 
-        trial_result: list = []
-        # trial_result.append(init_deck)
-        
-        for i_shuffle in range(max_n_shuffle):
-            shuffled_deck: Deck = shuffles.overhand_shuffle(init_deck, p=p)
-            trial_result.append(shuffled_deck)
-            #TODO: Check object initiation for performance. This can also be done using copy() on `trial_result`, creating less objects. 
-            new_deck: Deck = Deck()
-            new_deck.cards = shuffled_deck.cards
-            init_deck = new_deck
+
+def _check_a_shuffle_model(a: int, vectorized: bool, model: str) -> None:
+    """
+    Helper function that checks that the a-shuffle `model` can be simulated in the chosen mode, see `a_shuffle_simulation`.
+    """
+    if model not in ("a_shuffle", "a_shuffle_batch"):
+        raise ValueError(f"Unknown a-shuffle model '{model}', choose 'a_shuffle' or 'a_shuffle_batch'.")
+    if a > 2 and vectorized and model == "a_shuffle":
+        raise ValueError("The vectorized a-shuffle with a > 2 is the a-shuffle of shuffles.a_shuffle_batch, which has another distribution "
+                         "than shuffles.a_shuffle. Pass model='a_shuffle_batch' to simulate it, or use vectorized=False.")
+    if a > 2 and not vectorized and model == "a_shuffle_batch":
+        raise ValueError("The a-shuffle of shuffles.a_shuffle_batch can only be simulated with vectorized=True.")
+
+
+def iter_a_shuffle_simulation(n_trials: int, a: int, n_cards_in_deck: int, max_n_shuffle: int, record_at: set = None, stride: int = None, 
+                              chunk_size: int = None, vectorized: bool = False, rng=None, instrumentation: Instrumentation = None,
+                              model: str = "a_shuffle"):
+    """
+    Generator version of `a_shuffle_simulation`. The trials are yielded while they are simulated, and only the decks after the shuffle 
+    numbers given by `record_at` and `stride` are kept (see `recorded_shuffle_numbers`).
+
+    In vectorized mode, the shuffles between two kept shuffle numbers are sampled at once as one a**k-shuffle. For a > 2 the vectorized
+    mode simulates a different shuffle model than the default mode, so it needs model="a_shuffle_batch", see `a_shuffle_simulation`.
+
+    :param  n_trials: number of trials
+            a: number of packets in the a-shuffle
+            n_cards_in_deck: number of cards in the deck
+            max_n_shuffle: number of a-shuffles in each trial
+            record_at: a set of shuffle numbers after which the decks are kept
+            stride: keep the decks after every `stride`-th shuffle
+            chunk_size: number of trials per yielded chunk. If None, one trial is yielded at a time (or all trials, when vectorized)
+            vectorized: if True, use the batched a-shuffle and yield numpy arrays with shape (trials in chunk, recorded shuffles, cards).
+                        For a > 2 this needs model="a_shuffle_batch"
+            rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
+            instrumentation: an instrumentation.Instrumentation to measure the simulation, e.g. the time per phase and the throughput
+            model: "a_shuffle" for the a-shuffle of `shuffles.a_shuffle`, or "a_shuffle_batch" for the a-shuffle of `shuffles.a_shuffle_batch`
+    :return generator, yielding a list of the kept Decks for each trial, or a list of these lists for each chunk of trials
+    """
+    _check_a_shuffle_model(a, vectorized, model)
+    shuffle_numbers: list = recorded_shuffle_numbers(max_n_shuffle, record_at, stride)
+    instrumentation = get_instrumentation(instrumentation)
+    rng = instrumentation.wrap_rng(rng)
+
+    if vectorized:
+        instrumentation.start(n_trials)
+        try:
+            for n_trials_in_chunk in _chunk_sizes(n_trials, chunk_size):
+                decks: np.ndarray = new_deck_batch(n_trials_in_chunk, n_cards_in_deck)
+                result: np.ndarray = np.empty((n_trials_in_chunk, len(shuffle_numbers), n_cards_in_deck), dtype=decks.dtype)
+
+                n_shuffled: int = 0
+                for i, shuffle_number in enumerate(shuffle_numbers):
+                    with instrumentation.phase('shuffle'):
+                        decks = shuffles.a_shuffle_batch(decks, a, k=shuffle_number - n_shuffled, rng=rng)
+                    n_shuffled = shuffle_number
+                    with instrumentation.phase('record'):
+                        result[:, i] = decks
+
+                instrumentation.update(n_trials_in_chunk, n_trials_in_chunk * len(shuffle_numbers))
+                yield result
+        finally:
+            instrumentation.finish()
+        return
+
+    yield from _in_chunks(_iter_a_shuffle_trials(n_trials, a, n_cards_in_deck, max_n_shuffle, set(shuffle_numbers), rng, instrumentation), 
+                          chunk_size)
+
+
+def _iter_a_shuffle_trials(n_trials: int, a: int, n_cards_in_deck: int, max_n_shuffle: int, shuffle_numbers: set, rng=None, 
+                           instrumentation: Instrumentation = None):
+    """
+    Yields the kept Decks of each trial of the a-shuffle simulation, see `iter_a_shuffle_simulation`.
+    """
+    instrumentation = get_instrumentation(instrumentation)
+    instrumentation.start(n_trials)
+    try:
+        for i_trial in range(n_trials):
+            deck: Deck = Deck().init_new_deck(n_cards_in_deck)
+            
+            trial_result: list = []
+            
+            for shuffle_number in range(1, max_n_shuffle + 1):
+                with instrumentation.phase('shuffle'):
+                    deck: Deck = shuffles.a_shuffle(deck, a, rng=rng)
+                if shuffle_number in shuffle_numbers:
+                    with instrumentation.phase('record'):
+                        trial_result.append(deck)
+            
+            instrumentation.update(1, max_n_shuffle)
+            yield trial_result
+    finally:
+        instrumentation.finish()
+
+
+def top_in_at_random_shuffle_simulation(n_trials: int, n_cards_in_deck: int, stopping_time: bool = False, final_decks: bool = False, 
+                                        rng=None, instrumentation: Instrumentation = None):
+    """
+    Simulate `n_trials` trials of the top in at random shuffle. In each trial, top in at random moves are performed on a new deck of 
+    `n_cards_in_deck` cards, until the original bottom card has reached the top of the deck and is inserted at a random position.
+
+    When `stopping_time` is True, the decks are not built. Only the number of moves in each trial is computed, for all trials at once,
+    see `iter_top_in_at_random_stopping_times`.
+
+    :param  n_trials: number of trials
+            n_cards_in_deck: number of cards in the deck
+            stopping_time: if True, return the number of moves in each trial as a numpy array
+            final_decks: (stopping_time only) if True, also return the deck after the last move of each trial
+            rng: source of random numbers, a numpy.random.Generator or a variates.RandomVariatePool. If None, the global numpy random state 
+                 is used (see np.random.seed)
+            instrumentation: an instrumentation.Instrumentation to measure the simulation, e.g. the time per phase and the throughput
+    :return list of lists: for each trial a list with the Deck after each move. len(trial) is the number of moves in the trial.
+            When `stopping_time` is True: a numpy array with the number of moves in each trial, or a dict with the arrays 'moves' and 
+            'deck' when `final_decks` is True
+    """
+    if stopping_time:
+        return next(iter_top_in_at_random_stopping_times(n_trials, n_cards_in_deck, final_decks=final_decks, 
+                                                         rng=rng, instrumentation=instrumentation))
+
+    return list(iter_top_in_at_random_shuffle_simulation(n_trials, n_cards_in_deck, rng=rng, instrumentation=instrumentation))
+
+
+def iter_top_in_at_random_stopping_times(n_trials: int, n_cards_in_deck: int, final_decks: bool = False, chunk_size: int = None, rng=None, 
+                                         instrumentation: Instrumentation = None):
+    """
+    Computes the number of moves in each trial of the top in at random simulation directly, for a chunk of trials at once, without 
+    building any decks.
+
+    A move only matters through where the top card is inserted, relative to the original bottom card. When j cards lie below the original
+    bottom card, the top card is inserted below it with probability (j + 1) / n. So the number of moves until j + 1 cards lie below it is
+    geometric((j + 1) / n), and the number of moves in a trial is 1 + the sum of these geometric numbers for j = 0 to n - 2.
+
+    The original bottom card reaching the top, and being inserted at random, is a strong uniform time: the deck after the last move is
+    uniformly random and independent of the number of moves. With `final_decks`, these decks are built by inserting the cards one by one 
+    at a random position, see `_insertion_decks`.
+
+    :param  n_trials: number of trials
+            n_cards_in_deck: number of cards in the deck
+            final_decks: if True, also yield the deck after the last move of each trial
+            chunk_size: number of trials per yielded chunk. If None, all trials are yielded at once
+            rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
+            instrumentation: an instrumentation.Instrumentation to measure the simulation, e.g. the time per phase and the throughput
+    :return generator, yielding for each chunk a numpy array with the number of moves in each trial, or a dict with the arrays 'moves' 
+            and 'deck' when `final_decks` is True
+    """
+    instrumentation = get_instrumentation(instrumentation)
+    rng = instrumentation.wrap_rng(np.random if rng is None else rng)
+
+    instrumentation.start(n_trials)
+    try:
+        for n_trials_in_chunk in _chunk_sizes(n_trials, chunk_size):
+            with instrumentation.phase('moves'):
+                moves: np.ndarray = np.ones(n_trials_in_chunk, dtype=np.int64)
+                for j in range(1, n_cards_in_deck):
+                    moves += rng.geometric(j / n_cards_in_deck, size=n_trials_in_chunk)
+
+            if not final_decks:
+                instrumentation.update(n_trials_in_chunk)
+                yield moves
+                continue
+
+            # card c is inserted at a random position among the c positions in a deck of c - 1 cards
+            with instrumentation.phase('decks'):
+                slots: np.ndarray = np.floor(rng.random((n_trials_in_chunk, n_cards_in_deck)) * np.arange(1, n_cards_in_deck + 1)).astype(np.int64)
+                decks: np.ndarray = _insertion_decks(slots)
+            instrumentation.update(n_trials_in_chunk, n_trials_in_chunk)
+            yield {'moves': moves, 'deck': decks}
+    finally:
+        instrumentation.finish()
+
+
+def _insertion_decks(slots: np.ndarray) -> np.ndarray:
+    """
+    Builds a batch of decks by inserting the cards 1 to n one by one: card c is inserted at position slots[:, c - 1] (0 to c - 1) in the deck 
+    holding the cards 1 to c - 1.
+
+    The insertions are resolved from the last card to the first: a card ends up at the slots[:, c - 1]-th position that is not taken by the 
+    cards inserted after it. The free positions are kept in a Fenwick tree, so each card is placed with O(log n) vectorized steps over 
+    all decks.
+
+    :param  slots: 2-D numpy array with shape (n_decks, n_cards), the insertion position of each card
+    :return 2-D numpy array with shape (n_decks, n_cards), holding the decks
+    """
+    n_decks, n_cards = slots.shape
+    rows: np.ndarray = np.arange(n_decks)
+
+    # Fenwick tree over the positions 1 to n_cards, counting the free positions. Initially all positions are free.
+    index: np.ndarray = np.arange(n_cards + 1)
+    tree: np.ndarray = np.tile(index & -index, (n_decks, 1))
+
+    decks: np.ndarray = np.empty((n_decks, n_cards), dtype=card_dtype(n_cards))
+    highest_step: int = 1 << (n_cards.bit_length() - 1)
+
+    for card in range(n_cards, 0, -1):
+        # find the position holding the rank-th free position, with binary lifting
+        rank: np.ndarray = slots[:, card - 1] + 1
+        position: np.ndarray = np.zeros(n_decks, dtype=np.int64)
+        step: int = highest_step
+        while step:
+            candidate: np.ndarray = position + step
+            in_range: np.ndarray = candidate <= n_cards
+            free: np.ndarray = tree[rows, np.minimum(candidate, n_cards)]
+            move: np.ndarray = in_range & (free < rank)
+            position = np.where(move, candidate, position)
+            rank = np.where(move, rank - free, rank)
+            step >>= 1
+
+        decks[rows, position] = card
+
+        # mark position + 1 (1-based) as taken
+        update: np.ndarray = position + 1
+        active: np.ndarray = rows
+        while len(active) > 0:
+            tree[active, update[active]] -= 1
+            update[active] += update[active] & -update[active]
+            active = active[update[active] <= n_cards]
+
+    return decks
+
+
+def iter_top_in_at_random_shuffle_simulation(n_trials: int, n_cards_in_deck: int, record_at: set = None, stride: int = None, 
+                                             chunk_size: int = None, rng=None, instrumentation: Instrumentation = None):
+    """
+    Generator version of `top_in_at_random_shuffle_simulation`. The trials are yielded while they are simulated, and only the decks 
+    after the move numbers given by `record_at` and `stride` are kept (see `recorded_shuffle_numbers`). The deck is only copied for the
+    moves that are kept.
+
+    :param  n_trials: number of trials
+            n_cards_in_deck: number of cards in the deck
+            record_at: a set of move numbers after which the decks are kept
+            stride: keep the decks after every `stride`-th move
+            chunk_size: number of trials per yielded chunk. If None, one trial is yielded at a time
+            rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
+            instrumentation: an instrumentation.Instrumentation to measure the simulation, e.g. the time per phase and the throughput
+    :return generator, yielding a list of the kept Decks for each trial, or a list of these lists for each chunk of trials
+    """
+    instrumentation = get_instrumentation(instrumentation)
+    rng = instrumentation.wrap_rng(rng)
+    yield from _in_chunks(_iter_top_in_at_random_shuffle_trials(n_trials, n_cards_in_deck, record_at, stride, rng, instrumentation), chunk_size)
+
+
+def _iter_top_in_at_random_shuffle_trials(n_trials: int, n_cards_in_deck: int, record_at: set = None, stride: int = None, rng=None, 
+                                          instrumentation: Instrumentation = None):
+    """
+    Yields the kept Decks of each trial of the top in at random simulation, see `iter_top_in_at_random_shuffle_simulation`.
+    """
+    instrumentation = get_instrumentation(instrumentation)
+    instrumentation.start(n_trials)
+    try:
+        for i_trial in range(n_trials):
+            trial_result: list = []
+
+            deck: Deck = Deck().init_new_deck(n_cards_in_deck)
+            bottom_card: int = deck[-1]
+            top_card: int = deck[0]
+            move_number: int = 0
+            
+            # perform top in at random moves until the bottom card is on top, and then one more move for the bottom card
+            while True:
+                last_move: bool = top_card == bottom_card
+                with instrumentation.phase('shuffle'):
+                    deck: Deck = shuffles.top_in_at_random_shuffle(deck, rng=rng)
+                move_number += 1
+                if _is_recorded(move_number, record_at, stride):
+                    with instrumentation.phase('copy'):
+                        deck_copy: Deck = deck.copy()
+                    with instrumentation.phase('record'):
+                        trial_result.append(deck_copy)
+                if last_move:
+                    break
+                top_card: int = deck[0]
+            
+            instrumentation.update(1, move_number)
+            yield trial_result
+    finally:
+        instrumentation.finish()
         
-        result.append(trial_result)
 
-    return result
+def overhand_shuffle_simulation(n_trials: int, n_cards_in_deck: int, max_n_shuffle: int, p: float = 0.25, vectorized: bool = False, 
+                                rng=None, instrumentation: Instrumentation = None):
+    """
+    Simulate `n_trials` trials. In each trial a new deck of `n_cards_in_deck` cards is overhand shuffled `max_n_shuffle` times.
+
+    By default the result is a list of lists: for each trial a list with the shuffled Deck after each overhand shuffle.
+    When `vectorized` is True, all trials are shuffled at once with `shuffles.overhand_shuffle_batch` and the result is a 3-D numpy array 
+    with shape (n_trials, max_n_shuffle, n_cards_in_deck).
+
+    To keep only some of the shuffled decks, e.g. only the decks after the last shuffle, use `iter_overhand_shuffle_simulation`.
+
+    :param  n_trials: number of trials
+            n_cards_in_deck: number of cards in the deck
+            max_n_shuffle: number of overhand shuffles in each trial
+            p: binomial parameter for the clump sizes, see `shuffles.overhand_shuffle`
+            vectorized: if True, use the batched overhand shuffle and return a numpy array
+            rng: source of random numbers, a numpy.random.Generator or a variates.RandomVariatePool. If None, the global numpy random state 
+                 is used (see np.random.seed)
+            instrumentation: an instrumentation.Instrumentation to measure the simulation, e.g. the time per phase and the throughput
+    :return list of lists with Deck objects, or a 3-D numpy array when `vectorized` is True
+    """
+    if vectorized:
+        return next(iter_overhand_shuffle_simulation(n_trials, n_cards_in_deck, max_n_shuffle, p=p, vectorized=True, 
+                                                     rng=rng, instrumentation=instrumentation))
+
+    return list(iter_overhand_shuffle_simulation(n_trials, n_cards_in_deck, max_n_shuffle, p=p, rng=rng, instrumentation=instrumentation))
+
+
+def iter_overhand_shuffle_simulation(n_trials: int, n_cards_in_deck: int, max_n_shuffle: int, p: float = 0.25, record_at: set = None, 
+                                     stride: int = None, chunk_size: int = None, vectorized: bool = False, rng=None, 
+                                     instrumentation: Instrumentation = None):
+    """
+    Generator version of `overhand_shuffle_simulation`. The trials are yielded while they are simulated, and only the decks after the
+    shuffle numbers given by `record_at` and `stride` are kept (see `recorded_shuffle_numbers`).
+
+    E.g.: only keep the decks after 2704 overhand shuffles:
+        for trial in iter_overhand_shuffle_simulation(5000, 52, 2800, p=0.25, record_at={2704}):
+            ...  # trial is a list with one Deck
+
+    E.g.: the same, with all trials shuffled at once:
+        decks = next(iter_overhand_shuffle_simulation(5000, 52, 2800, p=0.25, record_at={2704}, vectorized=True))[:, 0]
+
+    :param  n_trials: number of trials
+            n_cards_in_deck: number of cards in the deck
+            max_n_shuffle: number of overhand shuffles in each trial
+            p: binomial parameter for the clump sizes, see `shuffles.overhand_shuffle`
+            record_at: a set of shuffle numbers after which the decks are kept
+            stride: keep the decks after every `stride`-th shuffle
+            chunk_size: number of trials per yielded chunk. If None, one trial is yielded at a time (or all trials, when vectorized)
+            vectorized: if True, use the batched overhand shuffle and yield numpy arrays with shape (trials in chunk, recorded shuffles, cards)
+            rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
+            instrumentation: an instrumentation.Instrumentation to measure the simulation, e.g. the time per phase and the throughput
+    :return generator, yielding a list of the kept Decks for each trial, or a list of these lists for each chunk of trials
+    """
+    instrumentation = get_instrumentation(instrumentation)
+    rng = instrumentation.wrap_rng(rng)
 
+    if vectorized:
+        yield from _iter_batched_trials(n_trials, n_cards_in_deck, recorded_shuffle_numbers(max_n_shuffle, record_at, stride), chunk_size,
+                                        lambda decks: shuffles.overhand_shuffle_batch(decks, p=p, rng=rng), instrumentation)
+        return
 
-def premo_simulation(n_trials: int, n_cards_in_deck: int, max_riffle_shuffle: int) -> list:
+    shuffle_numbers: set = set(recorded_shuffle_numbers(max_n_shuffle, record_at, stride))
+    yield from _in_chunks(_iter_overhand_shuffle_trials(n_trials, n_cards_in_deck, max_n_shuffle, p, shuffle_numbers, rng, instrumentation), 
+                          chunk_size)
+
+
+def _iter_overhand_shuffle_trials(n_trials: int, n_cards_in_deck: int, max_n_shuffle: int, p: float, shuffle_numbers: set, rng=None, 
+                                  instrumentation: Instrumentation = None):
+    """
+    Yields the kept Decks of each trial of the overhand shuffle simulation, see `iter_overhand_shuffle_simulation`.
+    """
+    instrumentation = get_instrumentation(instrumentation)
+    instrumentation.start(n_trials)
+    try:
+        for i_trial in range(n_trials):
+            deck: Deck = Deck().init_new_deck(n_cards_in_deck)
+
+            trial_result: list = []
+            
+            for shuffle_number in range(1, max_n_shuffle + 1):
+                # overhand_shuffle returns a new Deck, the previous deck is not altered
+                with instrumentation.phase('shuffle'):
+                    deck: Deck = shuffles.overhand_shuffle(deck, p=p, rng=rng)
+                if shuffle_number in shuffle_numbers:
+                    with instrumentation.phase('record'):
+                        trial_result.append(deck)
+            
+            instrumentation.update(1, max_n_shuffle)
+            yield trial_result
+    finally:
+        instrumentation.finish()
+
+
+def premo_simulation(n_trials: int, n_cards_in_deck: int, max_riffle_shuffle: int, rng=None, instrumentation: Instrumentation = None) -> list:
+    """
+    Simulate `n_trials` trials of the premo trick. In each trial a new deck of `n_cards_in_deck` cards is cut and riffle shuffled 
+    `max_riffle_shuffle` times. After each cut and riffle shuffle the trick is completed on a copy of the deck: the top card is taken, 
+    inserted at a random position in the deck, and the deck is cut once more.
+
+    :param  n_trials: number of trials
+            n_cards_in_deck: number of cards in the deck
+            max_riffle_shuffle: number of cuts and riffle shuffles in each trial
+            rng: source of random numbers, a numpy.random.Generator or a variates.RandomVariatePool. If None, the global numpy random state 
+                 is used (see np.random.seed)
+            instrumentation: an instrumentation.Instrumentation to measure the simulation, e.g. the time per phase and the throughput
+    :return list of dicts, one per trial and shuffle number, with the top card, the deck after the trick, the trial number and the 
+            shuffle number
+    """
     result: list = []
+    instrumentation = get_instrumentation(instrumentation)
+    rng = instrumentation.wrap_rng(np.random if rng is None else rng)
+    instrumentation.start(n_trials)
 
-    # For each trial, create cut and shuffled decks, between 1 shuffle and max_riffle shuffle
-    # These cut and shuffled decks will be used later to pick a top card and then cut once more to complete the premo trick
-    cut_and_shuffled_decks_all_trials: list = []
-    for _ in range(n_trials):
-        cut_and_shuffled_decks_per_trial = []
-        d: Deck = Deck().init_new_deck(n_cards_in_deck)
+    try:
+        # For each trial, create cut and shuffled decks, between 1 shuffle and max_riffle shuffle
+        # These cut and shuffled decks will be used later to pick a top card and then cut once more to complete the premo trick
+        cut_and_shuffled_decks_all_trials: list = []
+        for _ in range(n_trials):
+            cut_and_shuffled_decks_per_trial = []
+            d: Deck = Deck().init_new_deck(n_cards_in_deck)
         
-        for e, _ in enumerate(range(max_riffle_shuffle)):
-            d = d.copy()
+            for e, _ in enumerate(range(max_riffle_shuffle)):
+                with instrumentation.phase('copy'):
+                    d = d.copy()
             
-            cut_position = np.random.randint(len(d)) # get uniform cut position
-            d = d.cut_deck(cut_position)
-            d = shuffles.riffle_shuffle(d)
+                with instrumentation.phase('cut'):
+                    cut_position = shuffles.random_integers(rng, len(d)) # get uniform cut position
+                    d = d.cut_deck(cut_position)
+                with instrumentation.phase('shuffle'):
+                    d = shuffles.riffle_shuffle(d, rng=rng)
             
-            cut_and_shuffled_decks_per_trial.append(d)
-        cut_and_shuffled_decks_all_trials.append(cut_and_shuffled_decks_per_trial)
-
-    # `Cut_and_shuffled_decks` holds lists. Each list represents a trial. Each trial holds 1 to max_riffle_shuffles number of decks that
-    # have been cut and riffle shuffled.
-    # From these decks in each trial, we will pick the top card, place it randomly in the deck and cut once more.
-    for trial_num, trial in enumerate(cut_and_shuffled_decks_all_trials, 1):
-        for shuffle_num, d in enumerate(trial, 1):
-            d: Deck = d.copy()
-            row: dict = {}
-            top_card: int = d.popleft()
-            random_position_for_top_card: int = np.random.binomial(len(d), p=0.5)
-            d.insert(random_position_for_top_card, top_card)
-
-            cut_position: int = np.random.randint(len(d))
-            d = d.cut_deck(cut_position)
-
-            row['top_card'] = top_card
-            row['deck'] = d
-            row['trial'] = trial_num
-            row['shuffle'] = shuffle_num
-        
-            result.append(row)
+                with instrumentation.phase('record'):
+                    cut_and_shuffled_decks_per_trial.append(d)
+            cut_and_shuffled_decks_all_trials.append(cut_and_shuffled_decks_per_trial)
+            instrumentation.update(1, max_riffle_shuffle)
 
+        # `Cut_and_shuffled_decks` holds lists. Each list represents a trial. Each trial holds 1 to max_riffle_shuffles number of decks that
+        # have been cut and riffle shuffled.
+        # From these decks in each trial, we will pick the top card, place it randomly in the deck and cut once more.
+        for trial_num, trial in enumerate(cut_and_shuffled_decks_all_trials, 1):
+            for shuffle_num, d in enumerate(trial, 1):
+                with instrumentation.phase('trick'):
+                    result.append(_premo_row(d, trial_num, shuffle_num, rng))
+    finally:
+        instrumentation.finish()
     return result
+
+
+def _premo_row(d: Deck, trial_num: int, shuffle_num: int, rng=None) -> dict:
+    """
+    Completes the premo trick on a copy of a cut and riffle shuffled deck: pick the top card, place it randomly in the deck and cut once more.
+
+    :return dict with the top card, the resulting deck, the trial number and the shuffle number
+    """
+    rng = np.random if rng is None else rng
+    d: Deck = d.copy()
+    row: dict = {}
+    top_card: int = d.popleft()
+    random_position_for_top_card: int = rng.binomial(len(d), p=0.5)
+    d.insert(random_position_for_top_card, top_card)
+
+    cut_position: int = shuffles.random_integers(rng, len(d))
+    d = d.cut_deck(cut_position)
+
+    row['top_card'] = top_card
+    row['deck'] = d
+    row['trial'] = trial_num
+    row['shuffle'] = shuffle_num
+
+    return row
+
+
+def iter_premo_simulation(n_trials: int, n_cards_in_deck: int, max_riffle_shuffle: int, record_at: set = None, stride: int = None, 
+                          chunk_size: int = None, rng=None, instrumentation: Instrumentation = None):
+    """
+    Generator version of `premo_simulation`. For each trial, the rows (see `premo_simulation`) are yielded as soon as the trial is
+    simulated, and only for the shuffle numbers given by `record_at` and `stride` (see `recorded_shuffle_numbers`).
+
+    Note: `premo_simulation` first cuts and shuffles the decks of all trials, before it completes the trick for each deck. This generator
+    completes the trick trial by trial, so the random numbers are drawn in a different order. For the same seed, the results are 
+    therefore different from `premo_simulation`, but they follow the same distribution.
+
+    :param  n_trials: number of trials
+            n_cards_in_deck: number of cards in the deck
+            max_riffle_shuffle: number of cuts and riffle shuffles in each trial
+            record_at: a set of shuffle numbers for which the trick is completed and kept
+            stride: complete and keep the trick after every `stride`-th shuffle
+            chunk_size: number of trials per yielded chunk. If None, one trial is yielded at a time
+            rng: source of random numbers, a numpy.random.Generator. If None, the global numpy random state is used (see np.random.seed)
+            instrumentation: an instrumentation.Instrumentation to measure the simulation, e.g. the time per phase and the throughput
+    :return generator, yielding a list of rows (dicts) for each trial, or a list of these lists for each chunk of trials
+    """
+    shuffle_numbers: set = set(recorded_shuffle_numbers(max_riffle_shuffle, record_at, stride))
+    instrumentation = get_instrumentation(instrumentation)
+    rng = instrumentation.wrap_rng(rng)
+    yield from _in_chunks(_iter_premo_trials(n_trials, n_cards_in_deck, max_riffle_shuffle, shuffle_numbers, rng, instrumentation), chunk_size)
+
+
+def _iter_premo_trials(n_trials: int, n_cards_in_deck: int, max_riffle_shuffle: int, shuffle_numbers: set, rng=None, 
+                       instrumentation: Instrumentation = None):
+    """
+    Yields the rows of each trial of the premo simulation, see `iter_premo_simulation`.
+    """
+    rng = np.random if rng is None else rng
+    instrumentation = get_instrumentation(instrumentation)
+    instrumentation.start(n_trials)
+    try:
+        for trial_num in range(1, n_trials + 1):
+            trial_result: list = []
+            d: Deck = Deck().init_new_deck(n_cards_in_deck)
+
+            for shuffle_num in range(1, max_riffle_shuffle + 1):
+                with instrumentation.phase('cut'):
+                    cut_position = shuffles.random_integers(rng, len(d)) # get uniform cut position
+                    d = d.cut_deck(cut_position)
+                with instrumentation.phase('shuffle'):
+                    d = shuffles.riffle_shuffle(d, rng=rng)
+
+                if shuffle_num in shuffle_numbers:
+                    with instrumentation.phase('trick'):
+                        trial_result.append(_premo_row(d, trial_num, shuffle_num, rng))
+
+            instrumentation.update(1, max_riffle_shuffle)
+            yield trial_result
+    finally:
+        instrumentation.finish()
         
 
 if __name__ == "__main__":
@@ -153,6 +756,7 @@ if __name__ == "__main__":
     # When setting the random seeds for a-shuffled and riffle shuffled to the same number, running the same number of trials should yield the same result
     np.random.seed(RANDOM_SEED)
     r = riffle_shuffle_simulation(n_trials=N_TRIALS, n_cards_in_deck=N_CARDS, max_n_riffle_shuffle=MAX_RIFFLE_SHUFFLES)
+    np.random.seed(RANDOM_SEED)
     a_r = a_shuffle_simulation(n_trials=N_TRIALS, a=2, n_cards_in_deck=N_CARDS, max_n_shuffle=MAX_RIFFLE_SHUFFLES)
     
     riffle_rising_sequences = {}
@@ -170,6 +774,25 @@ if __name__ == "__main__":
     assert len(r) == N_TRIALS
     assert len(a_r) == N_TRIALS
     assert riffle_rising_sequences == a_rising_sequences
+
+    # The vectorized a-shuffle with a=2 should match the riffle shuffle in distribution. Compare the mean number of rising sequences
+    # after 1 to 6 shuffles of a deck with 8 cards, with the theoretical means.
+    N_TRIALS_DISTRIBUTION = 20000
+    v_r = riffle_shuffle_simulation(n_trials=N_TRIALS_DISTRIBUTION, n_cards_in_deck=8, max_n_riffle_shuffle=6, vectorized=True)
+    v_a_r = a_shuffle_simulation(n_trials=N_TRIALS_DISTRIBUTION, a=2, n_cards_in_deck=8, max_n_shuffle=6, vectorized=True)
+    v_a_r_collapsed = a_shuffle_simulation(n_trials=N_TRIALS_DISTRIBUTION, a=2, n_cards_in_deck=8, max_n_shuffle=6, vectorized=True,
+                                           shuffle_numbers=[3, 6])
+    
+    def mean_rising_sequences(decks):
+        return np.mean(rising_sequences_batch(decks))
+
+    for k in range(1, 6 + 1):
+        # the expected number of rising sequences after k riffle shuffles, according to the Bayer-Diaconis formula
+        expected = sum(r * stats.eulerian(8, r) * stats.probability_rising_sequence(2, 8, k, r) for r in range(1, 8 + 1))
+        assert abs(mean_rising_sequences(v_r[:, k - 1]) - expected) < 0.05
+        assert abs(mean_rising_sequences(v_a_r[:, k - 1]) - expected) < 0.05
+        if k in [3, 6]:
+            assert abs(mean_rising_sequences(v_a_r_collapsed[:, [3, 6].index(k)]) - expected) < 0.05
     
     
     # number of moves to get the bottom card to the top, should be equal or greater than the number of cards in the deck
@@ -183,4 +806,51 @@ if __name__ == "__main__":
     
     
     MAX_OVERHAND_SHUFFLES = 10000
-    o_r = overhand_shuffle_simulation(n_trials=N_TRIALS, n_cards_in_deck=N_CARDS, max_n_shuffle=MAX_OVERHAND_SHUFFLES, p=0.2)
\ No newline at end of file
+    o_r = overhand_shuffle_simulation(n_trials=N_TRIALS, n_cards_in_deck=N_CARDS, max_n_shuffle=MAX_OVERHAND_SHUFFLES, p=0.2)
+    # The generators should keep the same decks as the full simulation, when run with the same seed
+    np.random.seed(RANDOM_SEED)
+    full_o_r = overhand_shuffle_simulation(n_trials=N_TRIALS, n_cards_in_deck=N_CARDS, max_n_shuffle=100, p=0.2)
+    np.random.seed(RANDOM_SEED)
+    chunks = list(iter_overhand_shuffle_simulation(n_trials=N_TRIALS, n_cards_in_deck=N_CARDS, max_n_shuffle=100, p=0.2, record_at={10}, 
+                                                   stride=25, chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert recorded_shuffle_numbers(100, record_at={10}, stride=25) == [10, 25, 50, 75, 100]
+    for full_trial, trial in zip(full_o_r, [trial for chunk in chunks for trial in chunk]):
+        assert [list(d) for d in trial] == [list(full_trial[n - 1]) for n in [10, 25, 50, 75, 100]]
+
+    np.random.seed(RANDOM_SEED)
+    full_v_r = riffle_shuffle_simulation(n_trials=100, n_cards_in_deck=N_CARDS, max_n_riffle_shuffle=MAX_RIFFLE_SHUFFLES, vectorized=True)
+    np.random.seed(RANDOM_SEED)
+    v_r_chunk = next(iter_riffle_shuffle_simulation(n_trials=100, n_cards_in_deck=N_CARDS, max_n_riffle_shuffle=MAX_RIFFLE_SHUFFLES, 
+                                                    stride=5, chunk_size=100, vectorized=True))
+    assert (v_r_chunk == full_v_r[:, [4, 9, 14, 19]]).all()
+
+    v_o_r = overhand_shuffle_simulation(n_trials=100, n_cards_in_deck=N_CARDS, max_n_shuffle=50, p=0.25, vectorized=True)
+    assert v_o_r.shape == (100, 50, N_CARDS)
+    assert (np.sort(v_o_r, axis=-1) == np.arange(1, N_CARDS + 1)).all()
+
+    # The number of moves from the stopping time mode should follow the same distribution as the number of moves in the simulation.
+    # Its mean is 1 + n * (1 + 1/2 + ... + 1/(n-1))
+    expected_moves = 1 + N_CARDS * sum(1 / j for j in range(1, N_CARDS))
+    moves = top_in_at_random_shuffle_simulation(n_trials=100000, n_cards_in_deck=N_CARDS, stopping_time=True)
+    assert abs(moves.mean() - expected_moves) < 1 and moves.min() >= N_CARDS
+    assert abs(np.mean([len(trial) for trial in top_in_at_random_shuffle_simulation(n_trials=500, n_cards_in_deck=N_CARDS)]) - expected_moves) < 5
+
+    final = top_in_at_random_shuffle_simulation(n_trials=20000, n_cards_in_deck=5, stopping_time=True, final_decks=True)
+    assert final['deck'].shape == (20000, 5) and (np.sort(final['deck'], axis=1) == np.arange(1, 6)).all()
+    # the final decks are uniformly distributed over the 120 permutations
+    assert len({tuple(d) for d in final['deck']}) == 120
+    assert np.abs((final['deck'] == 1).mean(axis=0) - 0.2).max() < 0.02
+
+    # A simulation of 0 trials gives an empty result, like the list versions
+    assert riffle_shuffle_simulation(0, N_CARDS, 3, vectorized=True).shape == (0, 3, N_CARDS) and riffle_shuffle_simulation(0, N_CARDS, 3) == []
+    assert top_in_at_random_shuffle_simulation(0, N_CARDS, stopping_time=True).shape == (0,)
+
+    # For a > 2 the vectorized a-shuffle is another shuffle model, which has to be chosen explicitly
+    assert a_shuffle_simulation(10, 3, N_CARDS, 2, vectorized=True, model="a_shuffle_batch").shape == (10, 2, N_CARDS)
+    for vectorized, model in [(True, "a_shuffle"), (False, "a_shuffle_batch")]:
+        try:
+            a_shuffle_simulation(10, 3, N_CARDS, 2, vectorized=vectorized, model=model)
+            assert False
+        except ValueError:
+            pass
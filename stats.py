@@ -1,29 +1,77 @@
 import math
+from collections import OrderedDict
+from statistics import NormalDist
 import numpy as np
 import pandas as pd
-from deck import Deck
+from deck import Deck, inverse_permutation_batch, rising_sequences_batch
+
+
+# Rows of the Eulerian triangle that have been computed, see `eulerian_row`. The least recently used rows are evicted when the cache holds
+# more than EULERIAN_CACHE_MAX_ENTRIES numbers, to keep the memory bounded for large n (the numbers in row n have about n*log2(n) bits).
+EULERIAN_CACHE_MAX_ENTRIES: int = 50000
+_eulerian_rows: OrderedDict = OrderedDict()
+
+
+def eulerian_row(n: int) -> tuple:
+    """
+    This function returns the row n of the Eulerian triangle: the Eulerian numbers for n and r = 1 to n, as a tuple of integers.
+    The row is computed with the recurrence A(n, r) = r * A(n-1, r) + (n-r+1) * A(n-1, r-1), see: https://en.wikipedia.org/wiki/Eulerian_number
+    
+    Computed rows are cached and reused across calls. To compute row n, the computation starts at the largest cached row below n.
+
+    E.g.:
+        eulerian_row(4) --> (1, 11, 11, 1)
+
+    :param  n: total number of elements considered
+    :return tuple with the Eulerian numbers A(n, 1), ..., A(n, n). eulerian_row(n)[r - 1] is the number of permutations with r rising sequences
+    """
+    if n < 1:
+        return ()
+    if n in _eulerian_rows:
+        _eulerian_rows.move_to_end(n)
+        return _eulerian_rows[n]
+
+    start: int = max((m for m in _eulerian_rows if m < n), default=1)
+    row: tuple = _eulerian_rows[start] if start in _eulerian_rows else (1,)
+
+    for m in range(start + 1, n + 1):
+        # previous row, padded with A(m-1, 0) = 0 and A(m-1, m) = 0
+        previous: tuple = (0,) + row + (0,)
+        row = tuple(r * previous[r] + (m - r + 1) * previous[r - 1] for r in range(1, m + 1))
+        _cache_eulerian_row(m, row)
+
+    return row
+
+
+def _cache_eulerian_row(n: int, row: tuple) -> None:
+    """
+    Helper function that adds a row to the cache of Eulerian rows, and evicts the least recently used rows when the cache is full.
+    Rows larger than the cache are not stored.
+    """
+    if len(row) > EULERIAN_CACHE_MAX_ENTRIES:
+        return
+    _eulerian_rows[n] = row
+    _eulerian_rows.move_to_end(n)
+    while sum(len(r) for r in _eulerian_rows.values()) > EULERIAN_CACHE_MAX_ENTRIES:
+        _eulerian_rows.popitem(last=False)
 
 
 def eulerian(n: int, r: int) -> int:
     """
-    This function returns the Eulerian number for n, according to the explicit formula, see here: https://en.wikipedia.org/wiki/Eulerian_number
+    This function returns the Eulerian number for n and r, see here: https://en.wikipedia.org/wiki/Eulerian_number
+    The value is taken from the cached Eulerian triangle, see `eulerian_row`.
 
     :param  n: total number of elements considered (0 to n).
-            r: number of possible permutations with r ascents
+            r: number of rising sequences (r = 1 to n), i.e. permutations with r - 1 descents
 
     :return Eulerian number as an integer
     """
-    if n < 0 or r < 0 or r >= n:
-        return 0
-    elif n == 0 and r == 0:
+    if n == 0 and r == 0:
         return 1
+    elif n < 0 or r < 1 or r > n:
+        return 0
 
-    result = 0
-
-    for i in range(0, r+1):
-        result += ((-1)**i) * math.comb(n+1, i) * ((r-i)**n)
-
-    return result
+    return eulerian_row(n)[r - 1]
 
 
 def uniform(n: int) -> float:
@@ -47,6 +95,86 @@ def probability_rising_sequence(a: int, n: int, k: int, r: int) -> float:
     return math.comb(n-r+(a**k), n) / (a**(k*n))
 
 
+def _binomial_terms(a: int, n: int, k: int):
+    """
+    Yields the numerators of `probability_rising_sequence`, C(n - r + a**k, n), for r = 1 to n, as exact integers.
+    Only the first term is computed with math.comb. The next terms follow from C(N - 1, n) = C(N, n) * (N - n) / N.
+    """
+    top: int = n - 1 + a**k
+    term: int = math.comb(top, n)
+    for r in range(1, n + 1):
+        yield term
+        term = term * (top - n) // top if top > 0 else 0
+        top -= 1
+
+
+def _theoretical_total_variation_distance(a: int, n: int, k: int) -> float:
+    """
+    Exact theoretical TVD between k a-shuffles of a deck of n cards and the uniform distribution. The sum is done with exact integers,
+    and only the final ratio is converted to a float, so the result does not overflow for large n.
+    """
+    a_kn: int = a**(k*n)
+    n_factorial: int = math.factorial(n)
+
+    # sum over r of A(n, r) * |C(n - r + a**k, n) / a**(kn) - 1 / n!|, multiplied by a**(kn) * n!
+    var_distance: int = sum(eul * abs(term * n_factorial - a_kn) for eul, term in zip(eulerian_row(n), _binomial_terms(a, n, k)))
+
+    return var_distance / (2 * a_kn * n_factorial)
+
+
+def log_eulerian_row(n: int) -> np.ndarray:
+    """
+    Returns the natural logarithms of row n of the Eulerian triangle, log A(n, r) for r = 1 to n, as floats.
+    The row is computed with the recurrence of `eulerian_row` in log space, with np.logaddexp, one row at a time. Unlike the exact integers,
+    whose size grows with n, this only needs two arrays of n floats, so it works for decks of many thousands of cards.
+
+    :param  n: total number of elements considered
+    :return numpy array with log A(n, 1), ..., log A(n, n)
+    """
+    row: np.ndarray = np.zeros(min(n, 1))
+    for m in range(2, n + 1):
+        r: np.ndarray = np.arange(1, m + 1)
+        # previous row, padded with log A(m-1, 0) = log A(m-1, m) = -inf
+        previous: np.ndarray = np.concatenate(([-np.inf], row, [-np.inf]))
+        row = np.logaddexp(np.log(r) + previous[1:], np.log(m - r + 1) + previous[:-1])
+    return row
+
+
+def _log_normalize(log_values: np.ndarray) -> np.ndarray:
+    """
+    Helper function that returns log_values minus the log of the sum of exp(log_values), so that their exponents sum to 1, without
+    overflow. This also removes the rounding errors that all log_values have in common.
+    """
+    largest: float = log_values.max()
+    return log_values - largest - np.log(np.exp(log_values - largest).sum())
+
+
+def _log_total_variation_distance(a: int, n: int, k: int, log_eulerian_probabilities: np.ndarray) -> float:
+    """
+    Theoretical TVD between k a-shuffles of a deck of n cards and the uniform distribution, computed in log space with floats.
+
+    The probability of r rising sequences after k a-shuffles is A(n, r) / n! * exp(x_r), with x_r = log(C(n - r + a**k, n) / a**(kn) * n!).
+    x_r is the sum of log1p(m / a**k) for m = 1 - r to n - r: a sliding window over the same 2n - 1 terms for all r. This avoids the
+    cancellation of lgamma(n - r + a**k + 1) - lgamma(a**k - r + 1) when a**k is large.
+
+    :param  log_eulerian_probabilities: log(A(n, r) / n!) for r = 1 to n, see `log_eulerian_row`
+    """
+    a_k: int = a**k
+    r: np.ndarray = np.arange(1, n + 1)
+    possible: np.ndarray = r <= a_k  # at most a**k rising sequences after k a-shuffles: C(n - r + a**k, n) = 0 for r > a**k
+
+    m: np.ndarray = np.arange(1 - min(n, a_k), n)
+    cumulative: np.ndarray = np.concatenate(([0.0], np.cumsum(np.log1p(m * (1 / a_k if a_k < 2**1023 else 0.0)))))
+    # the terms m = 1 - r to n - r are at indices m - m[0]
+    first: np.ndarray = 1 - r[possible] - m[0]
+    x: np.ndarray = cumulative[first + n] - cumulative[first]
+
+    shuffle_probabilities: np.ndarray = np.zeros(n)
+    shuffle_probabilities[possible] = np.exp(_log_normalize(log_eulerian_probabilities[possible] + x))
+
+    return float(np.abs(shuffle_probabilities - np.exp(log_eulerian_probabilities)).sum() / 2)
+
+
 def theoretical_total_variation_distance_riffle_shuffle(a: int, n: int, k: int, r: int, uniform_probability: float) -> float:
     """
     Calculate theoretical TVD based on a packets, n cars, k shuffles and r rising sequences. Compare versus uniform_probability
@@ -56,8 +184,7 @@ def theoretical_total_variation_distance_riffle_shuffle(a: int, n: int, k: int,
 
     var_distance: float = 0
 
-    for r in range(1, n+1):
-        eul: int = eulerian(n, r)
+    for r, eul in enumerate(eulerian_row(n), 1):
         prob_r: float = probability_rising_sequence(a, n, k, r)
         if eul > 0:
             var_distance += eul * abs(prob_r - uniform_probability)
@@ -65,6 +192,141 @@ def theoretical_total_variation_distance_riffle_shuffle(a: int, n: int, k: int,
     return var_distance / 2
 
 
+def theoretical_total_variation_distance_sweep(n_values: list, k_values: list, a_values: list = (2,), log_space: bool = False) -> np.ndarray:
+    """
+    Calculate the theoretical TVD for every combination of a number of cards n, a number of shuffles k and a number of packets a, in one call.
+    The Eulerian numbers for each n are computed once (see `eulerian_row`), and the binomial terms for each r follow from the previous r.
+
+    The exact integers have thousands of digits for large n, which makes this slow beyond a few hundred cards. With `log_space` True, the TVD
+    is computed with floats in log space instead (see `log_eulerian_row`), which takes seconds for decks of several thousand cards, e.g. a 
+    shoe of 8 decks. Both agree to about 1e-11.
+
+    E.g.: the TVD after 1 to 15 riffle shuffles, for decks of 26, 52, 104 and 156 cards:
+        tvd = theoretical_total_variation_distance_sweep([26, 52, 104, 156], range(1, 16))[:, :, 0]
+
+    :param  n_values: numbers of cards in the deck
+            k_values: numbers of shuffles
+            a_values: numbers of packets in the a-shuffle, 2 for a riffle shuffle
+            log_space: if True, compute in log space with floats instead of with exact integers
+    :return numpy array with shape (len(n_values), len(k_values), len(a_values)) holding the TVD for each (n, k, a)
+    """
+    n_values, k_values, a_values = list(n_values), list(k_values), list(a_values)
+    result: np.ndarray = np.empty((len(n_values), len(k_values), len(a_values)))
+
+    for i, n in enumerate(n_values):
+        if log_space:
+            log_eulerian_probabilities: np.ndarray = _log_normalize(log_eulerian_row(n))
+        for j, k in enumerate(k_values):
+            for l, a in enumerate(a_values):
+                if log_space:
+                    result[i, j, l] = _log_total_variation_distance(a, n, k, log_eulerian_probabilities)
+                else:
+                    result[i, j, l] = _theoretical_total_variation_distance(a, n, k)
+
+    return result
+
+
+def rising_sequence_histogram(rising_sequences: np.ndarray, n_cards: int) -> np.ndarray:
+    """
+    Counts how many decks have r rising sequences, for each shuffle number, in one scatter-add (np.bincount).
+
+    :param  rising_sequences: numpy array with shape (trials, shuffles), the number of rising sequences of each deck, 
+                              e.g. from deck.rising_sequences_batch
+            n_cards: number of cards in the deck
+    :return numpy array with shape (shuffles, n_cards + 1). counts[s, r] is the number of decks with r rising sequences after shuffle s
+    """
+    rising_sequences = np.asarray(rising_sequences)
+    n_shuffles: int = rising_sequences.shape[1]
+    index: np.ndarray = np.arange(n_shuffles) * (n_cards + 1) + rising_sequences
+    return np.bincount(index.ravel(), minlength=n_shuffles * (n_cards + 1)).reshape(n_shuffles, n_cards + 1)
+
+
+def empirical_total_variation_distance(counts) -> np.ndarray:
+    """
+    Empirical TVD between the simulated decks and the uniform distribution, for every shuffle number at once, from rising sequence 
+    counts. As in the riffle shuffle notebook, the decks with r rising sequences are assumed to be equally likely, so the TVD is
+    1/2 * sum over r of |P(r) - A(n, r) / n!|, with the Eulerian vector A(n, r) / n! computed once (see `eulerian_row`).
+
+    The counts can be the sum of the counts of several chunks or processes, e.g. from `runner.run_simulation(..., "rising_sequences")`,
+    so the rising sequences of each trial never need to be kept.
+
+    :param  counts: numpy array with shape (shuffles, n_cards + 1) or (n_cards + 1,), see `rising_sequence_histogram`, or a list of 
+                    these arrays (e.g. one per chunk), which are added up
+    :return numpy array with shape (shuffles,), or a float for 1-D counts. tvd[s] is the TVD after shuffle s
+    """
+    if isinstance(counts, list):
+        counts = np.sum(counts, axis=0)
+    counts = np.asarray(counts)
+    n_cards: int = counts.shape[-1] - 1
+
+    n_factorial: int = math.factorial(n_cards)
+    eulerian_probabilities: np.ndarray = np.array([0.0] + [eul / n_factorial for eul in eulerian_row(n_cards)])
+
+    probabilities: np.ndarray = counts / counts.sum(axis=-1, keepdims=True)
+    tvd: np.ndarray = np.abs(probabilities - eulerian_probabilities).sum(axis=-1) / 2
+    return tvd if tvd.ndim else float(tvd)
+
+
+def empirical_total_variation_distance_bootstrap(counts, confidence: float = 0.95, n_bootstrap: int = 1000, rng=None) -> dict:
+    """
+    Bootstrap of `empirical_total_variation_distance`: the rising sequence counts are resampled `n_bootstrap` times from a multinomial
+    distribution with the observed frequencies, for all shuffle numbers at once, and the TVD of each resample is computed.
+
+    The empirical TVD is biased upwards: the sampling noise of every frequency adds to |P(r) - A(n, r) / n!|, which matters most when the
+    true TVD is close to 0 (many shuffles, or few trials). The resamples are biased upwards from the empirical TVD in the same way, so the
+    bias is estimated as mean(resampled TVD) - TVD, and the bias corrected estimate is 2 * TVD - mean(resampled TVD). A percentile interval
+    of the resamples would be biased twice, so the interval is the basic (reverse percentile) bootstrap interval
+    [2 * TVD - q_upper, 2 * TVD - q_lower], which holds the bias corrected estimate.
+
+    The estimate and the interval are clipped to [0, 1], the possible values of a TVD. The half width is that of the interval before
+    clipping, so it is not made smaller by the clipping when the TVD is close to 0.
+
+    :param  counts: rising sequence counts, see `empirical_total_variation_distance`
+            confidence: confidence level of the interval
+            n_bootstrap: number of resamples
+            rng: a numpy.random.Generator. If None, a new unseeded generator is used
+    :return dict with numpy arrays with shape (shuffles,), or floats for 1-D counts:
+                'tvd': the bias corrected estimate of the TVD
+                'empirical_tvd': the empirical TVD, see `empirical_total_variation_distance`
+                'lower', 'upper': the basic bootstrap interval
+                'half_width': half the width of the basic bootstrap interval before clipping
+    """
+    if isinstance(counts, list):
+        counts = np.sum(counts, axis=0)
+    counts = np.asarray(counts)
+    rng = np.random.default_rng() if rng is None else rng
+
+    n_trials: np.ndarray = counts.sum(axis=-1)
+    resamples: np.ndarray = rng.multinomial(n_trials, counts / n_trials[..., None], size=(n_bootstrap,) + counts.shape[:-1])
+    tvd: np.ndarray = empirical_total_variation_distance(counts)
+    resampled_tvd: np.ndarray = empirical_total_variation_distance(resamples)
+
+    quantile_lower, quantile_upper = np.quantile(resampled_tvd, [0.5 - confidence / 2, 0.5 + confidence / 2], axis=0)
+    result: dict = {
+        'tvd': np.clip(2 * tvd - resampled_tvd.mean(axis=0), 0, 1),
+        'empirical_tvd': tvd,
+        'lower': np.clip(2 * tvd - quantile_upper, 0, 1),
+        'upper': np.clip(2 * tvd - quantile_lower, 0, 1),
+        'half_width': (quantile_upper - quantile_lower) / 2,
+    }
+    return result if counts.ndim > 1 else {key: float(value) for key, value in result.items()}
+
+
+def empirical_total_variation_distance_interval(counts, confidence: float = 0.95, n_bootstrap: int = 1000, rng=None) -> tuple:
+    """
+    The basic bootstrap confidence interval of the TVD, see `empirical_total_variation_distance_bootstrap`. For small TVDs the interval
+    can lie below the empirical TVD, which is biased upwards.
+
+    :param  counts: rising sequence counts, see `empirical_total_variation_distance`
+            confidence: confidence level of the interval
+            n_bootstrap: number of resamples
+            rng: a numpy.random.Generator. If None, a new unseeded generator is used
+    :return tuple (lower, upper) of numpy arrays with shape (shuffles,), or floats for 1-D counts
+    """
+    bootstrap: dict = empirical_total_variation_distance_bootstrap(counts, confidence, n_bootstrap, rng)
+    return bootstrap['lower'], bootstrap['upper']
+
+
 def find_consecutive_sequences(deck: Deck, sequence_length: int): # not used in dissertation due to unreliable results
     """
     Given a deck of cards (input parameter `deck`), this function calculates the number of consecutive subsequent cards with length `sequence_length`.
@@ -99,31 +361,89 @@ def find_consecutive_sequences(deck: Deck, sequence_length: int): # not used in
 
 def extract_decks_per_shuffle_number(results: list, shuffle_number: int) -> list:
     """
-    Extract the shuffled decks for a specific shuffle from each trial
+    Extract the shuffled decks after `shuffle_number` shuffles from each trial. In the results of the simulations, trial[i] holds the
+    deck after i + 1 shuffles, so this is trial[shuffle_number - 1].
+    `results` can also be a `store.ResultStore`, then only the decks after `shuffle_number` are read from disk, 
+    as a numpy array with shape (trials, n_cards).
     """
-    return [trial[shuffle_number + 1] for trial in results]
+    if hasattr(results, 'shuffle_slice'):
+        return results.shuffle_slice(shuffle_number)
+    return [trial[shuffle_number - 1] for trial in results]
 
 
 def create_frequency_matrix(results: list) -> pd.DataFrame:
     """
     Create big frequency matrix, showing which cards landed on which position in the deck, for each trial.
+    The rows are the cards, the columns are the positions in the deck (both starting at 1).
+
+    :param  results: a list of Decks, or a 2-D numpy array with shape (decks, n_cards)
+    :return pandas DataFrame with the number of decks holding each card on each position
+    """
+    if isinstance(results, np.ndarray):
+        return frequency_matrix_view(count_card_positions(results))
+    decks: np.ndarray = np.array([d.cards if isinstance(d, Deck) else d for d in results])
+    return frequency_matrix_view(count_card_positions(decks))
+
+
+def count_card_positions(decks: np.ndarray, counts: np.ndarray = None) -> np.ndarray:
     """
-    n_cards: int = len(results[0])
-    unique_cards: list = [c for c in range(1,  n_cards + 1)]
+    Counts how often each card lands on each position in the deck, for every shuffle number at once.
+    The counts are filled with one scatter-add (np.bincount) over all decks, instead of a Python loop over the decks and positions.
+
+    When `counts` is given, the new counts are added to it. This allows counts to be accumulated over chunks of trials, e.g.:
+        counts = None
+        for chunk in simulation.iter_riffle_shuffle_simulation(100000, 52, 15, chunk_size=10000, vectorized=True):
+            counts = count_card_positions(chunk, counts)
+
+    :param  decks: numpy array with shape (trials, shuffles, n_cards), or (trials, n_cards) for a single shuffle number. 
+                   The decks hold the cards 1 to n_cards
+            counts: counts to add the new counts to, with shape (shuffles, n_cards, n_cards) or (n_cards, n_cards)
+    :return numpy array with shape (shuffles, positions, cards), or (positions, cards) for 2-D `decks`. counts[s, i, c - 1] is the number of 
+            decks with card c on position i after shuffle s
+    """
+    decks = np.asarray(decks)
+    single_shuffle: bool = decks.ndim == 2
+    if single_shuffle:
+        decks = decks[:, None, :]
+    n_trials, n_shuffles, n_cards = decks.shape
 
-    matrix: np.array = np.zeros((n_cards, n_cards))
+    index: np.ndarray = (np.arange(n_shuffles)[:, None] * n_cards + np.arange(n_cards)) * n_cards + decks.astype(np.int64) - 1
+    new_counts: np.ndarray = np.bincount(index.ravel(), minlength=n_shuffles * n_cards * n_cards).reshape(n_shuffles, n_cards, n_cards)
+    if single_shuffle:
+        new_counts = new_counts[0]
 
-    for deck in results:
-        for idx, card in enumerate(deck):
-            row = unique_cards.index(card)
-            matrix[row][idx] += 1
+    if counts is None:
+        return new_counts
+    counts += new_counts
+    return counts
 
-    matrix: np.array = matrix.astype(int)
 
-    df: pd.DataFrame = pd.DataFrame(matrix)
+def merge_card_position_counts(counts: list) -> np.ndarray:
+    """
+    Merges card position counts (see `count_card_positions`) from several chunks of trials or processes, by adding them up.
+
+    :param  counts: list of numpy arrays with card position counts, all with the same shape
+    :return numpy array with the total counts
+    """
+    return np.sum(counts, axis=0)
+
+
+def frequency_matrix_view(counts: np.ndarray, shuffle_index: int = None) -> pd.DataFrame:
+    """
+    Returns the card position counts (see `count_card_positions`) of one shuffle as a pandas DataFrame, in the same layout as 
+    `create_frequency_matrix`: the rows are the cards, the columns are the positions in the deck (both starting at 1).
+
+    :param  counts: numpy array with shape (shuffles, positions, cards) or (positions, cards)
+            shuffle_index: index of the shuffle in `counts`, when counts holds several shuffles
+    :return pandas DataFrame with the number of decks holding each card on each position
+    """
+    if shuffle_index is not None:
+        counts = counts[shuffle_index]
+
+    df: pd.DataFrame = pd.DataFrame(counts.T.astype(int))
     df.columns += 1
     df.index += 1
-    
+
     return df
 
 
@@ -144,4 +464,239 @@ def winding_distance(deck: Deck, card: int):
         elem_to_suc += 1
         i = (i + 1) % len(deck)
     
-    return pre_to_elem + elem_to_suc - 1 
\ No newline at end of file
+    return pre_to_elem + elem_to_suc - 1 
+
+
+def winding_distances_batch(decks: np.ndarray) -> np.ndarray:
+    """
+    Batched version of `winding_distance`: the winding distance of every card, in every deck of a batch of decks, without a loop over the cards.
+
+    The winding distance of card c is the number of steps (going down the deck, and around from the bottom to the top) from its predecessor 
+    c - 1 to c, plus the number of steps from c to its successor c + 1, minus 1. Card n is the predecessor of card 1, and card 1 is the
+    successor of card n. The steps follow from the positions of the cards (the inverse permutation), as differences modulo n.
+
+    E.g.:
+        winding_distances_batch(np.array([[2, 1, 3, 4]])) --> array([[4, 4, 2, 2]])
+
+    :param  decks: numpy array with shape (..., n_cards), each deck holds the cards 1 to n_cards
+    :return numpy array with the same shape as `decks`. distances[..., c - 1] is the winding distance of card c
+    """
+    n_cards: int = decks.shape[-1]
+    positions: np.ndarray = inverse_permutation_batch(decks)
+
+    predecessor_positions: np.ndarray = np.roll(positions, 1, axis=-1)
+    successor_positions: np.ndarray = np.roll(positions, -1, axis=-1)
+
+    return (positions - predecessor_positions) % n_cards + (successor_positions - positions) % n_cards - 1
+
+
+def _premo_arrays(results) -> tuple:
+    """
+    Helper function that returns the shuffle numbers, top cards and decks of premo results as numpy arrays.
+    `results` is either the list of rows of `simulation.premo_simulation`, or the dict of arrays of `runner.collect_premo`.
+    """
+    if isinstance(results, dict):
+        top_cards: np.ndarray = np.asarray(results['top_card'])
+        decks: np.ndarray = np.asarray(results['deck'])
+        shuffles: np.ndarray = np.broadcast_to(np.arange(1, top_cards.shape[-1] + 1), top_cards.shape)
+        return shuffles.ravel(), top_cards.ravel(), decks.reshape(-1, decks.shape[-1])
+
+    shuffles: np.ndarray = np.fromiter((row['shuffle'] for row in results), dtype=int, count=len(results))
+    top_cards: np.ndarray = np.fromiter((row['top_card'] for row in results), dtype=int, count=len(results))
+    decks: np.ndarray = np.array([row['deck'].cards for row in results])
+    return shuffles, top_cards, decks
+
+
+def rank_premo_guesses(decks: np.ndarray, max_guesses: int) -> np.ndarray:
+    """
+    Guesses for the premo trick: for each deck, the `max_guesses` cards with the highest winding distance, highest first. The first g 
+    columns are the guesses when g cards may be guessed. Cards with the same winding distance are ranked by their position in the deck,
+    so the guesses are deterministic.
+
+    The cards are ranked once for all guess counts: np.argpartition selects the top `max_guesses` cards of each deck, and only these are sorted.
+
+    :param  decks: numpy array with shape (..., n_cards)
+            max_guesses: maximum number of guesses, at most n_cards
+    :return numpy array with shape (..., max_guesses), with the guessed cards
+    """
+    n_cards: int = decks.shape[-1]
+    if not 1 <= max_guesses <= n_cards:
+        raise ValueError(f"max_guesses should be between 1 and {n_cards}, got {max_guesses}.")
+
+    # Unique key per card: the winding distance, with the position in the deck (earlier is higher) as tie breaker
+    distances: np.ndarray = np.take_along_axis(winding_distances_batch(decks), decks.astype(np.intp) - 1, axis=-1)
+    keys: np.ndarray = distances.astype(np.int64) * n_cards + np.arange(n_cards - 1, -1, -1)
+
+    if max_guesses < n_cards:
+        top_positions: np.ndarray = np.argpartition(-keys, max_guesses - 1, axis=-1)[..., :max_guesses]
+    else:
+        top_positions: np.ndarray = np.broadcast_to(np.arange(n_cards), keys.shape)
+    order: np.ndarray = np.argsort(-np.take_along_axis(keys, top_positions, axis=-1), axis=-1)
+    top_positions = np.take_along_axis(top_positions, order, axis=-1)
+
+    return np.take_along_axis(decks, top_positions, axis=-1)
+
+
+def count_premo_hits(top_cards: np.ndarray, decks: np.ndarray, max_guesses: int) -> np.ndarray:
+    """
+    Counts, for each number of guesses g from 1 to `max_guesses`, how many times the top card is among the first g guesses of
+    `rank_premo_guesses`.
+
+    :param  top_cards: numpy array with shape (...), the top card that was moved in each deck
+            decks: numpy array with shape (..., n_cards)
+            max_guesses: maximum number of guesses
+    :return 1-D numpy array with shape (max_guesses,). hits[g - 1] is the number of correct guesses with g guesses
+    """
+    guesses: np.ndarray = rank_premo_guesses(decks, max_guesses).reshape(-1, max_guesses)
+    hit_at: np.ndarray = guesses == np.reshape(top_cards, (-1, 1))
+
+    return np.cumsum(hit_at.sum(axis=0))
+
+
+def wilson_interval(successes, trials, confidence: float = 0.95) -> tuple:
+    """
+    Wilson score confidence interval of a binomial proportion.
+
+    :param  successes: number of successes, a number or numpy array
+            trials: number of trials, a number or numpy array
+            confidence: confidence level of the interval
+    :return tuple (centre, half_width). The interval is centre - half_width to centre + half_width
+    """
+    z: float = NormalDist().inv_cdf(0.5 + confidence / 2)
+    proportion = successes / trials
+    centre = (proportion + z**2 / (2 * trials)) / (1 + z**2 / trials)
+    half_width = z * np.sqrt(proportion * (1 - proportion) / trials + z**2 / (4 * trials**2)) / (1 + z**2 / trials)
+    return centre, half_width
+
+
+def premo_hit_rates(results, max_guesses: int, confidence: float = 0.95) -> pd.DataFrame:
+    """
+    Hit rates of the premo trick, per shuffle number and number of guesses: the fraction of trials in which the top card is among the 
+    guessed cards (see `rank_premo_guesses`), with a Wilson score confidence interval.
+
+    E.g.: the hit rate after 3 shuffles with 1 guess
+        hit_rates = premo_hit_rates(simulation.premo_simulation(100000, 52, 10), max_guesses=5)
+        hit_rates.loc[(3, 1), 'hit_rate']
+
+    :param  results: the list of rows of `simulation.premo_simulation` (or `simulation.iter_premo_simulation`), or the dict of arrays 
+                     of `runner.collect_premo`
+            max_guesses: maximum number of guesses
+            confidence: confidence level of the interval
+    :return pd.DataFrame with a (shuffle, guesses) index, and the columns 'hits', 'trials', 'hit_rate', 'ci_lower' and 'ci_upper'
+    """
+    shuffles, top_cards, decks = _premo_arrays(results)
+    shuffle_numbers: np.ndarray = np.unique(shuffles)
+
+    hits: np.ndarray = np.array([count_premo_hits(top_cards[shuffles == s], decks[shuffles == s], max_guesses) for s in shuffle_numbers])
+    trials: np.ndarray = np.array([(shuffles == s).sum() for s in shuffle_numbers])[:, None].repeat(max_guesses, axis=1)
+
+    hit_rate: np.ndarray = hits / trials
+    centre, half_width = wilson_interval(hits, trials, confidence)
+
+    index: pd.MultiIndex = pd.MultiIndex.from_product([shuffle_numbers, range(1, max_guesses + 1)], names=['shuffle', 'guesses'])
+    return pd.DataFrame({
+        'hits': hits.ravel(),
+        'trials': trials.ravel(),
+        'hit_rate': hit_rate.ravel(),
+        'ci_lower': (centre - half_width).ravel(),
+        'ci_upper': (centre + half_width).ravel(),
+    }, index=index)
+
+
+if __name__ == "__main__":
+    # The Eulerian numbers from the recurrence should match the explicit formula
+    for n in range(1, 30):
+        for r in range(1, n + 1):
+            explicit = sum(((-1)**i) * math.comb(n+1, i) * ((r-i)**n) for i in range(0, r+1))
+            assert eulerian(n, r) == explicit
+        assert sum(eulerian_row(n)) == math.factorial(n)
+    assert eulerian(4, 0) == 0 and eulerian(4, 5) == 0
+
+    # The TVD sweep should match the TVD per (n, k)
+    tvd = theoretical_total_variation_distance_sweep([26, 52], range(1, 16), [2, 3])
+    for i, n in enumerate([26, 52]):
+        for j, k in enumerate(range(1, 16)):
+            for l, a in enumerate([2, 3]):
+                assert abs(tvd[i, j, l] - theoretical_total_variation_distance_riffle_shuffle(a, n, k, None, uniform(n))) < 1e-9
+    # After 7 riffle shuffles of a deck of 52 cards, the TVD is 0.334 (Bayer and Diaconis)
+    assert round(tvd[1, 6, 0], 3) == 0.334
+
+    # The log space Eulerian numbers and TVD should match the exact integers
+    for n in [1, 2, 10, 200]:
+        assert np.allclose(log_eulerian_row(n), [math.log(e) for e in eulerian_row(n)], rtol=1e-12, atol=1e-12)
+    exact = theoretical_total_variation_distance_sweep([1, 5, 52, 156], range(1, 21), [2, 3, 10])
+    assert np.abs(theoretical_total_variation_distance_sweep([1, 5, 52, 156], range(1, 21), [2, 3, 10], log_space=True) - exact).max() < 1e-11
+    large = theoretical_total_variation_distance_sweep([2000], [1, 12, 16, 30, 100], log_space=True)[0, :, 0]
+    assert large[0] > 1 - 1e-9 and (np.diff(large) < 0).all() and 0 <= large[-1] < 1e-12
+
+    # The vectorized frequency matrix should match a count per deck and position
+    np.random.seed(2023)
+    decks = np.array([[np.random.permutation(np.arange(1, 11)) for _ in range(4)] for _ in range(200)])
+    counts = count_card_positions(decks)
+    assert counts.shape == (4, 10, 10) and (counts.sum(axis=1) == 200).all() and (counts.sum(axis=2) == 200).all()
+    for s, d in [(0, 0), (3, 17)]:
+        for i, card in enumerate(decks[d, s]):
+            assert counts[s, i, card - 1] >= 1
+    df = create_frequency_matrix([Deck(d) for d in decks[:, 2]])
+    assert (df.values == counts[2].T).all() and list(df.index) == list(range(1, 11)) and list(df.columns) == list(range(1, 11))
+    assert (merge_card_position_counts([count_card_positions(decks[:50]), count_card_positions(decks[50:])]) == counts).all()
+    assert (count_card_positions(decks[50:], count_card_positions(decks[:50])) == counts).all()
+    assert df.loc[decks[0, 2, 0], 1] == (decks[:, 2, 0] == decks[0, 2, 0]).sum()
+    # The decks after a shuffle number are the same for a list of trials and for the array with the decks after 1 to 4 shuffles
+    trials = [[Deck(d) for d in trial] for trial in decks[:20]]
+    assert [d.cards.tolist() for d in extract_decks_per_shuffle_number(trials, 3)] == decks[:20, 2].tolist()
+
+    # The batched winding distances should match the winding distance of each card
+    distances = winding_distances_batch(decks[:20, 0])
+    for d, deck_distances in zip(decks[:20, 0], distances):
+        assert [winding_distance(Deck(d), card) for card in range(1, 11)] == deck_distances.tolist()
+    assert winding_distances_batch(np.array([[2, 1, 3, 4]])).tolist() == [[4, 4, 2, 2]]
+
+    # The premo guesses should match the guesses of the notebook: the cards with the largest winding distances
+    np.random.seed(2023)
+    import simulation
+    premo_results = simulation.premo_simulation(n_trials=200, n_cards_in_deck=20, max_riffle_shuffle=4)
+    _, premo_top_cards, premo_decks = _premo_arrays(premo_results)
+    guesses = rank_premo_guesses(premo_decks, 5)
+    for row, row_guesses in zip(premo_results, guesses):
+        distances = pd.Series({card: winding_distance(row['deck'], card) for card in row['deck']})
+        assert row_guesses.tolist() == distances.nlargest(5).index.tolist()
+    assert (rank_premo_guesses(premo_decks, 20)[:, :5] == guesses).all()
+    hit_rates = premo_hit_rates(premo_results, max_guesses=5)
+    assert hit_rates.shape == (20, 5) and (hit_rates['trials'] == 200).all()
+    for (shuffle, g), row in hit_rates.iterrows():
+        assert row['hits'] == sum(r['top_card'] in r_guesses[:g] for r, r_guesses in zip(premo_results, guesses) if r['shuffle'] == shuffle)
+        assert row['ci_lower'] <= row['hit_rate'] <= row['ci_upper']
+    assert (hit_rates['hits'].unstack().diff(axis=1).fillna(0) >= 0).all().all()
+
+    # The empirical TVD should match the TVD of the riffle shuffle notebook, computed per shuffle and r
+    rng = np.random.default_rng(2023)
+    n_cards, n_trials = 10, 2000
+    decks = np.stack([rng.permuted(np.tile(np.arange(1, n_cards + 1), (n_trials, 1)), axis=1)] + 
+                     [np.tile(np.arange(1, n_cards + 1), (n_trials, 1))], axis=1)
+    counts = rising_sequence_histogram(rising_sequences_batch(decks), n_cards)
+    assert counts.shape == (2, n_cards + 1) and (counts.sum(axis=1) == n_trials).all() and counts[1, 1] == n_trials
+    tvd = empirical_total_variation_distance(counts)
+    for s in range(2):
+        r_prob = counts[s, 1:] / n_trials
+        expected = sum(eulerian(n_cards, r) * abs(r_prob[r - 1] / eulerian(n_cards, r) - uniform(n_cards)) for r in range(1, n_cards + 1)) / 2
+        assert abs(tvd[s] - expected) < 1e-12
+    assert abs(tvd[1] - (1 - uniform(n_cards))) < 1e-12
+    assert (empirical_total_variation_distance([counts // 2, counts - counts // 2]) == tvd).all()
+    assert empirical_total_variation_distance(counts[0]) == tvd[0]
+    lower, upper = empirical_total_variation_distance_interval(counts, rng=np.random.default_rng(2023))
+    assert lower[0] < upper[0] and lower[1] == upper[1] == tvd[1]
+
+    # The empirical TVD is biased upwards when the true TVD is small, the basic bootstrap interval should still hold the theoretical TVD
+    import shuffles
+    rng = np.random.default_rng(2023)
+    k_values = [8, 10, 12, 13, 14]
+    decks = np.stack([shuffles.a_shuffle_batch(np.tile(np.arange(1, 53), (10000, 1)), 2, k, rng=rng) for k in k_values], axis=1)
+    counts = rising_sequence_histogram(rising_sequences_batch(decks), 52)
+    lower, upper = empirical_total_variation_distance_interval(counts, rng=rng)
+    theoretical = np.array([_theoretical_total_variation_distance(2, 52, k) for k in k_values])
+    assert (lower <= theoretical).all() and (theoretical <= upper).all()
+    assert empirical_total_variation_distance(counts)[-1] > 2 * theoretical[-1]
+    bootstrap = empirical_total_variation_distance_bootstrap(counts, rng=np.random.default_rng(2023))
+    assert (bootstrap['lower'] <= bootstrap['tvd']).all() and (bootstrap['tvd'] <= bootstrap['upper']).all()
+    assert (bootstrap['tvd'] < bootstrap['empirical_tvd']).all() and (bootstrap['half_width'] >= (bootstrap['upper'] - bootstrap['lower']) / 2).all()
@@ -0,0 +1,190 @@
+import json
+import os
+from pathlib import Path
+import numpy as np
+from deck import card_dtype
+from runner import collect_decks
+
+
+METADATA_FILE_NAME = "metadata.json"
+
+
+class ResultStore:
+    """
+    On-disk store for the decks of a simulation, as an alternative to keeping (or pickling) lists of Deck objects.
+
+    A store is a folder with a small sidecar file (metadata.json) and one .npy file per appended chunk of trials. The sidecar holds the
+    number of cards, the recorded shuffle numbers, the dtype, the number of trials per chunk, and free metadata such as the config and seed.
+    The cards are stored with the smallest dtype that fits them (see `deck.card_dtype`), in the layout (shuffles, trials, cards), so that
+    the decks after one shuffle number are contiguous in each chunk file. When a store is opened, the chunks are memory-mapped:
+    reading the decks after one shuffle number only reads that slice from disk.
+
+    E.g.: store the decks after every 100th overhand shuffle, and count the card positions after 2700 shuffles:
+        store = ResultStore.create("../results/overhand", N_CARDS, range(100, 2801, 100), config=overhand_shuffle_cfg, seed=RANDOM_SEED)
+        store.write_simulation(simulation.iter_overhand_shuffle_simulation(N_TRIALS, N_CARDS, 2800, p=P, stride=100, chunk_size=1000, vectorized=True))
+
+        store = ResultStore.open("../results/overhand")
+        df = stats.create_frequency_matrix(stats.extract_decks_per_shuffle_number(store, 2700))
+    """
+    def __init__(self, path, metadata: dict):
+        self.path: Path = Path(path)
+        self.metadata: dict = metadata
+
+    @classmethod
+    def create(cls, path, n_cards_in_deck: int, shuffle_numbers, **metadata):
+        """
+        Creates a new, empty store in the folder `path`.
+
+        :param  path: folder of the store. It is created if it does not exist, and should not hold a store yet
+                n_cards_in_deck: number of cards in the deck
+                shuffle_numbers: the shuffle numbers after which the decks are recorded, in the order of the recorded decks
+                **metadata: extra metadata to keep in the sidecar file, e.g. config and seed. Should be serializable to JSON
+        :return ResultStore
+        """
+        path = Path(path)
+        if (path / METADATA_FILE_NAME).exists():
+            raise FileExistsError(f"There is already a result store in '{path}'.")
+        path.mkdir(parents=True, exist_ok=True)
+
+        store = cls(path, {
+            'n_cards': int(n_cards_in_deck),
+            'shuffle_numbers': [int(s) for s in shuffle_numbers],
+            'dtype': np.dtype(card_dtype(n_cards_in_deck)).name,
+            'layout': ['shuffle', 'trial', 'card'],
+            'chunks': [],
+            **metadata,
+        })
+        store._write_metadata()
+        return store
+
+    @classmethod
+    def open(cls, path):
+        """
+        Opens an existing store. The chunks are only read from disk when they are used.
+        """
+        with open(Path(path) / METADATA_FILE_NAME, "r") as f:
+            return cls(path, json.load(f))
+
+    def _write_metadata(self) -> None:
+        """
+        Writes the sidecar file. It is first written to a temporary file and then renamed, so it always describes complete chunks.
+        """
+        temporary_path: Path = self.path / (METADATA_FILE_NAME + ".tmp")
+        with open(temporary_path, "w") as f:
+            json.dump(self.metadata, f, indent=2)
+        os.replace(temporary_path, self.path / METADATA_FILE_NAME)
+
+    @property
+    def n_cards(self) -> int:
+        return self.metadata['n_cards']
+
+    @property
+    def shuffle_numbers(self) -> list:
+        return self.metadata['shuffle_numbers']
+
+    @property
+    def n_trials(self) -> int:
+        return sum(chunk['n_trials'] for chunk in self.metadata['chunks'])
+
+    def __len__(self) -> int:
+        return self.n_trials
+
+    def __repr__(self) -> str:
+        return f"ResultStore('{self.path}', n_trials={self.n_trials}, n_cards={self.n_cards}, n_shuffles={len(self.shuffle_numbers)})"
+
+    def append(self, chunk) -> None:
+        """
+        Appends a chunk of trials to the store, as a new chunk file.
+
+        :param  chunk: a chunk of trials as yielded by one of the simulation generators (see `runner.collect_decks`), with the decks
+                       after the shuffle numbers of the store
+        """
+        decks: np.ndarray = collect_decks(chunk)
+        expected_shape: tuple = (len(self.shuffle_numbers), self.n_cards)
+        if decks.ndim != 3 or decks.shape[1:] != expected_shape:
+            raise ValueError(f"Expected decks with shape (trials, {expected_shape[0]}, {expected_shape[1]}), got {decks.shape}.")
+
+        file_name: str = f"chunk_{len(self.metadata['chunks']):05d}.npy"
+        np.save(self.path / file_name, np.ascontiguousarray(decks.transpose(1, 0, 2), dtype=self.metadata['dtype']))
+
+        self.metadata['chunks'].append({'file': file_name, 'n_trials': len(decks)})
+        self._write_metadata()
+
+    def write_simulation(self, chunks) -> None:
+        """
+        Appends all chunks yielded by a simulation generator, e.g. `simulation.iter_riffle_shuffle_simulation(..., chunk_size=10000)`.
+        Only one chunk is in memory at a time.
+        """
+        for chunk in chunks:
+            self.append(chunk)
+
+    def _load_chunk(self, chunk: dict) -> np.ndarray:
+        """
+        Memory-maps one chunk file, with shape (shuffles, trials, cards).
+        """
+        return np.load(self.path / chunk['file'], mmap_mode='r')
+
+    def _shuffle_index(self, shuffle_number: int) -> int:
+        if shuffle_number not in self.shuffle_numbers:
+            raise ValueError(f"The decks after shuffle {shuffle_number} are not recorded in this store.")
+        return self.shuffle_numbers.index(shuffle_number)
+
+    def iter_shuffle_slice(self, shuffle_number: int):
+        """
+        Yields, for each chunk, the decks after shuffle number `shuffle_number`, as a memory-mapped array with shape (trials in chunk, cards).
+        """
+        shuffle_index: int = self._shuffle_index(shuffle_number)
+        for chunk in self.metadata['chunks']:
+            yield self._load_chunk(chunk)[shuffle_index]
+
+    def shuffle_slice(self, shuffle_number: int) -> np.ndarray:
+        """
+        Returns the decks of all trials after shuffle number `shuffle_number`, as an array with shape (trials, cards).
+        Only this slice is read from disk. With a single chunk, the memory-mapped array itself is returned.
+        """
+        slices: list = list(self.iter_shuffle_slice(shuffle_number))
+        if len(slices) == 1:
+            return slices[0]
+        return np.concatenate(slices) if slices else np.empty((0, self.n_cards), dtype=self.metadata['dtype'])
+
+    def iter_chunks(self):
+        """
+        Yields each chunk as a memory-mapped array with shape (trials in chunk, shuffles, cards), the layout of the vectorized simulation
+        generators. The chunks can be passed to the reducers in runner.py, e.g. `runner.count_rising_sequences`.
+        """
+        for chunk in self.metadata['chunks']:
+            yield self._load_chunk(chunk).transpose(1, 0, 2)
+
+
+if __name__ == "__main__":
+    import tempfile
+    import simulation
+    import stats
+
+    with tempfile.TemporaryDirectory() as folder:
+        rng = np.random.default_rng(2023)
+        decks = next(simulation.iter_overhand_shuffle_simulation(250, 20, 30, p=0.25, stride=10, chunk_size=250, vectorized=True, rng=rng))
+
+        store = ResultStore.create(Path(folder) / "overhand", 20, [10, 20, 30], config={'p': 0.25}, seed=2023)
+        store.append(decks[:100])
+        store.append(decks[100:])
+        # Non-vectorized chunks (lists of trials with Decks) can be appended as well
+        store.write_simulation(simulation.iter_riffle_shuffle_simulation(5, 20, 30, stride=10, chunk_size=3))
+
+        store = ResultStore.open(Path(folder) / "overhand")
+        assert store.n_trials == 255 and store.metadata['seed'] == 2023 and store.metadata['config'] == {'p': 0.25}
+        assert store.metadata['dtype'] == 'uint8'
+        assert (store.shuffle_slice(20)[:250] == decks[:, 1]).all() and store.shuffle_slice(20).shape == (255, 20)
+        assert isinstance(next(store.iter_shuffle_slice(30)), np.memmap)
+        assert (np.concatenate(list(store.iter_chunks()))[:250] == decks).all()
+
+        # The frequency matrix from the store should match the one from the decks in memory
+        df = stats.create_frequency_matrix(stats.extract_decks_per_shuffle_number(store, 30))
+        assert (df.values == stats.create_frequency_matrix(np.concatenate([decks[:, 2], store.shuffle_slice(30)[250:]])).values).all()
+        assert df.values.sum() == 255 * 20
+
+        try:
+            store.shuffle_slice(15)
+            assert False
+        except ValueError:
+            pass
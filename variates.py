@@ -0,0 +1,108 @@
+import numpy as np
+
+
+DEFAULT_BLOCK_SIZE = 8192
+
+
+class RandomVariatePool:
+    """
+    Source of random numbers for the shuffles, that draws the random numbers in blocks instead of one at a time.
+
+    The non-vectorized shuffles draw a single random number per call, e.g. `gsr.drop_from_left_stack` draws one uniform per card and
+    `shuffles.overhand_shuffle` one binomial per clump. Each call to numpy has an overhead of about a microsecond, more than the work it
+    drives. The pool draws `block_size` numbers at once from a numpy.random.Generator, for each kind of random number (uniforms, and
+    binomials and bounded integers per set of parameters), and hands them out one by one. A block is refilled when it is used up.
+
+    The pool has the same methods as a numpy.random.Generator (random, binomial, integers, geometric, ...), and randint as the np.random module,
+    so it can be passed as `rng` to the functions in gsr.py and shuffles.py and the simulations in simulation.py. Calls with a `size` are
+    passed on to the generator. The random numbers only depend on the seed and the calls, so the results are reproducible for a given seed.
+    They are different from the numbers drawn by the generator itself.
+
+    E.g.:
+        rng = RandomVariatePool(RANDOM_SEED)
+        results = simulation.overhand_shuffle_simulation(N_TRIALS, N_CARDS, MAX_OVERHAND_SHUFFLES, p=P, rng=rng)
+    """
+    def __init__(self, seed=None, block_size: int = DEFAULT_BLOCK_SIZE):
+        """
+        :param  seed: seed for np.random.default_rng, or a numpy.random.Generator
+                block_size: number of random numbers drawn at once, for each kind of random number
+        """
+        self.generator: np.random.Generator = np.random.default_rng(seed)
+        self.block_size: int = block_size
+        self._uniforms = iter(())
+        self._binomials: dict = {}
+        self._integers: dict = {}
+
+    def __getattr__(self, name: str):
+        # Other methods, e.g. permutation or multinomial, are those of the generator
+        if name == 'generator':
+            raise AttributeError(name)
+        return getattr(self.generator, name)
+
+    def random(self, size=None):
+        """
+        Returns a uniform random number in [0, 1), or an array of them, like numpy.random.Generator.random.
+        """
+        if size is not None:
+            return self.generator.random(size)
+        try:
+            return next(self._uniforms)
+        except StopIteration:
+            self._uniforms = iter(self.generator.random(self.block_size).tolist())
+            return next(self._uniforms)
+
+    def binomial(self, n, p, size=None):
+        """
+        Returns a binomial random number with parameters n and p, or an array of them, like numpy.random.Generator.binomial.
+        """
+        if size is not None:
+            return self.generator.binomial(n, p, size)
+        key: tuple = (n, p)
+        try:
+            return next(self._binomials[key])
+        except (KeyError, StopIteration):
+            self._binomials[key] = iter(self.generator.binomial(n, p, self.block_size).tolist())
+            return next(self._binomials[key])
+
+    def integers(self, low, high=None, size=None):
+        """
+        Returns a random integer in [low, high), or in [0, low) when high is None, or an array of them, like numpy.random.Generator.integers.
+        """
+        if size is not None:
+            return self.generator.integers(low, high, size)
+        key: tuple = (low, high)
+        try:
+            return next(self._integers[key])
+        except (KeyError, StopIteration):
+            self._integers[key] = iter(self.generator.integers(low, high, self.block_size).tolist())
+            return next(self._integers[key])
+
+    def randint(self, low, high=None, size=None):
+        """
+        Same as `integers`, with the name of the np.random module.
+        """
+        return self.integers(low, high, size)
+
+
+if __name__ == "__main__":
+    from deck import Deck
+    import shuffles
+    import simulation
+
+    # The random numbers are reproducible for a given seed, and have the right distribution
+    first, second = RandomVariatePool(2023, block_size=100), RandomVariatePool(2023, block_size=100)
+    draws = [(first.random(), first.binomial(52, 0.5), first.integers(0, 52), first.randint(10)) for _ in range(1000)]
+    assert draws == [(second.random(), second.binomial(52, 0.5), second.integers(0, 52), second.randint(10)) for _ in range(1000)]
+    uniforms, binomials, integers, small_integers = map(np.array, zip(*draws))
+    assert 0 <= uniforms.min() and uniforms.max() < 1 and abs(uniforms.mean() - 0.5) < 0.05
+    assert abs(binomials.mean() - 26) < 0.5 and integers.min() == 0 and integers.max() == 51 and set(small_integers) == set(range(10))
+    assert first.random((3, 4)).shape == (3, 4) and first.binomial(10, 0.5, size=5).shape == (5,) and first.geometric(0.5) >= 1
+
+    # The pool can be used by the shuffles and the simulations instead of the global random state
+    deck = Deck().init_new_deck(52)
+    assert sorted(shuffles.overhand_shuffle(deck, p=0.25, rng=RandomVariatePool(2023)).cards) == list(range(1, 53))
+    trials = simulation.riffle_shuffle_simulation(20, 52, 5, rng=RandomVariatePool(2023))
+    assert [[d.cards.tolist() for d in trial] for trial in trials] == \
+           [[d.cards.tolist() for d in trial] for trial in simulation.riffle_shuffle_simulation(20, 52, 5, rng=RandomVariatePool(2023))]
+    assert len(simulation.premo_simulation(10, 52, 3, rng=RandomVariatePool(2023))) == 30
+    assert len(simulation.top_in_at_random_shuffle_simulation(10, 10, rng=RandomVariatePool(2023))) == 10